@@ -0,0 +1,273 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Columnar, memory-mappable layout of the normalized dataset.
+
+Every record type is stored in its own directory with a ``meta.json``
+and one raw little-endian file per column:
+
+* ``int`` columns are ``<i8`` arrays, nullable ones come with a
+  ``<name>.null`` ``u1`` mask;
+* ``datetime`` columns are ``<i8`` microseconds since the Unix epoch,
+  in UTC;
+* ``str`` columns are a ``<name>.offsets`` ``<i8`` array of nrows + 1
+  offsets into the ``<name>.data`` UTF-8 blob.
+
+Readers memory-map the files and decode only the rows of the batch
+they are asked for.
+"""
+
+
+import datetime
+import json
+import os
+import typing
+
+import numpy as np
+
+
+# Record type -> column -> kind, for the layout of dataset.json.
+DATASET_COLUMNS = {
+    'person': {
+        'id': 'int',
+        'first_name': 'str',
+        'middle_name': 'str',
+        'last_name': 'str',
+        'image': 'str',
+        'bio': 'str',
+    },
+    'user': {
+        'id': 'int',
+        'name': 'str',
+        'image': 'str',
+    },
+    'movie': {
+        'id': 'int',
+        'image': 'str',
+        'title': 'str',
+        'year': 'int',
+        'description': 'str',
+    },
+    'directors': {
+        'list_order': 'int?',
+        'person_id': 'int',
+        'movie_id': 'int',
+    },
+    'cast': {
+        'list_order': 'int?',
+        'person_id': 'int',
+        'movie_id': 'int',
+    },
+    'review': {
+        'id': 'int',
+        'body': 'str',
+        'rating': 'int',
+        'creation_time': 'datetime',
+        'author_id': 'int',
+        'movie_id': 'int',
+    },
+}
+
+# Rows buffered per table before they are appended to the files.
+FLUSH_ROWS = 10_000
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _to_micros(value) -> int:
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return (value - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+class TableWriter:
+
+    def __init__(self, path, columns: typing.Dict[str, str]):
+        self.path = path
+        self.columns = columns
+        self.nrows = 0
+        self.buffers = {name: [] for name in columns}
+        self.files = {}
+        self.str_offsets = {}
+
+        os.makedirs(path, exist_ok=True)
+        for name, kind in columns.items():
+            self.files[name] = open(self._file(name), 'wb')
+            if kind == 'int?':
+                self.files[f'{name}.null'] = open(
+                    self._file(f'{name}.null'), 'wb')
+            elif kind == 'str':
+                self.files[f'{name}.data'] = open(
+                    self._file(f'{name}.data'), 'wb')
+                self.str_offsets[name] = 0
+
+        for name, kind in columns.items():
+            if kind == 'str':
+                # Offsets start with the beginning of the first string.
+                self.files[name].write(np.zeros(1, '<i8').tobytes())
+
+    def _file(self, name):
+        if self.columns.get(name) == 'str':
+            name = f'{name}.offsets'
+        return os.path.join(self.path, name)
+
+    def append(self, record: dict):
+        for name, buf in self.buffers.items():
+            buf.append(record.get(name))
+        self.nrows += 1
+        if len(next(iter(self.buffers.values()))) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        for name, kind in self.columns.items():
+            values = self.buffers[name]
+            if not values:
+                continue
+            f = self.files[name]
+            if kind == 'int':
+                f.write(np.array(values, '<i8').tobytes())
+            elif kind == 'int?':
+                mask = np.array([v is None for v in values], 'u1')
+                ints = np.array(
+                    [0 if v is None else v for v in values], '<i8')
+                f.write(ints.tobytes())
+                self.files[f'{name}.null'].write(mask.tobytes())
+            elif kind == 'datetime':
+                f.write(np.array(
+                    [_to_micros(v) for v in values], '<i8').tobytes())
+            elif kind == 'str':
+                encoded = [v.encode() for v in values]
+                lengths = np.fromiter(
+                    (len(e) for e in encoded), '<i8', len(encoded))
+                offsets = self.str_offsets[name] + np.cumsum(lengths)
+                self.files[f'{name}.data'].write(b''.join(encoded))
+                f.write(offsets.tobytes())
+                self.str_offsets[name] = int(offsets[-1])
+            else:
+                raise ValueError(f'unsupported column kind: {kind!r}')
+            values.clear()
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        with open(os.path.join(self.path, 'meta.json'), 'wt') as f:
+            json.dump({'nrows': self.nrows, 'columns': self.columns}, f)
+
+
+class DatasetWriter:
+    """Write records of the normalized dataset as they are produced."""
+
+    def __init__(self, path, columns=DATASET_COLUMNS):
+        self.path = path
+        self.tables = {
+            rtype: TableWriter(os.path.join(path, rtype), cols)
+            for rtype, cols in columns.items()
+        }
+
+    def write(self, rtype: str, record: dict):
+        self.tables[rtype].append(record)
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Table:
+    """Memory-mapped columns of a single record type."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'rt') as f:
+            meta = json.load(f)
+        self.nrows = meta['nrows']
+        self.columns = meta['columns']
+        self._arrays = {}
+
+        def mmap(name, dtype, n):
+            if n == 0:
+                return np.zeros(0, dtype)
+            return np.memmap(
+                os.path.join(path, name), dtype=dtype, mode='r', shape=(n,))
+
+        for name, kind in self.columns.items():
+            if kind == 'str':
+                self._arrays[name] = mmap(
+                    f'{name}.offsets', '<i8', self.nrows + 1)
+                data_path = os.path.join(path, f'{name}.data')
+                if os.path.getsize(data_path):
+                    self._arrays[f'{name}.data'] = np.memmap(
+                        data_path, dtype='u1', mode='r')
+                else:
+                    self._arrays[f'{name}.data'] = np.zeros(0, 'u1')
+            else:
+                self._arrays[name] = mmap(name, '<i8', self.nrows)
+                if kind == 'int?':
+                    self._arrays[f'{name}.null'] = mmap(
+                        f'{name}.null', 'u1', self.nrows)
+
+    def __len__(self):
+        return self.nrows
+
+    def column(self, name, start=0, stop=None) -> list:
+        """Decode rows [start, stop) of a column into Python values."""
+        stop = self.nrows if stop is None else min(stop, self.nrows)
+        kind = self.columns[name]
+        values = self._arrays[name]
+
+        if kind == 'int':
+            return values[start:stop].tolist()
+        elif kind == 'int?':
+            nulls = self._arrays[f'{name}.null'][start:stop].tolist()
+            return [
+                None if null else v
+                for v, null in zip(values[start:stop].tolist(), nulls)
+            ]
+        elif kind == 'datetime':
+            return [
+                _EPOCH + datetime.timedelta(microseconds=us)
+                for us in values[start:stop].tolist()
+            ]
+        elif kind == 'str':
+            offsets = values[start:stop + 1]
+            base = int(offsets[0])
+            blob = bytes(self._arrays[f'{name}.data'][base:int(offsets[-1])])
+            bounds = (offsets - base).tolist()
+            return [
+                blob[a:b].decode() for a, b in zip(bounds, bounds[1:])
+            ]
+        else:
+            raise ValueError(f'unsupported column kind: {kind!r}')
+
+    def iter_rows(self, columns: typing.List[str], batch_size=FLUSH_ROWS):
+        """Yield tuples of the given columns, decoded a batch at a time."""
+        for start in range(0, self.nrows, batch_size):
+            stop = start + batch_size
+            yield from zip(*[self.column(c, start, stop) for c in columns])
+
+
+class Dataset:
+    """Memory-mapped normalized dataset, written by DatasetWriter."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tables = {
+            rtype: Table(os.path.join(path, rtype))
+            for rtype in sorted(os.listdir(path))
+            if os.path.exists(os.path.join(path, rtype, 'meta.json'))
+        }
+
+    def __getitem__(self, rtype) -> Table:
+        return self.tables[rtype]
@@ -11,6 +11,8 @@ from django.test.client import RequestFactory
 import json
 import random
 
+import _idsample
+
 from . import bootstrap  # NoQA
 
 from . import models
@@ -44,30 +46,26 @@ def close(ctx, db):
 
 
 def load_ids(ctx, db):
-    users = models.User.objects.raw('''
-        SELECT * FROM _django_user ORDER BY random() LIMIT %s
-    ''', [ctx.number_of_ids])
-
-    movies = models.Movie.objects.raw('''
-        SELECT * FROM _django_movie ORDER BY random() LIMIT %s
-    ''', [ctx.number_of_ids])
-
-    people = models.Person.objects.raw('''
-        SELECT * FROM _django_person ORDER BY random() LIMIT %s
-    ''', [ctx.number_of_ids])
+    with connection.cursor() as cur:
+        ids = _idsample.sample_tables(ctx, cur, 'django_bench', {
+            'users': ('_django_user', 'id'),
+            'movies': ('_django_movie', 'id'),
+            'people': ('_django_person', 'id'),
+        })
+    users, movies, people = ids['users'], ids['movies'], ids['people']
 
     return dict(
-        get_user=[d.id for d in users],
-        get_movie=[d.id for d in movies],
-        get_person=[d.id for d in people],
+        get_user=[d[0] for d in users],
+        get_movie=[d[0] for d in movies],
+        get_person=[d[0] for d in people],
         # re-use user IDs for update tests
-        update_movie=[d.id for d in movies],
+        update_movie=[d[0] for d in movies],
         # generate as many insert stubs as "concurrency" to
         # accommodate concurrent inserts
         insert_user=[INSERT_PREFIX] * ctx.concurrency,
         insert_movie=[{
             'prefix': INSERT_PREFIX,
-            'people': [p.id for p in people[:4]],
+            'people': [p[0] for p in people[:4]],
         }] * ctx.concurrency,
         insert_movie_plus=[INSERT_PREFIX] * ctx.concurrency,
     )
@@ -10,13 +10,198 @@ import argparse
 import asyncio
 import edgedb
 import json
-import progress.bar
+import random
+import time
 import uvloop
 
 
-async def import_data(data: dict):
-    concurrency = 32
+PEOPLE_QUERY = r'''
+    WITH people := <json>$data
+    FOR person IN json_array_unpack(people) UNION (
+    INSERT Person {
+        first_name := <str>person['first_name'],
+        middle_name := <str>person['middle_name'],
+        last_name := <str>person['last_name'],
+        image := <str>person['image'],
+        bio := <str>person['bio'],
+    });
+'''
+
+USERS_QUERY = r'''
+    WITH users := <json>$data
+    FOR user IN json_array_unpack(users) UNION (
+    INSERT User {
+        name := <str>user['name'],
+        image := <str>user['image'],
+    });
+'''
+
+ORDERED_MOVIES_QUERY = r'''
+    WITH movies := <json>$data
+    FOR movie in json_array_unpack(movies) UNION (
+    INSERT Movie {
+        title := <str>movie['title'],
+        description := <str>movie['description'],
+        year := <int64>movie['year'],
+        image := <str>movie['image'],
+
+        directors := (
+            FOR X IN {
+                enumerate(array_unpack(
+                    <array<str>>movie['directors']
+                ))
+            }
+            UNION (
+                SELECT Person {@list_order := X.0}
+                FILTER .image = X.1
+            )
+        ),
+        cast := (
+            FOR X IN {
+                enumerate(array_unpack(
+                    <array<str>>movie['cast']
+                ))
+            }
+            UNION (
+                SELECT Person {@list_order := X.0}
+                FILTER .image = X.1
+            )
+        )
+    });
+'''
+
+UNORDERED_MOVIES_QUERY = r'''
+    WITH movies := <json>$data
+    FOR movie in json_array_unpack(movies) UNION (
+    INSERT Movie {
+        title := <str>movie['title'],
+        description := <str>movie['description'],
+        year := <int64>movie['year'],
+        image := <str>movie['image'],
+
+        directors := (
+            FOR X IN {
+                enumerate(array_unpack(
+                    <array<str>>movie['directors']
+                ))
+            }
+            UNION (
+                SELECT Person {@list_order := X.0}
+                FILTER .image = X.1
+            )
+        ),
+        cast := (
+            FOR X IN {
+                enumerate(array_unpack(
+                    <array<str>>movie['cast']
+                ))
+            }
+            UNION (
+                SELECT Person
+                FILTER .image = X.1
+            )
+        )
+    });
+'''
+
+REVIEWS_QUERY = r'''
+    WITH reviews := <json>$data
+    FOR review in json_array_unpack(reviews) UNION (
+    INSERT Review {
+        body := <str>review['body'],
+        rating := <int64>review['rating'],
+        author := (SELECT User FILTER .image = <str>review['uimage'] LIMIT 1),
+        movie := (SELECT Movie FILTER .image = <str>review['mimage'] LIMIT 1),
+        creation_time := <cal::local_datetime><str>review['creation_time'],
+    });
+'''
+
+
+class BatchLoader:
+    """Insert the rows of one type in concurrent batches.
+
+    Batches of all loaders share a limit of in-flight queries.  The
+    batch size adapts to keep every query close to TARGET_BATCH_TIME:
+    large batches hold locks for long and conflict more, small ones
+    waste round trips.  The client retries transaction conflicts on its
+    own; batches that still fail are split in half, and each half is
+    retried after a backoff.
+    """
+
+    TARGET_BATCH_TIME = 1.0
+    MIN_BATCH_SIZE = 10
+    MAX_BATCH_SIZE = 10000
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, client, label, query, rows, *,
+                 limit: asyncio.Semaphore, batch_size: int):
+        self.client = client
+        self.label = label
+        self.query = query
+        self.rows = rows
+        self.limit = limit
+        self.batch_size = batch_size
+        self.retries = 0
+
+    async def _insert(self, batch, attempt=0):
+        # Called with a slot of self.limit acquired.
+        try:
+            start = time.monotonic()
+            try:
+                await self.client.query(self.query, data=json.dumps(batch))
+            except edgedb.TransactionConflictError:
+                if attempt == self.MAX_ATTEMPTS - 1:
+                    raise
+            else:
+                self._adapt(len(batch), time.monotonic() - start)
+                return
+        finally:
+            self.limit.release()
+
+        self.retries += 1
+        self.batch_size = max(self.MIN_BATCH_SIZE, self.batch_size // 2)
+        await asyncio.sleep(min(2 ** attempt * 0.1, 5) * random.random())
+
+        mid = len(batch) // 2
+        tasks = []
+        for half in (batch[:mid], batch[mid:]):
+            if half:
+                await self.limit.acquire()
+                tasks.append(asyncio.create_task(
+                    self._insert(half, attempt + 1)))
+        await asyncio.gather(*tasks)
+
+    def _adapt(self, size, elapsed):
+        if size < self.batch_size:
+            # A short tail batch says nothing about the current size.
+            return
+        if elapsed < self.TARGET_BATCH_TIME / 2:
+            self.batch_size = min(self.MAX_BATCH_SIZE, self.batch_size * 2)
+        elif elapsed > self.TARGET_BATCH_TIME * 2:
+            self.batch_size = max(self.MIN_BATCH_SIZE, self.batch_size // 2)
+
+    async def run(self):
+        start = time.monotonic()
+        tasks = []
+        pos = 0
+        while pos < len(self.rows):
+            await self.limit.acquire()
+            batch = self.rows[pos:pos + self.batch_size]
+            pos += len(batch)
+            tasks.append(asyncio.create_task(self._insert(batch)))
+
+        await asyncio.gather(*tasks)
+
+        elapsed = time.monotonic() - start
+        rate = len(self.rows) / elapsed if elapsed else 0
+        print(f'{self.label:<16} {len(self.rows):>10} rows in '
+              f'{elapsed:7.1f}s ({rate:,.0f} rows/s, '
+              f'{self.retries} retries)')
+
+
+async def import_data(data: dict, *, concurrency: int, batch_size: int):
     client = edgedb.create_async_client(max_concurrency=concurrency)
+    limit = asyncio.Semaphore(concurrency)
 
     users = data['user']
     reviews = data['review']
@@ -27,24 +212,6 @@ async def import_data(data: dict):
     for cat in ['user', 'person', 'movie']:
         id2image_maps[cat] = {r['id']: r['image'] for r in data[cat]}
 
-    batch_size = 1000
-
-    movies_data = [
-        dict(
-            _id=m['id'],
-            title=m['title'],
-            description=m['description'],
-            year=m['year'],
-            image=m['image'],
-            directors=id2image(id2image_maps['person'], m['directors']),
-            cast=id2image(id2image_maps['person'], m['cast']),
-        ) for m in movies]
-    ordered = [m for m in movies_data if m['_id'] % 10]
-    unordered = [m for m in movies_data if not m['_id'] % 10]
-
-    #################
-    ## LOAD PEOPLE ##
-    #################
     people_data = [
         dict(
             first_name=p['first_name'],
@@ -55,32 +222,6 @@ async def import_data(data: dict):
         ) for p in people
     ]
 
-    ppl_insert_query = r'''
-        WITH people := <json>$people
-        FOR person IN json_array_unpack(people) UNION (
-        INSERT Person {
-            first_name := <str>person['first_name'],
-            middle_name := <str>person['middle_name'],
-            last_name := <str>person['last_name'],
-            image := <str>person['image'],
-            bio := <str>person['bio'],
-        });
-    '''
-
-    start = 0
-    people_bar = progress.bar.Bar("Person", max=len(people))
-    people_slice = people_data[start:start+batch_size]
-    while len(people_slice):
-        people_bar.goto(start)
-        await client.query(ppl_insert_query, people=json.dumps(people_slice))
-        start += batch_size
-        people_slice = people_data[start:start+batch_size]
-    people_bar.goto(people_bar.max)
-    people_bar.finish()
-
-    ################
-    ## LOAD USERS ##
-    ################
     users_data = [
         dict(
             name=u['name'],
@@ -88,29 +229,6 @@ async def import_data(data: dict):
         ) for u in users
     ]
 
-    users_insert_query = r'''
-        WITH users := <json>$users
-        FOR user IN json_array_unpack(users) UNION (
-        INSERT User {
-            name := <str>user['name'],
-            image := <str>user['image'],
-        });
-    '''
-
-    start = 0
-    users_bar = progress.bar.Bar("User", max=len(users))
-    users_slice = users_data[start:start+batch_size]
-    while len(users_slice):
-        users_bar.goto(start)
-        await client.query(users_insert_query, users=json.dumps(users_slice))
-        start += batch_size
-        users_slice = users_data[start:start+batch_size]
-    users_bar.goto(users_bar.max)
-    users_bar.finish()
-
-    #################
-    ## LOAD MOVIES ##
-    #################
     movies_data = [
         dict(
             _id=m['id'],
@@ -125,99 +243,6 @@ async def import_data(data: dict):
     ordered = [m for m in movies_data if m['_id'] % 10]
     unordered = [m for m in movies_data if not m['_id'] % 10]
 
-    start = 0
-    movie_bar = progress.bar.Bar("Movie", max=len(movies))
-    total_movies = 0
-    ordered_slice = ordered[start:start+batch_size]
-    while len(ordered_slice):
-        movie_bar.goto(total_movies)
-
-        await client.query(r'''
-            WITH movies := <json>$movies
-            FOR movie in json_array_unpack(movies) UNION (
-            INSERT Movie {
-                title := <str>movie['title'],
-                description := <str>movie['description'],
-                year := <int64>movie['year'],
-                image := <str>movie['image'],
-
-                directors := (
-                    FOR X IN {
-                        enumerate(array_unpack(
-                            <array<str>>movie['directors']
-                        ))
-                    }
-                    UNION (
-                        SELECT Person {@list_order := X.0}
-                        FILTER .image = X.1
-                    )
-                ),
-                cast := (
-                    FOR X IN {
-                        enumerate(array_unpack(
-                            <array<str>>movie['cast']
-                        ))
-                    }
-                    UNION (
-                        SELECT Person {@list_order := X.0}
-                        FILTER .image = X.1
-                    )
-                )
-            });
-        ''', movies=json.dumps(ordered_slice))
-        start += batch_size
-        total_movies += batch_size
-        ordered_slice = ordered[start:start+batch_size]
-
-    start = 0
-    batch_size = 100
-    unordered_slice = unordered[start:start+batch_size]
-    while len(unordered_slice):
-        movie_bar.goto(total_movies)
-        await client.query(r'''
-            WITH movies := <json>$movies
-            FOR movie in json_array_unpack(movies) UNION (
-            INSERT Movie {
-                title := <str>movie['title'],
-                description := <str>movie['description'],
-                year := <int64>movie['year'],
-                image := <str>movie['image'],
-
-                directors := (
-                    FOR X IN {
-                        enumerate(array_unpack(
-                            <array<str>>movie['directors']
-                        ))
-                    }
-                    UNION (
-                        SELECT Person {@list_order := X.0}
-                        FILTER .image = X.1
-                    )
-                ),
-                cast := (
-                    FOR X IN {
-                        enumerate(array_unpack(
-                            <array<str>>movie['cast']
-                        ))
-                    }
-                    UNION (
-                        SELECT Person
-                        FILTER .image = X.1
-                    )
-                )
-            });
-        ''', movies=json.dumps(unordered_slice))
-        start += batch_size
-        total_movies += batch_size
-        unordered_slice = unordered[start:start+batch_size]
-
-    movie_bar.goto(movie_bar.max)
-    movie_bar.finish()
-
-    ##################
-    ## LOAD REVIEWS ##
-    ##################
-
     reviews_data = [
         dict(
             body=r['body'],
@@ -228,29 +253,29 @@ async def import_data(data: dict):
         ) for r in reviews
     ]
 
-    start = 0
-    batch_size = 1000
-    review_bar = progress.bar.Bar("Review", max=len(reviews))
-    reviews_slice = reviews_data[start:start+batch_size]
-    while len(reviews_slice):
-        review_bar.goto(start)
-        await client.query(r'''
-        WITH reviews := <json>$reviews
-        FOR review in json_array_unpack(reviews) UNION (
-        INSERT Review {
-            body := <str>review['body'],
-            rating := <int64>review['rating'],
-            author := (SELECT User FILTER .image = <str>review['uimage'] LIMIT 1),
-            movie := (SELECT Movie FILTER .image = <str>review['mimage'] LIMIT 1),
-            creation_time := <cal::local_datetime><str>review['creation_time'],
-        });
-      ''', reviews=json.dumps(reviews_slice))
-
-        start += batch_size
-        reviews_slice = reviews_data[start:start+batch_size]
-
-    review_bar.goto(review_bar.max)
-    review_bar.finish()
+    def loader(label, query, rows, batch_size=batch_size):
+        return BatchLoader(
+            client, label, query, rows,
+            limit=limit, batch_size=batch_size)
+
+    # Movies link to people, and reviews to users and movies, by image.
+    # Everything else is independent and is loaded concurrently.
+    async def load_people_and_movies():
+        await loader('Person', PEOPLE_QUERY, people_data).run()
+        await asyncio.gather(
+            loader('Movie (ordered)', ORDERED_MOVIES_QUERY, ordered).run(),
+            loader('Movie (unordered)', UNORDERED_MOVIES_QUERY, unordered,
+                   batch_size=max(1, batch_size // 10)).run(),
+        )
+
+    try:
+        await asyncio.gather(
+            load_people_and_movies(),
+            loader('User', USERS_QUERY, users_data).run(),
+        )
+        await loader('Review', REVIEWS_QUERY, reviews_data).run()
+    finally:
+        await client.aclose()
 
 
 def id2image(idmap, ids):
@@ -261,10 +286,16 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Load EdgeDB dataset.')
     parser.add_argument('filename', type=str,
                         help='The JSON dataset file')
+    parser.add_argument('--concurrency', type=int, default=32,
+                        help='maximum number of batches loaded at once')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='initial number of rows per batch; adapted '
+                             'to the observed query time')
     args = parser.parse_args()
 
     with open(args.filename, 'rt') as f:
         records = json.load(f)
 
     uvloop.install()
-    asyncio.run(import_data(records))
+    asyncio.run(import_data(
+        records, concurrency=args.concurrency, batch_size=args.batch_size))
@@ -10,6 +10,8 @@ import edgedb
 import json
 import random
 
+import _idsample
+
 from . import queries
 
 INSERT_PREFIX = 'insert_test__'
@@ -26,23 +28,12 @@ def close(ctx, conn):
 
 
 def load_ids(ctx, conn):
-    d = conn.query_single('''
-        WITH
-            U := User {id, r := random()},
-            M := Movie {id, r := random()},
-            P := Person {id, r := random()}
-        SELECT (
-            users := array_agg((SELECT U ORDER BY U.r LIMIT <int64>$lim).id),
-            movies := array_agg((SELECT M ORDER BY M.r LIMIT <int64>$lim).id),
-            people := array_agg((SELECT P ORDER BY P.r LIMIT <int64>$lim).id),
-        );
-    ''', lim=ctx.number_of_ids)
-
-    movies = list(d.movies)
-    people = list(d.people)
+    ids = _idsample.sample_edgedb(ctx, conn)
+    movies = ids['movies']
+    people = ids['people']
 
     return dict(
-        get_user=list(d.users),
+        get_user=ids['users'],
         get_movie=movies,
         get_person=people,
         # re-use user IDs for update tests
@@ -8,6 +8,8 @@
 
 import edgedb
 
+import _idsample
+
 
 INSERT_PREFIX = 'insert_test__'
 
@@ -64,29 +66,17 @@ def close(ctx, conn):
 
 
 def load_ids(ctx, conn):
-    d = conn.query_single('''
-        WITH
-            U := User {id, r := random()},
-            M := Movie {id, r := random()},
-            P := Person {id, r := random()}
-        SELECT (
-            users := array_agg((SELECT U ORDER BY U.r LIMIT <int64>$lim).id),
-            movies := array_agg((SELECT M ORDER BY M.r LIMIT <int64>$lim){
-                id,
-                title := '---' ++ (<str>.id)[:8],
-            }),
-            people := array_agg((SELECT P ORDER BY P.r LIMIT <int64>$lim).id),
-        );
-    ''', lim=ctx.number_of_ids)
-
-    people = list(d.people)
+    ids = _idsample.sample_edgedb(ctx, conn)
+    people = ids['people']
 
     return dict(
-        get_user=[[str(v)] for v in d.users],
-        get_movie=[[str(v.id)] for v in d.movies],
+        get_user=[[str(v)] for v in ids['users']],
+        get_movie=[[str(v)] for v in ids['movies']],
         get_person=[[str(v)] for v in people],
         # re-use user IDs for update tests
-        update_movie=[[str(v.id), v.title] for v in d.movies],
+        update_movie=[
+            [str(v), '---' + str(v)[:8]] for v in ids['movies']
+        ],
         # generate as many insert stubs as "concurrency" to
         # accommodate concurrent inserts
         insert_user=[[INSERT_PREFIX]] * ctx.concurrency,
@@ -8,6 +8,8 @@
 
 import psycopg2
 
+import _idsample
+
 
 INSERT_PREFIX = 'insert_test__'
 
@@ -69,29 +71,13 @@ def close(ctx, conn):
 
 
 def load_ids(ctx, conn):
-    cur = conn.cursor()
-
     # read IDs as strings to be converted later into ints
-    cur.execute(
-        'SELECT u.id::text FROM users u ORDER BY random() LIMIT %s',
-        [ctx.number_of_ids])
-    users = cur.fetchall()
-
-    cur.execute(
-        '''
-        SELECT
-            m.id::text, m.title || '---' || m.id::text
-        FROM
-            movies m ORDER BY random() LIMIT %s
-        ''',
-        [ctx.number_of_ids]
-    )
-    movies = cur.fetchall()
-
-    cur.execute(
-        'SELECT p.id::text FROM persons p ORDER BY random() LIMIT %s',
-        [ctx.number_of_ids])
-    people = cur.fetchall()
+    ids = _idsample.sample_tables(ctx, conn.cursor(), 'postgres_bench', {
+        'users': ('users', 'id::text'),
+        'movies': ('movies', "id::text, title || '---' || id::text"),
+        'people': ('persons', 'id::text'),
+    })
+    users, movies, people = ids['users'], ids['movies'], ids['people']
 
     return dict(
         get_user=[[u[0]] for u in users],
@@ -5,7 +5,9 @@ import (
 	"fmt"
 	"log"
 	"math"
+	"math/bits"
 	"math/rand"
+	"sort"
 	"time"
 
 	"github.com/edgedb/imdbench/_go/bench"
@@ -21,12 +23,63 @@ type Slice struct {
 }
 
 type Stats struct {
-	Queries       int64    `json:"nqueries"`
-	MinLatency    int64    `json:"min_latency"`
-	MaxLatency    int64    `json:"max_latency"`
-	LatencyCounts []int64  `json:"latency_stats"`
-	Duration      float64  `json:"duration"`
-	Samples       []string `json:"samples"`
+	Queries       int64      `json:"nqueries"`
+	MinLatency    int64      `json:"min_latency"`
+	MaxLatency    int64      `json:"max_latency"`
+	LatencyCounts []int64    `json:"latency_stats"`
+	Duration      float64    `json:"duration"`
+	Samples       []string   `json:"samples"`
+	Timeseries    TimeSeries `json:"timeseries"`
+}
+
+// Latencies in the time series are bucketed like in _histogram.py:
+// every value keeps its subBucketBits most significant bits.
+const subBucketBits = 8
+
+func bucketIndex(value int64) int {
+	shift := bits.Len64(uint64(value)) - subBucketBits
+	if shift <= 0 {
+		return int(value)
+	}
+	return shift*(1<<(subBucketBits-1)) + int(value>>shift)
+}
+
+// Per-second latency bucket counts, since the start of the warmup.
+type TimeSeries []map[int]int64
+
+func (ts *TimeSeries) record(since time.Duration, latency time.Duration) {
+	idx := int(since / time.Second)
+	for len(*ts) <= idx {
+		*ts = append(*ts, make(map[int]int64))
+	}
+	(*ts)[idx][bucketIndex(latency.Nanoseconds())]++
+}
+
+func (ts *TimeSeries) add(other TimeSeries) {
+	for idx, counts := range other {
+		for len(*ts) <= idx {
+			*ts = append(*ts, make(map[int]int64))
+		}
+		for bucket, count := range counts {
+			(*ts)[idx][bucket] += count
+		}
+	}
+}
+
+// Encode every interval as a list of [bucket index, count] pairs.
+func (ts TimeSeries) MarshalJSON() ([]byte, error) {
+	out := make([][][2]int64, len(ts))
+	for i, counts := range ts {
+		pairs := make([][2]int64, 0, len(counts))
+		for bucket, count := range counts {
+			pairs = append(pairs, [2]int64{int64(bucket), count})
+		}
+		sort.Slice(pairs, func(a, b int) bool {
+			return pairs[a][0] < pairs[b][0]
+		})
+		out[i] = pairs
+	}
+	return json.Marshal(out)
 }
 
 func safeSlice(
@@ -47,6 +100,7 @@ func safeSlice(
 func doWork(
 	work bench.Worker,
 	duration time.Duration,
+	benchStart time.Time,
 	args cli.Args,
 	slice Slice,
 	statsChan chan Stats,
@@ -87,6 +141,7 @@ func doWork(
 		qargs = QArgs[index]
 
 		reqTime, _ := exec(qargs)
+		stats.Timeseries.record(time.Since(benchStart), reqTime)
 
 		rounded := reqTime.Nanoseconds() / 10_000
 		if rounded > stats.MaxLatency {
@@ -111,6 +166,7 @@ func doWork(
 func doConcurrentWork(
 	work bench.Worker,
 	duration time.Duration,
+	benchStart time.Time,
 	args cli.Args,
 ) Stats {
 	statsChan := make(chan Stats, args.Concurrency)
@@ -120,7 +176,7 @@ func doConcurrentWork(
 
 	for i := 0; i < args.Concurrency; i++ {
 		slice := Slice{Start: chunk_len*i, End: chunk_len*(i+1)}
-		go doWork(work, duration, args, slice, statsChan)
+		go doWork(work, duration, benchStart, args, slice, statsChan)
 	}
 
 	samples := make([]string, 0, args.NSamples*args.Concurrency)
@@ -137,6 +193,7 @@ func doConcurrentWork(
 		tStats := <-statsChan
 		stats.Queries += tStats.Queries
 		samples = append(samples, tStats.Samples...)
+		stats.Timeseries.add(tStats.Timeseries)
 
 		for i := 0; i < len(stats.LatencyCounts); i++ {
 			stats.LatencyCounts[i] += tStats.LatencyCounts[i]
@@ -177,9 +234,13 @@ func main() {
 		worker = http.Worker
 	}
 
-	doConcurrentWork(worker, args.Warmup, args)
+	benchStart := time.Now()
+	warmup := doConcurrentWork(worker, args.Warmup, benchStart, args)
 
-	stats := doConcurrentWork(worker, args.Duration, args)
+	stats := doConcurrentWork(worker, args.Duration, benchStart, args)
+	// The time series covers the warmup too, so that its effect
+	// is visible in the report.
+	stats.Timeseries.add(warmup.Timeseries)
 
 	data, err := json.Marshal(stats)
 	if err != nil {
@@ -1,5 +1,7 @@
 import psycopg2
 
+import _idsample
+
 
 INSERT_PREFIX = 'insert_test__'
 
@@ -18,22 +20,12 @@ def close(ctx, conn):
 
 
 def load_ids(ctx, conn):
-    cur = conn.cursor()
-
-    cur.execute(
-        'SELECT u.id FROM users u ORDER BY random() LIMIT %s',
-        [ctx.number_of_ids])
-    users = cur.fetchall()
-
-    cur.execute(
-        'SELECT m.id FROM movies m ORDER BY random() LIMIT %s',
-        [ctx.number_of_ids])
-    movies = cur.fetchall()
-
-    cur.execute(
-        'SELECT p.id FROM persons p ORDER BY random() LIMIT %s',
-        [ctx.number_of_ids])
-    people = cur.fetchall()
+    ids = _idsample.sample_tables(ctx, conn.cursor(), 'postgres_bench', {
+        'users': ('users', 'id'),
+        'movies': ('movies', 'id'),
+        'people': ('persons', 'id'),
+    })
+    users, movies, people = ids['users'], ids['movies'], ids['people']
 
     return dict(
         get_user=[[str(u[0])] for u in users],
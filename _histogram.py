@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+import math
+import typing
+
+
+# Number of significant bits kept for every recorded value.  Values
+# below 2 ** SUB_BUCKET_BITS are recorded exactly, larger values land
+# in buckets whose width is at most 1/128th of their magnitude.
+SUB_BUCKET_BITS = 8
+
+_HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+
+def bucket_index(value: int) -> int:
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    if shift <= 0:
+        return value
+    return shift * _HALF + (value >> shift)
+
+
+def bucket_range(index: int) -> typing.Tuple[int, int]:
+    """Return the (lowest, highest) values that map to *index*."""
+    if index < 2 * _HALF:
+        return index, index
+    shift = index // _HALF - 1
+    low = (index - shift * _HALF) << shift
+    return low, low + (1 << shift) - 1
+
+
+class LatencyHistogram:
+    """Log-linear (HDR-style) histogram of request latencies.
+
+    Latencies are recorded in integer nanoseconds.  The histogram is
+    sparse and open-ended: nothing is clamped, and the memory footprint
+    depends only on the orders of magnitude actually observed.  Use
+    encode() / decode() to pass it through JSON.
+    """
+
+    __slots__ = ('counts', 'total', 'sum', 'min', 'max')
+
+    def __init__(self):
+        self.counts = []
+        self.total = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value: int, count: int = 1):
+        if value < 0:
+            value = 0
+
+        idx = bucket_index(value)
+        counts = self.counts
+        if idx >= len(counts):
+            counts.extend([0] * (idx - len(counts) + 1))
+        counts[idx] += count
+
+        self.total += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def add(self, other: 'LatencyHistogram'):
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+
+        self.total += other.total
+        self.sum += other.sum
+        if other.min is not None and (
+                self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (
+                self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self) -> float:
+        if not self.total:
+            return 0.0
+        return self.sum / self.total
+
+    def stddev(self) -> float:
+        if not self.total:
+            return 0.0
+        mean = self.mean()
+        acc = 0.0
+        for i, c in enumerate(self.counts):
+            if c:
+                low, high = bucket_range(i)
+                acc += c * ((low + high) / 2 - mean) ** 2
+        return math.sqrt(acc / self.total)
+
+    def value_at_quantile(self, q: float) -> float:
+        if not (0 <= q <= 1):
+            raise ValueError('quantiles should be in [0, 1]')
+        if not self.total:
+            return 0.0
+
+        target = max(1, math.ceil(q * self.total))
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= target:
+                low, high = bucket_range(i)
+                value = (low + high) / 2
+                return min(max(value, self.min), self.max)
+
+        return float(self.max)
+
+    def encode(self) -> dict:
+        """Return a compact, JSON-serializable representation.
+
+        Only non-empty buckets are stored, as delta-encoded bucket
+        indexes with a parallel list of counts.
+        """
+        buckets = []
+        counts = []
+        prev = 0
+        for i, c in enumerate(self.counts):
+            if c:
+                buckets.append(i - prev)
+                counts.append(c)
+                prev = i
+
+        return {
+            'unit': 'ns',
+            'sub_bucket_bits': SUB_BUCKET_BITS,
+            'total': self.total,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'buckets': buckets,
+            'counts': counts,
+        }
+
+    @classmethod
+    def decode(cls, data: dict) -> 'LatencyHistogram':
+        if data.get('sub_bucket_bits') != SUB_BUCKET_BITS:
+            raise ValueError(
+                'unsupported histogram encoding: sub_bucket_bits={}'.format(
+                    data.get('sub_bucket_bits')))
+
+        hist = cls()
+        idx = 0
+        for delta, c in zip(data['buckets'], data['counts']):
+            idx += delta
+            if idx >= len(hist.counts):
+                hist.counts.extend([0] * (idx - len(hist.counts) + 1))
+            hist.counts[idx] += c
+
+        hist.total = data['total']
+        hist.sum = data['sum']
+        hist.min = data['min']
+        hist.max = data['max']
+        return hist
+
+    @classmethod
+    def from_dense(cls, counts: typing.Sequence[int],
+                   unit_ns: int) -> 'LatencyHistogram':
+        """Build a histogram from a dense array of per-unit counts.
+
+        This is the format produced by the Go, JS and Dart runners, where
+        ``counts[i]`` is the number of requests that took ``i * unit_ns``.
+        """
+        hist = cls()
+        for i, c in enumerate(counts):
+            if c:
+                hist.record(int(i * unit_ns), int(c))
+        return hist
+
+    def __getstate__(self):
+        return self.encode()
+
+    def __setstate__(self, state):
+        other = self.decode(state)
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(other, attr))
+
+
+# Length of a time series interval, in nanoseconds.  The Go and JS
+# runners use the same fixed interval.
+TIMESERIES_INTERVAL = 1_000_000_000
+
+
+class LatencyTimeSeries:
+    """Latency histograms of consecutive fixed-length intervals.
+
+    Interval 0 starts at *start* (a time.monotonic_ns() value), which
+    runners set to the beginning of the warmup period, so that the
+    effect of warmup is visible in the series.
+    """
+
+    __slots__ = ('start', 'intervals')
+
+    def __init__(self, start: int = 0):
+        self.start = start
+        self.intervals = []
+
+    def record(self, now: int, value: int):
+        idx = (now - self.start) // TIMESERIES_INTERVAL
+        intervals = self.intervals
+        while len(intervals) <= idx:
+            intervals.append(LatencyHistogram())
+        intervals[idx].record(value)
+
+    def add(self, other: 'LatencyTimeSeries'):
+        # Series of different workers are aligned by interval index;
+        # workers start within milliseconds of each other.
+        for i, hist in enumerate(other.intervals):
+            if i < len(self.intervals):
+                self.intervals[i].add(hist)
+            else:
+                self.intervals.append(hist)
+
+    def encode(self) -> list:
+        return [hist.encode() for hist in self.intervals]
+
+    @classmethod
+    def decode(cls, data: list) -> 'LatencyTimeSeries':
+        series = cls()
+        series.intervals = [LatencyHistogram.decode(d) for d in data]
+        return series
+
+    @classmethod
+    def from_buckets(cls, data: list) -> 'LatencyTimeSeries':
+        """Build a series from per-interval ``[bucket_index, count]`` pairs.
+
+        This is the format produced by the Go and JS runners, which
+        bucket latencies in nanoseconds with bucket_index().  Exact
+        extremes are not known, so the bucket bounds are used instead.
+        """
+        series = cls()
+        for pairs in data:
+            hist = LatencyHistogram()
+            for idx, c in pairs:
+                low, high = bucket_range(idx)
+                hist.record((low + high) // 2, c)
+            if pairs:
+                hist.min = bucket_range(min(p[0] for p in pairs))[0]
+                hist.max = bucket_range(max(p[0] for p in pairs))[1]
+            series.intervals.append(hist)
+        return series
@@ -0,0 +1,260 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""History of benchmark results in an SQLite database.
+
+Every ``bench.py`` run is recorded along with what it ran on: the
+platform, the git revision of the benchmarks, a fingerprint of the
+dataset and the benchmark options.  Results keep their full latency
+histogram, so any percentile can be recomputed later.  See history.py
+for querying trends.
+"""
+
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import subprocess
+import typing
+
+import _shared
+
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_PATH = os.path.join(ROOT, 'history.sqlite')
+
+DATASET_PATH = os.path.join(ROOT, 'dataset', 'build', 'dataset.json')
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        -- ISO 8601, UTC.
+        date TEXT NOT NULL,
+        git_rev TEXT,
+        git_dirty INTEGER,
+        -- JSON of bench.platform_info().
+        platform TEXT NOT NULL,
+        dataset TEXT,
+        concurrency INTEGER NOT NULL,
+        duration INTEGER NOT NULL,
+        rate REAL NOT NULL,
+        netlatency INTEGER NOT NULL,
+        id_distribution TEXT NOT NULL,
+        repeat INTEGER NOT NULL,
+        -- JSON list of the command line arguments.
+        argv TEXT NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS results (
+        run_id INTEGER NOT NULL REFERENCES runs (id),
+        implementation TEXT NOT NULL,
+        query TEXT NOT NULL,
+        queries REAL NOT NULL,
+        duration REAL NOT NULL,
+        qps REAL NOT NULL,
+        latency_mean REAL NOT NULL,
+        latency_p50 REAL NOT NULL,
+        latency_p90 REAL NOT NULL,
+        latency_p99 REAL NOT NULL,
+        -- JSON of _histogram.LatencyHistogram.encode().
+        histogram TEXT,
+        -- JSON of the whole entry of the report, but samples.
+        stats TEXT NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS results_by_benchmark
+        ON results (implementation, query);
+'''
+
+# Metrics that can be queried, by results column.
+METRICS = {
+    'qps': 'qps',
+    'mean': 'latency_mean',
+    'p50': 'latency_p50',
+    'p90': 'latency_p90',
+    'p99': 'latency_p99',
+}
+
+# Run options that make results comparable.
+CONFIG_COLUMNS = [
+    'platform', 'dataset', 'concurrency', 'rate', 'id_distribution']
+
+# Bytes hashed at each end of the dataset file.
+_DATASET_SAMPLE = 1 << 20
+
+
+def connect(path: str = DEFAULT_PATH) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def git_revision() -> typing.Tuple[typing.Optional[str], bool]:
+    """Return the revision of the benchmarks and whether it is modified."""
+    try:
+        rev = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True,
+            capture_output=True, check=True).stdout.strip()
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'],
+            cwd=ROOT, text=True, capture_output=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None, False
+    return rev, bool(status.strip())
+
+
+def dataset_fingerprint(path: str = DATASET_PATH) -> typing.Optional[str]:
+    """Identify the generated dataset without reading all of it.
+
+    The file size and its first and last megabyte change with the
+    dataset size and seed.  It is the generated dataset, though, the
+    databases might still hold a previous one.
+    """
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return None
+
+    h = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        h.update(f.read(_DATASET_SAMPLE))
+        if size > _DATASET_SAMPLE:
+            f.seek(max(_DATASET_SAMPLE, size - _DATASET_SAMPLE))
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def record_run(conn: sqlite3.Connection, report_data: dict,
+               argv: typing.List[str]) -> int:
+    """Record the run that produced *report_data* (see bench.main())."""
+    names = {
+        impl.title: name for name, impl in _shared.IMPLEMENTATIONS.items()}
+    git_rev, git_dirty = git_revision()
+
+    with conn:
+        run_id = conn.execute(
+            '''
+            INSERT INTO runs (
+                date, git_rev, git_dirty, platform, dataset, concurrency,
+                duration, rate, netlatency, id_distribution, repeat, argv
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''',
+            (
+                datetime.datetime.now(datetime.timezone.utc).isoformat(
+                    timespec='seconds'),
+                git_rev,
+                git_dirty,
+                json.dumps(report_data['platform'], sort_keys=True),
+                dataset_fingerprint(),
+                report_data['concurrency'],
+                report_data['duration'],
+                report_data['rate'],
+                report_data['netlatency'],
+                report_data['id_distribution'],
+                report_data['repeat'],
+                json.dumps(argv),
+            ),
+        ).lastrowid
+
+        for queryname, benches in report_data['benchmarks'].items():
+            if queryname == 'mean':
+                # Derived from the others.
+                continue
+            for d in benches:
+                pcts = dict(d['latency_percentiles'])
+                stats = {
+                    k: v for k, v in d.items()
+                    if k not in {'samples', 'latency_histogram'}
+                }
+                conn.execute(
+                    '''
+                    INSERT INTO results (
+                        run_id, implementation, query, queries, duration,
+                        qps, latency_mean, latency_p50, latency_p90,
+                        latency_p99, histogram, stats
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''',
+                    (
+                        run_id,
+                        names.get(d['implementation'], d['implementation']),
+                        queryname,
+                        d['queries'],
+                        d['duration'],
+                        d['qps'],
+                        d['latency_mean'],
+                        pcts[50],
+                        pcts[90],
+                        pcts[99],
+                        (json.dumps(d['latency_histogram'])
+                         if 'latency_histogram' in d else None),
+                        json.dumps(stats),
+                    ),
+                )
+
+    return run_id
+
+
+def latest_config(conn: sqlite3.Connection, implementation: str,
+                  query: str) -> typing.Optional[dict]:
+    """Return the run options of the last run of a benchmark."""
+    row = conn.execute(
+        f'''
+        SELECT {", ".join(f"runs.{c}" for c in CONFIG_COLUMNS)}
+        FROM results JOIN runs ON runs.id = results.run_id
+        WHERE implementation = ? AND query = ?
+        ORDER BY runs.id DESC LIMIT 1
+        ''',
+        (implementation, query),
+    ).fetchone()
+    return dict(row) if row is not None else None
+
+
+def trend(conn: sqlite3.Connection, implementation: str, query: str,
+          metric: str, *, config: typing.Optional[dict] = None,
+          limit: int = 0) -> typing.List[sqlite3.Row]:
+    """Return the values of *metric* of a benchmark, oldest first.
+
+    With *config* (see latest_config()) only runs with the same options
+    are returned.  *limit* keeps the last so many runs.
+    """
+    where = ['implementation = ?', 'query = ?']
+    params = [implementation, query]
+    for column, value in (config or {}).items():
+        if column not in CONFIG_COLUMNS:
+            raise ValueError(f'not a run option: {column!r}')
+        where.append(f'runs.{column} IS ?')
+        params.append(value)
+
+    rows = conn.execute(
+        f'''
+        SELECT
+            runs.id AS run_id, runs.date, runs.git_rev, runs.git_dirty,
+            runs.dataset, runs.concurrency, results.{METRICS[metric]} AS value
+        FROM results JOIN runs ON runs.id = results.run_id
+        WHERE {" AND ".join(where)}
+        ORDER BY runs.id DESC
+        {"LIMIT ?" if limit else ""}
+        ''',
+        params + ([limit] if limit else []),
+    ).fetchall()
+    return rows[::-1]
+
+
+def benchmarks(conn: sqlite3.Connection
+               ) -> typing.List[typing.Tuple[str, str]]:
+    """Return the (implementation, query) pairs in the history."""
+    return [
+        (row['implementation'], row['query'])
+        for row in conn.execute(
+            'SELECT DISTINCT implementation, query FROM results '
+            'ORDER BY implementation, query')
+    ]
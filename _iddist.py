@@ -0,0 +1,187 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Distributions of the ids that benchmarks fetch data with.
+
+``load_ids()`` returns ids in random order; the position of an id in
+that list is its rank, the most accessed id being the first:
+
+* ``uniform`` walks the ids round-robin, so every id is accessed
+  equally often (the default);
+* ``zipf:<s>`` accesses the id of rank k with probability
+  proportional to 1 / k^s;
+* ``hotset:<pct>[:<share>]`` sends <share> percent (90 by default) of
+  the requests to the top <pct> percent of the ids.
+
+Skewed distributions are turned into a sampling table once per
+connection: a shuffled array of indices in which every id occurs in
+proportion to its probability.  Requests then walk the table, which
+costs no more than the uniform walk.
+
+Connections never mutate the same object: ids of mutation benchmarks
+are split into disjoint chunks, interleaved by rank so that hot ids are
+spread over all connections.  Read benchmarks use all ids in every
+connection, which keeps the skew of the whole workload exact.
+
+numpy is only imported for skewed distributions, as every driver
+imports this module through _shared.
+"""
+
+
+import argparse
+import array
+import random
+import typing
+
+if typing.TYPE_CHECKING:
+    import numpy as np
+
+
+# Minimal number of entries of a sampling table; an id with a
+# probability below 1 / TABLE_SIZE might not be accessed at all.
+TABLE_SIZE = 1 << 16
+
+DEFAULT_HOT_SHARE = 90
+
+
+class IdDistribution(typing.NamedTuple):
+
+    kind: str
+    # Exponent of zipf, percentage of hot ids of hotset.
+    param: float = 0
+    # Percentage of requests to the hot ids of hotset.
+    share: float = DEFAULT_HOT_SHARE
+
+    def __str__(self):
+        if self.kind == 'zipf':
+            return f'zipf:{self.param:g}'
+        elif self.kind == 'hotset':
+            return f'hotset:{self.param:g}:{self.share:g}'
+        return self.kind
+
+    @property
+    def uniform(self) -> bool:
+        return self.kind == 'uniform'
+
+    def weights(self, n: int) -> 'np.ndarray':
+        """Return the probabilities of the ids of ranks 0 .. n-1."""
+        import numpy as np
+
+        if self.kind == 'zipf':
+            w = np.arange(1, n + 1, dtype=np.float64) ** -self.param
+        elif self.kind == 'hotset':
+            nhot = min(n, max(1, round(n * self.param / 100)))
+            w = np.empty(n, dtype=np.float64)
+            if nhot == n:
+                w[:] = 1
+            else:
+                w[:nhot] = self.share / nhot
+                w[nhot:] = (100 - self.share) / (n - nhot)
+        else:
+            w = np.ones(n, dtype=np.float64)
+        return w / w.sum()
+
+
+UNIFORM = IdDistribution('uniform')
+
+
+def parse_id_distribution(spec: str) -> IdDistribution:
+    """Parse a "uniform", "zipf:<s>" or "hotset:<pct>[:<share>]" spec."""
+    kind, _, rest = spec.strip().partition(':')
+    params = rest.split(':') if rest else []
+    try:
+        values = [float(p) for p in params]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'invalid parameters in id distribution {spec!r}') from None
+
+    if kind == 'uniform' and not values:
+        return UNIFORM
+    elif kind == 'zipf' and len(values) == 1:
+        if values[0] <= 0:
+            raise argparse.ArgumentTypeError(
+                f'zipf exponent must be positive: {spec!r}')
+        return IdDistribution('zipf', values[0])
+    elif kind == 'hotset' and len(values) in (1, 2):
+        if not all(0 < v <= 100 for v in values):
+            raise argparse.ArgumentTypeError(
+                f'hotset percentages must be in (0, 100]: {spec!r}')
+        return IdDistribution('hotset', *values)
+
+    raise argparse.ArgumentTypeError(
+        f'invalid id distribution {spec!r}, expected "uniform", '
+        f'"zipf:<s>" or "hotset:<pct>[:<share>]"')
+
+
+class RankedIds(typing.NamedTuple):
+    """Ids along with their ranks among all ids of the query."""
+
+    values: list
+    ranks: range
+    total: int
+
+
+def ranked(values) -> RankedIds:
+    if isinstance(values, RankedIds):
+        return values
+    values = list(values)
+    return RankedIds(values, range(len(values)), len(values))
+
+
+def chunk(dist: IdDistribution, ids, exclusive: bool,
+          nchunks: int, i: int) -> RankedIds:
+    """Return the ids of connection *i* out of *nchunks*.
+
+    *exclusive* ids (of mutation benchmarks) are never shared between
+    connections.
+    """
+    ids = ranked(ids)
+    if dist.uniform:
+        # Contiguous chunks, as the ids are in random order anyway.
+        size = -(-len(ids.values) // nchunks)
+        s = slice(size * i, size * (i + 1))
+    elif exclusive:
+        s = slice(i, None, nchunks)
+    else:
+        return ids
+    return RankedIds(ids.values[s], ids.ranks[s], ids.total)
+
+
+class IdSampler:
+    """Endless sequence of ids drawn from a distribution."""
+
+    def __init__(self, dist: IdDistribution, ids):
+        ids = ranked(ids)
+        self.values = ids.values
+        self.i = 0
+
+        if dist.uniform or not self.values:
+            # Loop over the ids in such a way as to avoid repeating the
+            # same id too closely to itself.
+            self.table = list(range(len(self.values)))
+            random.shuffle(self.table)
+        else:
+            import numpy as np
+
+            p = dist.weights(ids.total)[np.asarray(ids.ranks)]
+            cdf = np.cumsum(p / p.sum())
+            size = max(TABLE_SIZE, len(self.values))
+            # Systematic sampling: id j takes up size * p[j] (+-1)
+            # entries of the table.
+            table = np.searchsorted(cdf, (np.arange(size) + 0.5) / size)
+            table = np.minimum(table, len(self.values) - 1)
+            np.random.default_rng().shuffle(table)
+            self.table = array.array('i', table.astype(np.intc).tobytes())
+
+        self.len = len(self.table)
+
+    def get_next(self):
+        # advance
+        self.i += 1
+        self.i %= self.len
+        return self.values[self.table[self.i]]
@@ -0,0 +1,262 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Sampling of the ids that benchmarks fetch data with.
+
+``ORDER BY random() LIMIT n`` sorts a whole table to pick a few rows.
+Tables with integer keys are instead sampled by probing random keys
+between the smallest and the largest one, which only touches the
+primary key index and fetches nothing but the requested columns.
+
+Samples are cached on disk, so a run re-uses the ids of the previous
+one for free.  The cache key is a fingerprint of the loaded data that
+is cheap to compute (e.g. the key range of every table, or the id of
+the first object), along with the database and ``--number-of-ids``:
+reloading the database or changing the dataset invalidates it.
+Pass ``--resample-ids`` to ignore the cache.
+"""
+
+
+import hashlib
+import os
+import pickle
+import random
+import typing
+
+
+# Upper bound of keys probed in one query.
+BATCH_SIZE = 10_000
+
+CACHE_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'dataset', 'build', 'ids')
+
+
+def _cache_path(ctx, name, fingerprint) -> str:
+    key = repr((name, fingerprint, ctx.number_of_ids)).encode()
+    return os.path.join(
+        CACHE_DIR, f'{name}-{hashlib.sha1(key).hexdigest()[:16]}.pickle')
+
+
+def shuffled(ids: typing.Dict[str, list]) -> typing.Dict[str, list]:
+    # Samples are cached (and fetched by key) in no particular order,
+    # while the order of ids matters to skewed --id-distribution.
+    ids = {key: list(values) for key, values in ids.items()}
+    for values in ids.values():
+        random.shuffle(values)
+    return ids
+
+
+def get(ctx, name: str,
+        fingerprint) -> typing.Optional[typing.Dict[str, list]]:
+    """Return the cached samples of database *name*, or None."""
+    if getattr(ctx, 'resample_ids', False):
+        return None
+    try:
+        with open(_cache_path(ctx, name, fingerprint), 'rb') as f:
+            return shuffled(pickle.load(f))
+    except FileNotFoundError:
+        return None
+
+
+def put(ctx, name: str, fingerprint,
+        ids: typing.Dict[str, list]) -> typing.Dict[str, list]:
+    """Cache the samples of database *name* and return them shuffled."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = _cache_path(ctx, name, fingerprint)
+    with open(f'{path}.tmp', 'wb') as f:
+        pickle.dump(ids, f)
+    os.replace(f'{path}.tmp', path)
+    return shuffled(ids)
+
+
+class KeySampler:
+    """Random distinct keys of a range, a batch of candidates at a time.
+
+        sampler = KeySampler(lo, hi, n)
+        while batch := sampler.candidates():
+            sampler.add(<rows with a key in batch>)
+        rows = sampler.rows
+
+    Keys are mostly dense, so the first batch usually does it.
+    """
+
+    def __init__(self, lo: typing.Optional[int], hi: typing.Optional[int],
+                 n: int):
+        # An empty table has no key range.
+        self.keys = range(0) if lo is None else range(lo, hi + 1)
+        self.n = n
+        self.tried = set()
+        self.rows = []
+
+    def candidates(self) -> typing.List[int]:
+        want = self.n - len(self.rows)
+        left = len(self.keys) - len(self.tried)
+        if want <= 0 or left <= 0:
+            return []
+        if left <= want * 2:
+            # Close to the whole range, just try all that is left.
+            batch = [k for k in self.keys if k not in self.tried]
+            random.shuffle(batch)
+        else:
+            # Oversample a little for gaps in the keys.  An empty batch
+            # would end the sampling, so draw until some key is new.
+            k = min(left, want + want // 4 + 16)
+            batch = []
+            while not batch:
+                batch = [
+                    key for key in random.sample(self.keys, k)
+                    if key not in self.tried
+                ]
+        batch = batch[:BATCH_SIZE]
+        self.tried.update(batch)
+        return batch
+
+    def add(self, rows: list):
+        # Rows come in key order, drop the surplus of the oversampling
+        # at random.
+        rows = list(rows)
+        random.shuffle(rows)
+        self.rows.extend(rows[:self.n - len(self.rows)])
+
+
+def _sampling(ctx, name: str, keys: typing.Iterable[str], scope):
+    """Sample every one of *keys*, the queries left to the caller.
+
+    Yields (key, None) for the key range and (key, batch) for the rows
+    of the keys in batch, and is sent the results.  Returns the samples
+    by key, cached with the key ranges and *scope* as fingerprint.
+    """
+    keys = list(keys)
+    bounds = {}
+    for key in keys:
+        bounds[key] = tuple((yield key, None))
+    fingerprint = (scope, sorted(bounds.items()))
+
+    ids = get(ctx, name, fingerprint)
+    if ids is not None:
+        return ids
+
+    ids = {}
+    for key in keys:
+        sampler = KeySampler(*bounds[key], ctx.number_of_ids)
+        while batch := sampler.candidates():
+            sampler.add((yield key, batch))
+        ids[key] = sampler.rows
+
+    return put(ctx, name, fingerprint, ids)
+
+
+def sample_keys(ctx, name: str, keys: typing.Iterable[str],
+                bounds: typing.Callable, fetch: typing.Callable,
+                *, scope=None) -> typing.Dict[str, list]:
+    """Sample rows of database *name* by probing random integer keys.
+
+    *bounds(key)* returns the smallest and the largest key of sample
+    *key*, *fetch(key, batch)* the rows with a key in *batch*.  Returns
+    lists of rows by sample key.
+    """
+    sampling = _sampling(ctx, name, keys, scope)
+    try:
+        key, batch = next(sampling)
+        while True:
+            result = bounds(key) if batch is None else fetch(key, batch)
+            key, batch = sampling.send(result)
+    except StopIteration as e:
+        return e.value
+
+
+async def sample_keys_async(ctx, name: str, keys: typing.Iterable[str],
+                            bounds: typing.Callable, fetch: typing.Callable,
+                            *, scope=None) -> typing.Dict[str, list]:
+    """Like sample_keys(), with coroutine functions *bounds* and *fetch*."""
+    sampling = _sampling(ctx, name, keys, scope)
+    try:
+        key, batch = next(sampling)
+        while True:
+            if batch is None:
+                result = await bounds(key)
+            else:
+                result = await fetch(key, batch)
+            key, batch = sampling.send(result)
+    except StopIteration as e:
+        return e.value
+
+
+def sample_tables(ctx, cur, name: str,
+                  tables: typing.Dict[str, typing.Tuple[str, str]],
+                  ) -> typing.Dict[str, list]:
+    """Sample rows of tables with an integer ``id`` key via DB-API *cur*.
+
+    *tables* maps sample names to (table, selected columns).  Returns
+    lists of rows by sample name.
+    """
+    def bounds(key):
+        table, _ = tables[key]
+        cur.execute(f'SELECT min(id), max(id) FROM {table}')
+        return cur.fetchone()
+
+    def fetch(key, batch):
+        table, columns = tables[key]
+        cur.execute(
+            f'SELECT {columns} FROM {table} WHERE id = ANY(%s)', [batch])
+        return [tuple(row) for row in cur.fetchall()]
+
+    return sample_keys(
+        ctx, name, tables, bounds, fetch, scope=sorted(tables.items()))
+
+
+# The smallest ids come from the primary key index.  EdgeDB generates
+# new ids whenever the data is loaded, so they fingerprint the data.
+EDGEDB_FINGERPRINT = '''
+    SELECT (
+        users := (SELECT User ORDER BY .id LIMIT 1).id,
+        movies := (SELECT Movie ORDER BY .id LIMIT 1).id,
+        people := (SELECT Person ORDER BY .id LIMIT 1).id,
+    );
+'''
+
+# EdgeDB has no way to sample objects, but at least only ids are
+# fetched, and only on a cache miss.
+EDGEDB_SAMPLE = '''
+    WITH
+        U := User {id, r := random()},
+        M := Movie {id, r := random()},
+        P := Person {id, r := random()}
+    SELECT (
+        users := array_agg((SELECT U ORDER BY U.r LIMIT <int64>$lim).id),
+        movies := array_agg((SELECT M ORDER BY M.r LIMIT <int64>$lim).id),
+        people := array_agg((SELECT P ORDER BY P.r LIMIT <int64>$lim).id),
+    );
+'''
+
+
+def _edgedb_ids(d) -> typing.Dict[str, list]:
+    return {
+        'users': list(d.users),
+        'movies': list(d.movies),
+        'people': list(d.people),
+    }
+
+
+def sample_edgedb(ctx, client) -> typing.Dict[str, list]:
+    """Sample the ids of users, movies and people via an EdgeDB *client*."""
+    fingerprint = tuple(client.query_single(EDGEDB_FINGERPRINT) or ())
+    ids = get(ctx, 'edgedb', fingerprint)
+    if ids is None:
+        d = client.query_single(EDGEDB_SAMPLE, lim=ctx.number_of_ids)
+        ids = put(ctx, 'edgedb', fingerprint, _edgedb_ids(d))
+    return ids
+
+
+async def sample_edgedb_async(ctx, client) -> typing.Dict[str, list]:
+    fingerprint = tuple(await client.query_single(EDGEDB_FINGERPRINT) or ())
+    ids = get(ctx, 'edgedb', fingerprint)
+    if ids is None:
+        d = await client.query_single(EDGEDB_SAMPLE, lim=ctx.number_of_ids)
+        ids = put(ctx, 'edgedb', fingerprint, _edgedb_ids(d))
+    return ids
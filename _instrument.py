@@ -0,0 +1,126 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+import functools
+import json
+import sys
+import time
+import tracemalloc
+import typing
+
+
+class ClientInstrumentation:
+    """Client-side cost accounting for a benchmark worker process.
+
+    Measures, over the measurement window only:
+
+    * ``cpu_ns``: CPU time of the worker process (all threads);
+    * ``render_ns``: CPU spent serializing results with json.dumps (or
+      bson.json_util.dumps), the remainder of ``cpu_ns`` is attributed
+      to the driver call;
+    * ``mem_peak_bytes``: tracemalloc peak above the start of the window;
+    * ``mem_retained_blocks``: memory blocks allocated during the window
+      that are still alive at its end.
+
+    All connections of an asyncio worker share the process, so their
+    measurement windows are merged: the window opens when the first
+    connection starts measuring and closes when the last one stops.
+
+    Tracing allocations is expensive, so throughput and latency of
+    instrumented runs must not be compared with regular runs.
+    """
+
+    def __init__(self):
+        self.render_ns = 0
+        self._active = 0
+        self._rendering = 0
+        self._patch_renderers()
+        tracemalloc.start()
+
+    def _patch_renderers(self):
+        # The query functions render results with module-level
+        # json.dumps calls, so patching the function is enough to
+        # attribute the time spent in it.
+        json.dumps = self._timed(json.dumps)
+
+        json_util = sys.modules.get('bson.json_util')
+        if json_util is not None:
+            json_util.dumps = self._timed(json_util.dumps)
+
+    def _timed(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            # bson.json_util.dumps calls json.dumps, only the outermost
+            # call counts.
+            self._rendering += 1
+            if self._rendering > 1:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._rendering -= 1
+
+            start = time.process_time_ns()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.render_ns += time.process_time_ns() - start
+                self._rendering -= 1
+
+        return wrapper
+
+    def start(self):
+        self._active += 1
+        if self._active > 1:
+            return
+
+        self._render_start = self.render_ns
+        tracemalloc.reset_peak()
+        self._mem_start, _ = tracemalloc.get_traced_memory()
+        self._snapshot = tracemalloc.take_snapshot()
+        self._cpu_start = time.process_time_ns()
+
+    def stop(self) -> typing.Optional[dict]:
+        """Close the window; return its stats if it was the last one."""
+        self._active -= 1
+        if self._active > 0:
+            return None
+
+        cpu_ns = time.process_time_ns() - self._cpu_start
+        _, mem_peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        retained = sum(
+            stat.count_diff
+            for stat in snapshot.compare_to(self._snapshot, 'filename')
+        )
+        self._snapshot = None
+
+        return {
+            'cpu_ns': cpu_ns,
+            'render_ns': self.render_ns - self._render_start,
+            'mem_peak_bytes': max(0, mem_peak - self._mem_start),
+            'mem_retained_blocks': retained,
+        }
+
+
+def merge(stats: typing.Iterable[typing.Optional[dict]]) -> dict:
+    """Aggregate the stats of all worker processes."""
+    merged = {
+        'cpu_ns': 0,
+        'render_ns': 0,
+        'mem_peak_bytes': 0,
+        'mem_retained_blocks': 0,
+    }
+    for s in stats:
+        if s is None:
+            continue
+        merged['cpu_ns'] += s['cpu_ns']
+        merged['render_ns'] += s['render_ns']
+        merged['mem_peak_bytes'] = max(
+            merged['mem_peak_bytes'], s['mem_peak_bytes'])
+        merged['mem_retained_blocks'] += s['mem_retained_blocks']
+    return merged
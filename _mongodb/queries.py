@@ -12,6 +12,8 @@ import pymongo
 from pymongo.collection import ReturnDocument
 import random
 
+import _idsample
+
 
 INSERT_PREFIX = 'insert_test__'
 
@@ -34,12 +36,28 @@ def close(ctx, db):
 
 
 def load_ids(ctx, db):
-    users = db.users.aggregate([{'$sample': {'size': ctx.number_of_ids}}])
-    movies = db.movies.aggregate([{'$sample': {'size': ctx.number_of_ids}}])
-    people = db.people.aggregate([{'$sample': {'size': ctx.number_of_ids}}])
+    # Object ids are generated whenever the data is loaded, so the
+    # smallest ones fingerprint the data.
+    fingerprint = tuple(
+        doc['_id']
+        for coll in (db.users, db.movies, db.people)
+        for doc in coll.find({}, {'_id': 1}).sort('_id', 1).limit(1)
+    )
+    ids = _idsample.get(ctx, 'mongodb', fingerprint)
+    if ids is None:
+        def sample(coll, fields):
+            return list(coll.aggregate([
+                {'$sample': {'size': ctx.number_of_ids}},
+                {'$project': fields},
+            ]))
+
+        ids = _idsample.put(ctx, 'mongodb', fingerprint, {
+            'users': sample(db.users, {'_id': 1}),
+            'movies': sample(db.movies, {'_id': 1, 'title': 1}),
+            'people': sample(db.people, {'_id': 1}),
+        })
+    users, movies, people = ids['users'], ids['movies'], ids['people']
 
-    people = list(people)
-    movies = list(movies)
     return dict(
         get_user=[d['_id'] for d in users],
         get_movie=[d['_id'] for d in movies],
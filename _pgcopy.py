@@ -0,0 +1,297 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Bulk loader of the normalized dataset into Postgres-backed schemas.
+
+The dataset is parsed once (or memory-mapped, when given the columnar
+``build/dataset`` directory) and streamed with binary COPY into the
+tables of any number of ORM schemas, each described by a Schema
+mapping of dataset record types and fields to tables and columns.
+Foreign keys and secondary indexes are dropped for the duration of
+the load and rebuilt afterwards.
+"""
+
+
+import argparse
+import asyncio
+import collections
+import datetime
+import json
+import os
+import time
+import typing
+
+import asyncpg
+
+import _columnar
+
+
+class Table(typing.NamedTuple):
+
+    name: str
+    # Dataset field name -> column name.
+    columns: typing.Dict[str, str]
+
+
+class Schema(typing.NamedTuple):
+
+    database: str
+    user: str
+    # Dataset record type -> table.
+    tables: typing.Dict[str, Table]
+
+
+def _tables(names: typing.Dict[str, str]):
+    # All current schemas use the dataset field names for columns.
+    fields = {
+        'user': ['id', 'name', 'image'],
+        'person': ['id', 'first_name', 'middle_name', 'last_name',
+                   'image', 'bio'],
+        'movie': ['id', 'image', 'title', 'year', 'description'],
+        'review': ['id', 'body', 'rating', 'creation_time', 'author_id',
+                   'movie_id'],
+        'directors': ['id', 'list_order', 'person_id', 'movie_id'],
+        'cast': ['id', 'list_order', 'person_id', 'movie_id'],
+    }
+    return {
+        rtype: Table(name=names[rtype], columns={f: f for f in fields[rtype]})
+        for rtype in fields
+    }
+
+
+SCHEMAS = {
+    'postgres': Schema(
+        database='postgres_bench',
+        user='postgres_bench',
+        tables=_tables({
+            'user': 'users',
+            'person': 'persons',
+            'movie': 'movies',
+            'review': 'reviews',
+            'directors': 'directors',
+            'cast': 'actors',
+        }),
+    ),
+    'django': Schema(
+        database='django_bench',
+        user='django_bench',
+        tables=_tables({
+            rtype: f'_django_{rtype}'
+            for rtype in ['user', 'person', 'movie', 'review',
+                          'directors', 'cast']
+        }),
+    ),
+    'sqlalchemy': Schema(
+        database='sqlalch_bench',
+        user='sqlalch_bench',
+        tables=_tables({
+            rtype: rtype
+            for rtype in ['user', 'person', 'movie', 'review',
+                          'directors', 'cast']
+        }),
+    ),
+}
+
+
+def read_dataset(filename):
+    if os.path.isdir(filename):
+        return _columnar.Dataset(filename)
+
+    with open(filename, 'rt') as f:
+        records = json.load(f)
+
+    data = collections.defaultdict(list)
+    for rec in records:
+        rtype = rec['model'].split('.')[-1]
+        datum = rec['fields']
+        if 'pk' in rec:
+            datum['id'] = rec['pk']
+        # convert datetime
+        if rtype == 'review':
+            datum['creation_time'] = datetime.datetime.fromisoformat(
+                datum['creation_time'])
+
+        data[rtype].append(datum)
+
+    return data
+
+
+def quote_ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+async def connect(schema: Schema, *, host='localhost', port=15432):
+    return await asyncpg.connect(
+        user=schema.user, database=schema.database,
+        password='edgedbbenchmark', host=host, port=port)
+
+
+def make_records(table: Table, rtype: str, data):
+    """Return the number of rows of *rtype* and an iterable of them."""
+    fields = [f for f in table.columns if f != 'id']
+
+    if isinstance(data, _columnar.Dataset):
+        columns = data[rtype]
+        if 'id' in columns.columns:
+            return len(columns), columns.iter_rows(['id'] + fields)
+        # Link tables have no ids in the dataset, number them here.
+        return len(columns), (
+            (i, *row)
+            for i, row in enumerate(columns.iter_rows(fields), 1)
+        )
+
+    rows = data[rtype]
+    return len(rows), [
+        (row.get('id', i), *[row.get(f) for f in fields])
+        for i, row in enumerate(rows, 1)
+    ]
+
+
+async def drop_constraints(con, tables: typing.List[str]):
+    """Drop foreign keys and secondary indexes of *tables*.
+
+    Returns the DDL to recreate them once the data is in place.
+    """
+    tables = [quote_ident(t) for t in tables]
+
+    fkeys = await con.fetch('''
+        SELECT
+            conrelid::regclass::text AS tbl,
+            quote_ident(conname) AS conname,
+            pg_get_constraintdef(oid) AS def
+        FROM pg_constraint
+        WHERE contype = 'f' AND conrelid = any($1::regclass[])
+    ''', tables)
+
+    indexes = await con.fetch('''
+        SELECT
+            indexrelid::regclass::text AS name,
+            pg_get_indexdef(indexrelid) AS def
+        FROM pg_index
+        WHERE
+            indrelid = any($1::regclass[])
+            AND NOT indisprimary
+            -- Indexes backing unique constraints have to stay.
+            AND indexrelid NOT IN (SELECT conindid FROM pg_constraint)
+    ''', tables)
+
+    for fk in fkeys:
+        await con.execute(
+            f'ALTER TABLE {fk["tbl"]} DROP CONSTRAINT {fk["conname"]}')
+    for idx in indexes:
+        await con.execute(f'DROP INDEX {idx["name"]}')
+
+    return (
+        [idx['def'] for idx in indexes],
+        [
+            f'ALTER TABLE {fk["tbl"]} ADD CONSTRAINT {fk["conname"]} '
+            f'{fk["def"]}'
+            for fk in fkeys
+        ],
+    )
+
+
+async def _copy_table(schema: Schema, table: Table, rtype: str, data,
+                      **conn_args):
+    start = time.monotonic()
+    count, records = make_records(table, rtype, data)
+    con = await connect(schema, **conn_args)
+    try:
+        await con.copy_records_to_table(
+            table.name,
+            columns=[table.columns['id']] + [
+                col for f, col in table.columns.items() if f != 'id'
+            ],
+            records=records)
+    finally:
+        await con.close()
+    elapsed = time.monotonic() - start
+    print(f'{table.name:<20} {count:>10} rows in {elapsed:.1f}s')
+
+
+async def _execute_all(schema: Schema, statements, **conn_args):
+    con = await connect(schema, **conn_args)
+    try:
+        for stmt in statements:
+            await con.execute(stmt)
+    finally:
+        await con.close()
+
+
+async def load(schema: Schema, data, **conn_args):
+    """Replace the contents of the *schema* tables with *data*."""
+    tables = list(schema.tables.values())
+    names = ', '.join(quote_ident(t.name) for t in tables)
+
+    con = await connect(schema, **conn_args)
+    try:
+        await con.execute(f'TRUNCATE {names}')
+        indexes, fkeys = await drop_constraints(
+            con, [t.name for t in tables])
+    finally:
+        await con.close()
+
+    # Without foreign keys and indexes in the way, all tables can be
+    # streamed in parallel, each over its own connection.
+    await asyncio.gather(*[
+        _copy_table(schema, table, rtype, data, **conn_args)
+        for rtype, table in schema.tables.items()
+    ])
+
+    # Every index is built by a separate backend; foreign keys are
+    # validated afterwards, each in a single pass over its table.
+    start = time.monotonic()
+    await asyncio.gather(*[
+        _execute_all(schema, [idx], **conn_args) for idx in indexes
+    ])
+    await _execute_all(schema, fkeys, **conn_args)
+    print(f'{"indexes":<20} {len(indexes) + len(fkeys):>10} '
+          f'built in {time.monotonic() - start:.1f}s')
+
+    con = await connect(schema, **conn_args)
+    try:
+        for table in tables:
+            name = quote_ident(table.name)
+            await con.execute(f'''
+                SELECT setval(
+                    pg_get_serial_sequence($1, 'id'),
+                    coalesce(max(id), 0) + 1,
+                    false
+                ) FROM {name}
+            ''', name)
+        await con.execute(f'ANALYZE {names}')
+    finally:
+        await con.close()
+
+
+async def load_all(schemas: typing.List[Schema], data, **conn_args):
+    for schema in schemas:
+        print(f'== {schema.database} ==')
+        await load(schema, data, **conn_args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load the dataset into Postgres-backed ORM schemas '
+                    'with COPY, old data will be purged.')
+    parser.add_argument('filename', type=str,
+                        help='The JSON dataset file or the columnar '
+                             'dataset directory')
+    parser.add_argument('schemas', nargs='+', choices=list(SCHEMAS),
+                        help='schemas to load, the dataset is parsed once')
+    parser.add_argument('--host', type=str, default='localhost',
+                        help='PostgreSQL server host')
+    parser.add_argument('--port', type=int, default=15432,
+                        help='PostgreSQL server port')
+
+    args = parser.parse_args()
+
+    data = read_dataset(args.filename)
+    asyncio.run(load_all(
+        [SCHEMAS[name] for name in args.schemas], data,
+        host=args.host, port=args.port))
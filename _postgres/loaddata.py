@@ -14,6 +14,14 @@ import datetime
 import json
 import progress.bar
 
+import _pgcopy
+
+
+async def connect():
+    return await asyncpg.connect(
+        user='postgres_bench', database='postgres_bench',
+        password='edgedbbenchmark', host='localhost', port=15432)
+
 
 class Pool:
 
@@ -38,9 +46,7 @@ class Pool:
                 asyncio.create_task(self._worker()))
 
     async def _worker(self):
-        con = await asyncpg.connect(
-            user='postgres_bench', database='postgres_bench',
-            password='edgedbbenchmark', host='localhost', port=15432)
+        con = await connect()
 
         try:
             while True:
@@ -194,24 +200,33 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(
         description='Load a specific fixture, old data will be purged.')
     parser.add_argument('filename', type=str,
-                        help='The JSON dataset file')
+                        help='The JSON dataset file or, unless --insert '
+                             'is used, the columnar dataset directory')
+    parser.add_argument('--insert', action='store_true',
+                        help='load rows with one INSERT each instead of '
+                             'bulk COPY (slow)')
 
     args = parser.parse_args()
 
-    with open(args.filename, 'rt') as f:
-        records = json.load(f)
-
-    data = collections.defaultdict(list)
-    for rec in records:
-        rtype = rec['model'].split('.')[-1]
-        datum = rec['fields']
-        if 'pk' in rec:
-            datum['id'] = rec['pk']
-        # convert datetime
-        if rtype == 'review':
-            datum['creation_time'] = datetime.datetime.fromisoformat(
-                datum['creation_time'])
-
-        data[rtype].append(datum)
-
-    asyncio.run(import_data(data))
+    if args.insert:
+        with open(args.filename, 'rt') as f:
+            records = json.load(f)
+
+        data = collections.defaultdict(list)
+        for rec in records:
+            rtype = rec['model'].split('.')[-1]
+            datum = rec['fields']
+            if 'pk' in rec:
+                datum['id'] = rec['pk']
+            # convert datetime
+            if rtype == 'review':
+                datum['creation_time'] = datetime.datetime.fromisoformat(
+                    datum['creation_time'])
+
+            data[rtype].append(datum)
+
+        asyncio.run(import_data(data))
+    else:
+        # A columnar dataset directory is memory-mapped, not parsed.
+        data = _pgcopy.read_dataset(args.filename)
+        asyncio.run(_pgcopy.load(_pgcopy.SCHEMAS['postgres'], data))
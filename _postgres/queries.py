@@ -10,6 +10,8 @@ import asyncpg
 import json
 import random
 
+import _idsample
+
 
 ASYNC = True
 INSERT_PREFIX = 'insert_test__'
@@ -29,30 +31,34 @@ async def close(ctx, conn):
 
 
 async def load_ids(ctx, conn):
-    users = await conn.fetch(
-        'SELECT u.id FROM users u ORDER BY random() LIMIT $1',
-        ctx.number_of_ids)
+    # Sample only the ids, by their key range (see _idsample).
+    tables = {'users': 'users', 'movies': 'movies', 'people': 'persons'}
+
+    async def bounds(key):
+        return await conn.fetchrow(
+            f'SELECT min(id), max(id) FROM {tables[key]}')
 
-    movies = await conn.fetch(
-        'SELECT m.id FROM movies m ORDER BY random() LIMIT $1',
-        ctx.number_of_ids)
+    async def fetch(key, batch):
+        rows = await conn.fetch(
+            f'SELECT id FROM {tables[key]} WHERE id = ANY($1)', batch)
+        return [r['id'] for r in rows]
 
-    people = await conn.fetch(
-        'SELECT p.id FROM persons p ORDER BY random() LIMIT $1',
-        ctx.number_of_ids)
+    ids = await _idsample.sample_keys_async(
+        ctx, 'postgres_bench_asyncpg', tables, bounds, fetch)
+    users, movies, people = ids['users'], ids['movies'], ids['people']
 
     return dict(
-        get_user=[u['id'] for u in users],
-        get_movie=[m['id'] for m in movies],
-        get_person=[p['id'] for p in people],
+        get_user=users,
+        get_movie=movies,
+        get_person=people,
         # re-use user IDs for update tests
-        update_movie=[u['id'] for u in movies],
+        update_movie=movies[:],
         # generate as many insert stubs as "concurrency" to
         # accommodate concurrent inserts
         insert_user=[INSERT_PREFIX] * ctx.concurrency,
         insert_movie=[{
             'prefix': INSERT_PREFIX,
-            'people': [p['id'] for p in people[:4]],
+            'people': people[:4],
         }] * ctx.concurrency,
         insert_movie_plus=[INSERT_PREFIX] * ctx.concurrency,
     )
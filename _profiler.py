@@ -0,0 +1,116 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+import collections
+import os
+import sys
+import threading
+import typing
+
+
+# Sampling interval in seconds.  The sampler thread only needs the GIL
+# for a few microseconds per sample, so this keeps the overhead low.
+SAMPLE_INTERVAL = 0.005
+
+# Stacks deeper than this are truncated at the root.
+MAX_DEPTH = 128
+
+
+_STDLIB = os.path.dirname(os.__file__) + os.sep
+
+
+def _frame_label(code) -> str:
+    filename = code.co_filename
+    _, sep, tail = filename.rpartition('site-packages' + os.sep)
+    if sep:
+        filename = tail
+    elif filename.startswith(_STDLIB):
+        filename = filename[len(_STDLIB):]
+    elif filename.startswith(os.getcwd() + os.sep):
+        filename = os.path.relpath(filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+class SamplingProfiler:
+    """Statistical profiler of a single thread of a worker process.
+
+    A background thread periodically captures the stack of the profiled
+    thread (the one that created the profiler) and counts identical
+    stacks in the "collapsed" format understood by flamegraph.pl and
+    speedscope: frames joined with ``;``, outermost first.
+
+    Like ClientInstrumentation, overlapping start()/stop() calls of the
+    connections of an asyncio worker share one sampling window.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self._active = 0
+        self._stacks = None
+        self._stop = None
+        self._sampler = None
+        self._labels = {}
+
+    def _label(self, code) -> str:
+        try:
+            return self._labels[code]
+        except KeyError:
+            label = self._labels[code] = _frame_label(code)
+            return label
+
+    def _sample(self, stacks, stop):
+        while not stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_DEPTH:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                stacks[';'.join(stack)] += 1
+
+    def start(self):
+        self._active += 1
+        if self._active > 1:
+            return
+
+        self._stacks = collections.Counter()
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(
+            target=self._sample, args=(self._stacks, self._stop),
+            daemon=True)
+        self._sampler.start()
+
+    def stop(self) -> typing.Optional[collections.Counter]:
+        """Stop sampling; return the stacks if it was the last window."""
+        self._active -= 1
+        if self._active > 0:
+            return None
+
+        self._stop.set()
+        self._sampler.join()
+        stacks, self._stacks = self._stacks, None
+        self._sampler = self._stop = None
+        return stacks
+
+
+def merge(profiles: typing.Iterable[typing.Optional[collections.Counter]]
+          ) -> collections.Counter:
+    """Sum the stacks sampled in all worker processes."""
+    merged = collections.Counter()
+    for profile in profiles:
+        if profile is not None:
+            merged.update(profile)
+    return merged
+
+
+def write_collapsed(profile: collections.Counter, filename: str):
+    with open(filename, 'wt') as f:
+        for stack, count in sorted(profile.items()):
+            f.write(f'{stack} {count}\n')
@@ -7,92 +7,91 @@
 
 
 import argparse
+import importlib
+import json
+import subprocess
 import sys
 import types
 import typing
 
-
-from _edgedb import queries_json as edgedb_queries_json
-from _edgedb import queries_async as edgedb_queries_async
-from _edgedb import queries_repack as edgedb_queries_repack
-from _go.edgedb import queries_edgedb as edgedb_json_golang
-from _go.postgres import queries_pq as postgres_pq_golang
-from _go.postgres import queries_pgx as postgres_pgx_golang
-from _go.http import queries_graphql as edgedb_graphql_golang
-from _go.http import queries_hasura as postgres_hasura_golang
-from _go.http import queries_postgraphile as postgres_postgraphile_golang
-from _go.http import queries_http as edgedb_edgeql_golang
-from _django import queries as django_queries
-from _django import queries_restfw as django_queries_restfw
-from _mongodb import queries as mongodb_queries
-from _sqlalchemy import queries as sqlalchemy_queries
-from _sqlalchemy import queries_asyncio as sqlalchemy_queries_asyncio
-from _postgres import queries as postgres_queries
-from _postgres import queries_psycopg as postgres_psycopg_queries
+import _iddist
 
 
 class impl(typing.NamedTuple):
     language: str
     title: str
-    module: typing.Optional[types.ModuleType]
+    # Dotted path to the Python module implementing the benchmark
+    # queries (or driving the external runner).  It is only imported
+    # when the `module` attribute is first accessed, so that picking
+    # a single implementation does not import every ORM and driver.
+    module_name: typing.Optional[str]
+
+    @property
+    def module(self) -> typing.Optional[types.ModuleType]:
+        if self.module_name is None:
+            return None
+        return importlib.import_module(self.module_name)
 
 
 IMPLEMENTATIONS = {
 
     'edgedb_py_json':
-        impl('python', 'EdgeDB (Python, JSON)', edgedb_queries_json),
+        impl('python', 'EdgeDB (Python, JSON)', '_edgedb.queries_json'),
 
     'edgedb_py_json_async':
-        impl('python', 'EdgeDB (Python, JSON, asyncio)', edgedb_queries_async),
+        impl('python', 'EdgeDB (Python, JSON, asyncio)',
+             '_edgedb.queries_async'),
 
     'edgedb_py_sync':
-        impl('python', 'EdgeDB (Python)', edgedb_queries_repack),
+        impl('python', 'EdgeDB (Python)', '_edgedb.queries_repack'),
 
     'edgedb_go':
-        impl('go', 'EdgeDB (Go)', edgedb_json_golang),
+        impl('go', 'EdgeDB (Go)', '_go.edgedb.queries_edgedb'),
 
     'edgedb_go_json':
-        impl('go', 'EdgeDB (Go, JSON)', edgedb_json_golang),
+        impl('go', 'EdgeDB (Go, JSON)', '_go.edgedb.queries_edgedb'),
 
     'edgedb_go_graphql':
-        impl('go', 'EdgeDB (GraphQL)', edgedb_graphql_golang),
+        impl('go', 'EdgeDB (GraphQL)', '_go.http.queries_graphql'),
 
     'edgedb_go_http':
-        impl('go', 'EdgeDB (HTTP)', edgedb_edgeql_golang),
+        impl('go', 'EdgeDB (HTTP)', '_go.http.queries_http'),
 
     'django':
-        impl('python', 'Django ORM', django_queries),
+        impl('python', 'Django ORM', '_django.queries'),
 
     'django_restfw':
-        impl('python', 'Django (Rest Framework)', django_queries_restfw),
+        impl('python', 'Django (Rest Framework)', '_django.queries_restfw'),
 
     'mongodb':
-        impl('python', 'MongoDB (Python)', mongodb_queries),
+        impl('python', 'MongoDB (Python)', '_mongodb.queries'),
 
     'sqlalchemy':
-        impl('python', 'SQLAlchemy', sqlalchemy_queries),
+        impl('python', 'SQLAlchemy', '_sqlalchemy.queries'),
 
     'sqlalchemy_asyncio':
-        impl('python', 'SQLAlchemy (asyncio)', sqlalchemy_queries_asyncio),
+        impl('python', 'SQLAlchemy (asyncio)',
+             '_sqlalchemy.queries_asyncio'),
 
     'postgres_asyncpg':
-        impl('python', 'PostgreSQL (Python, asyncpg)', postgres_queries),
+        impl('python', 'PostgreSQL (Python, asyncpg)', '_postgres.queries'),
 
     'postgres_psycopg':
-        impl('python', 'PostgreSQL (Python, psycopg2)', postgres_psycopg_queries),
+        impl('python', 'PostgreSQL (Python, psycopg2)',
+             '_postgres.queries_psycopg'),
 
     'postgres_pq':
-        impl('go', 'PostgreSQL (Go, pq)', postgres_pq_golang),
+        impl('go', 'PostgreSQL (Go, pq)', '_go.postgres.queries_pq'),
 
     'postgres_pgx':
-        impl('go', 'PostgreSQL (Go, pgx)', postgres_pgx_golang),
+        impl('go', 'PostgreSQL (Go, pgx)', '_go.postgres.queries_pgx'),
 
     'postgres_hasura_go':
-        impl('go', 'Hasura + Postgres (Go)', postgres_hasura_golang),
+        impl('go', 'Hasura + Postgres (Go)', '_go.http.queries_hasura'),
 
     'postgres_postgraphile_go':
         impl('go', 'Postgraphile (Go)',
-             postgres_postgraphile_golang),
+             '_go.http.queries_postgraphile'),
 
     'edgedb_js':
         impl('js', 'EdgeDB (Node.js)', None),
@@ -135,6 +134,30 @@ IMPLEMENTATIONS = {
 }
 
 
+def measure_import_time(benchname: str) -> typing.Optional[float]:
+    """Return the time, in seconds, to import the module of *benchname*.
+
+    The import is timed in a fresh interpreter, so that modules already
+    loaded into the current process do not skew the result.  Returns
+    None for implementations without a Python module.
+    """
+    module_name = IMPLEMENTATIONS[benchname].module_name
+    if module_name is None:
+        return None
+
+    code = (
+        'import time; '
+        'start = time.perf_counter(); '
+        f'import {module_name}; '
+        'print(time.perf_counter() - start)'
+    )
+    proc = subprocess.run(
+        [sys.executable, '-c', code],
+        text=True, capture_output=True, check=True,
+    )
+    return float(proc.stdout.strip().splitlines()[-1])
+
+
 class bench(typing.NamedTuple):
     title: str
     description: str
@@ -198,8 +221,74 @@ BENCHMARKS = {
 }
 
 
+# Name of the aggregate results of a mixed workload (--mix); results of
+# the individual queries of the mix are named by mixed_queryname().
+MIXED = 'mixed'
+
+
+def mixed_queryname(queryname: str) -> str:
+    return f'{MIXED}__{queryname}'
+
+
+def parse_mix(spec: str) -> typing.Dict[str, int]:
+    """Parse a "get_movie=70,get_user=20,update_movie=10" mix spec."""
+    mix = {}
+    for item in spec.split(','):
+        queryname, sep, weight = item.strip().partition('=')
+        if not sep or queryname not in BENCHMARKS:
+            raise argparse.ArgumentTypeError(
+                f'invalid mix item {item!r}, expected <query>=<weight> '
+                f'with one of: {", ".join(BENCHMARKS)}')
+        try:
+            mix[queryname] = int(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                f'invalid weight in mix item {item!r}') from None
+        if mix[queryname] <= 0:
+            raise argparse.ArgumentTypeError(
+                f'weight in mix item {item!r} must be positive')
+    return mix
+
+
+def format_mix(mix: typing.Dict[str, int]) -> str:
+    return ','.join(f'{q}={w}' for q, w in mix.items())
+
+
+def mix_benchmarks(mix: typing.Dict[str, int]) -> typing.Dict[str, bench]:
+    """Describe the aggregate and per-query results of a mixed workload."""
+    total = sum(mix.values())
+    shares = {q: round(100 * w / total, 1) for q, w in mix.items()}
+    benchmarks = {
+        MIXED: bench(
+            title='Mixed workload',
+            description=(
+                'Every request is drawn from a weighted mix of queries: ' +
+                ', '.join(f'{BENCHMARKS[q].title} ({shares[q]}%)'
+                          for q in mix) + '.'
+            ),
+        ),
+    }
+    for q in mix:
+        benchmarks[mixed_queryname(q)] = bench(
+            title=f'Mixed workload: {BENCHMARKS[q].title}',
+            description=(
+                f'{BENCHMARKS[q].description} '
+                f'{shares[q]}% of the requests of the mixed workload.'
+            ),
+        )
+    return benchmarks
+
+
+def benchmark_descriptions(args) -> typing.Dict[str, bench]:
+    if args.mix:
+        return {**BENCHMARKS, **mix_benchmarks(args.mix)}
+    return BENCHMARKS
+
+
 def parse_args(*, prog_desc: str, out_to_json: bool = False,
-               out_to_html: bool = False):
+               out_to_html: bool = False, sweep: bool = False,
+               parallel_drivers: bool = False, repeat: bool = False,
+               history: bool = False):
     parser = argparse.ArgumentParser(
         description=prog_desc,
         formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -225,6 +314,46 @@ def parse_args(*, prog_desc: str, out_to_json: bool = False,
     parser.add_argument(
         '--warmup-time', type=int, default=5,
         help='duration of warmup period for each benchmark in seconds')
+    parser.add_argument(
+        '--adaptive', action='store_true',
+        help='end warmup once throughput and latency are steady, and '
+             'measurement once mean and p99 latency are precise enough '
+             '(see --ci-width); --warmup-time and --duration become '
+             'upper bounds (Python drivers only)')
+    parser.add_argument(
+        '--min-duration', type=int, default=5,
+        help='minimal duration of measurement in --adaptive runs, in '
+             'seconds')
+    parser.add_argument(
+        '--ci-width', type=float, default=0.02,
+        help='target half-width of the 95%% confidence intervals of mean '
+             'and p99 latency in --adaptive runs, relative to their value')
+    parser.add_argument(
+        '--rate', type=float, default=0,
+        help='target aggregate request rate in queries per second; when '
+             'set, requests are sent on a fixed timetable (open loop) '
+             'instead of back-to-back (Python drivers only)')
+    parser.add_argument(
+        '--instrument', action='store_true',
+        help='measure client-side CPU time (split into driver and result '
+             'rendering) and allocations per query; adds overhead, so '
+             'throughput of instrumented runs is not comparable '
+             '(Python drivers only)')
+    parser.add_argument(
+        '--profile', action='store_true',
+        help='sample the stacks of every worker during the measured '
+             'window and write a collapsed-stack (flamegraph) file per '
+             'implementation and query (Python drivers only)')
+    parser.add_argument(
+        '--profile-prefix', type=str, default='',
+        help='path prefix of --profile output files; defaults to the '
+             'JSON report filename without extension')
+    parser.add_argument(
+        '--reset', choices=['cleanup', 'snapshot'], default='cleanup',
+        help='how mutation benchmarks reset the database: "cleanup" '
+             'deletes the inserted rows, "snapshot" restores a snapshot '
+             'of the loaded database (see _snapshot.py) before every '
+             'mutation benchmark')
     parser.add_argument(
         '--net-latency', default=0, type=int,
         help='assumed p0 roundtrip latency between a database and a client')
@@ -244,11 +373,34 @@ def parse_args(*, prog_desc: str, out_to_json: bool = False,
         '--number-of-ids', type=int, default=250,
         help='number of random IDs to fetch data with in benchmarks')
 
+    parser.add_argument(
+        '--resample-ids', action='store_true',
+        help='sample new IDs instead of the ones cached for the loaded '
+             'data in dataset/build/ids (see _idsample.py)')
+
+    parser.add_argument(
+        '--id-distribution', type=_iddist.parse_id_distribution,
+        default=_iddist.UNIFORM, metavar='uniform|zipf:S|hotset:PCT',
+        help='how often each of the ids is accessed: "uniform", '
+             '"zipf:<s>" (the k-th most accessed id gets a share '
+             'proportional to 1/k^s) or "hotset:<pct>[:<share>]" '
+             '(<share> percent of requests, 90 by default, go to <pct> '
+             'percent of the ids); see _iddist.py (Python drivers only)')
+
     parser.add_argument(
         '--query', dest='queries', action='append',
         help='queries to benchmark',
         choices=list(BENCHMARKS.keys()) + ['all'])
 
+    parser.add_argument(
+        '--mix', type=parse_mix, default=None,
+        metavar='QUERY=WEIGHT,...',
+        help='run a single mixed workload instead of separate queries: '
+             'every request is drawn from the queries with the given '
+             'weights, e.g. "get_movie=70,get_user=20,update_movie=10"; '
+             'results are reported per query and in aggregate '
+             '(Python drivers only)')
+
     parser.add_argument(
         'benchmarks', nargs='+', help='benchmarks names',
         choices=list(IMPLEMENTATIONS.keys()) + ['all'])
@@ -263,16 +415,85 @@ def parse_args(*, prog_desc: str, out_to_json: bool = False,
             '--html', type=str, default='',
             help='filename to dump HTML report')
 
+    if parallel_drivers:
+        parser.add_argument(
+            '--parallel-drivers', action='store_true', default=False,
+            help='run the drivers of different languages concurrently, '
+                 'each pinned to a disjoint set of CPUs')
+        parser.add_argument(
+            '--driver-opts', action='append', metavar='LANG:OPTIONS',
+            help='extra options for the driver of a given language, '
+                 'e.g. "go:--db-host 10.0.0.3"; use it to point parallel '
+                 'drivers at separate databases')
+
+    if repeat:
+        parser.add_argument(
+            '--repeat', type=int, default=1,
+            help='number of trials of every benchmark; implementations '
+                 'run in a random order in every trial, and reports '
+                 'include 95%% bootstrap confidence intervals of the '
+                 'metrics over trials')
+
+    if history:
+        parser.add_argument(
+            '--history', type=str, default='',
+            help='SQLite file to record the run and its results in; '
+                 'history.sqlite in the repository by default (see '
+                 'history.py)')
+        parser.add_argument(
+            '--no-history', action='store_true',
+            help='do not record the run in the results history')
+
+    if sweep:
+        parser.add_argument(
+            '--slo-p99', type=float, default=50,
+            help='p99 latency objective in milliseconds; a step that '
+                 'exceeds it is considered past saturation')
+        parser.add_argument(
+            '--min-gain', type=float, default=0.05,
+            help='minimal relative throughput gain of a step over the '
+                 'best previous step to continue the sweep')
+        parser.add_argument(
+            '--sweep-factor', type=float, default=2,
+            help='geometric factor applied to concurrency (or to --rate) '
+                 'at every step')
+        parser.add_argument(
+            '--max-concurrency', type=int, default=256,
+            help='upper bound for swept concurrency')
+        parser.add_argument(
+            '--max-steps', type=int, default=12,
+            help='upper bound for the number of steps per implementation')
+
     args = parser.parse_args()
     argv = sys.argv[1:]
 
-    if not args.queries:
+    if args.mix:
+        if args.queries:
+            raise Exception("'--mix' and '--query' are mutually exclusive")
+        args.queries = [MIXED]
+    elif not args.queries:
         args.queries = list(BENCHMARKS.keys())
 
     if args.concurrency % args.async_split != 0:
         raise Exception(
             "'--concurrency' must be an integer multiple of '--async-split'")
 
+    if args.rate < 0:
+        raise Exception("'--rate' must not be negative")
+
+    if args.adaptive and not 0 < args.min_duration <= args.duration:
+        raise Exception(
+            "'--min-duration' must be positive and at most '--duration'")
+
+    if args.ci_width <= 0:
+        raise Exception("'--ci-width' must be positive")
+
+    if repeat and args.repeat < 1:
+        raise Exception("'--repeat' must be at least 1")
+
+    if sweep and args.sweep_factor <= 1:
+        raise Exception("'--sweep-factor' must be greater than 1")
+
     if 'all' in args.benchmarks:
         args.benchmarks = list(IMPLEMENTATIONS.keys())
 
@@ -284,4 +505,92 @@ def parse_args(*, prog_desc: str, out_to_json: bool = False,
         i = argv.index('--html')
         del argv[i:i + 2]
 
+    if repeat and '--repeat' in argv:
+        i = argv.index('--repeat')
+        del argv[i:i + 2]
+
+    if history:
+        if args.history:
+            i = argv.index('--history')
+            del argv[i:i + 2]
+        if args.no_history:
+            argv.remove('--no-history')
+
+    if parallel_drivers:
+        for opt in args.driver_opts or []:
+            lang, _, _ = opt.partition(':')
+            if lang not in {'python', 'go', 'js', 'dart'}:
+                raise Exception(
+                    f"'--driver-opts': unknown driver language {lang!r}")
+
+        if args.parallel_drivers:
+            argv.remove('--parallel-drivers')
+        while '--driver-opts' in argv:
+            i = argv.index('--driver-opts')
+            del argv[i:i + 2]
+
     return args, argv
+
+
+class ResultsStream:
+    """Newline-delimited JSON output of a language driver.
+
+    Every finished (implementation, query) benchmark is written out as
+    a single self-contained JSON line and flushed immediately, so that
+    bench.py can aggregate results while the driver is still running,
+    and results of completed benchmarks survive a crash.
+    """
+
+    def __init__(self, ctx, language: str, *, rate: float = 0):
+        self.ctx = ctx
+        self.language = language
+        # Target rate of open-loop runs, for runners that support it.
+        self.rate = rate
+        self.file = open(ctx.json, 'wt') if ctx.json else None
+
+    def write(self, result):
+        if self.file is None:
+            return
+
+        query = {
+            'queryname': result.queryname,
+            'nqueries': result.nqueries,
+            'min_latency': result.min_latency,
+            'max_latency': result.max_latency,
+            'latency_stats': result.latency_stats.encode(),
+            'samples': result.samples,
+        }
+        if hasattr(result, 'backlog'):
+            query['backlog'] = result.backlog
+        if getattr(result, 'client_stats', None) is not None:
+            query['client_stats'] = result.client_stats
+        if getattr(result, 'timeseries', None) is not None:
+            query['timeseries'] = result.timeseries.encode()
+
+        warmup_time = getattr(result, 'warmup_time', None)
+        if warmup_time is None:
+            warmup_time = self.ctx.warmup_time
+
+        record = {
+            'language': self.language,
+            'concurrency': self.ctx.concurrency,
+            'warmup_time': warmup_time,
+            'rate': self.rate,
+            'benchmark': result.benchmark,
+            'duration': result.duration,
+            'query': query,
+        }
+
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,305 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Snapshots of the freshly loaded benchmark databases.
+
+With ``--reset snapshot`` the runners restore the database of an
+implementation from its snapshot before every mutation benchmark (and
+once more after the last one) instead of deleting the inserted rows
+with the setup()/cleanup() queries of the implementation.  Every
+mutation benchmark then starts from an identical, vacuumed state.
+
+Snapshots are taken on first use and dropped by the ``make load-*``
+targets, or managed explicitly:
+
+    $ python _snapshot.py take postgres django
+"""
+
+
+import argparse
+import contextlib
+import typing
+
+
+# Benchmarks that modify the database.
+MUTATIONS = {'update_movie', 'insert_user', 'insert_movie',
+             'insert_movie_plus'}
+
+
+class PostgresSnapshot(typing.NamedTuple):
+    """A template database copy of a Postgres database."""
+
+    database: str
+    owner: str
+
+    @property
+    def name(self):
+        return f'{self.database}_snapshot'
+
+    def _connect(self, ctx, database='postgres'):
+        import psycopg2
+
+        conn = psycopg2.connect(
+            user='postgres', dbname=database, host=ctx.db_host,
+            port=ctx.pg_port)
+        # CREATE/DROP DATABASE cannot run in a transaction.
+        conn.autocommit = True
+        return conn
+
+    def exists(self, ctx) -> bool:
+        with contextlib.closing(self._connect(ctx)) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                'SELECT 1 FROM pg_database WHERE datname = %s', [self.name])
+            return cur.fetchone() is not None
+
+    def take(self, ctx):
+        # Freeze and analyze first: copies start without dead tuples,
+        # with all pages all-visible and with fresh statistics.
+        with contextlib.closing(self._connect(ctx, self.database)) as conn:
+            conn.cursor().execute('VACUUM (FREEZE, ANALYZE)')
+
+        with contextlib.closing(self._connect(ctx)) as conn:
+            cur = conn.cursor()
+            # A template database must not have other sessions.
+            cur.execute('''
+                SELECT pg_terminate_backend(pid)
+                FROM pg_stat_activity
+                WHERE datname = %s AND pid <> pg_backend_pid()
+            ''', [self.database])
+            cur.execute(f'DROP DATABASE IF EXISTS {self.name}')
+            cur.execute(
+                f'CREATE DATABASE {self.name} TEMPLATE {self.database} '
+                f'OWNER {self.owner}')
+
+    def restore(self, ctx):
+        with contextlib.closing(self._connect(ctx)) as conn:
+            cur = conn.cursor()
+            cur.execute(
+                f'DROP DATABASE IF EXISTS {self.database} WITH (FORCE)')
+            cur.execute(
+                f'CREATE DATABASE {self.database} TEMPLATE {self.name} '
+                f'OWNER {self.owner}')
+
+    def drop(self, ctx):
+        with contextlib.closing(self._connect(ctx)) as conn:
+            conn.cursor().execute(f'DROP DATABASE IF EXISTS {self.name}')
+
+
+class EdgeDBSnapshot(typing.NamedTuple):
+    """A data branch copy of the EdgeDB branch used by the benchmarks.
+
+    Requires EdgeDB 5 or later.  Branches are created and dropped from
+    a separate, empty branch, as the copied one must not be in use.
+    """
+
+    admin_branch: str = 'bench_admin'
+
+    def _client(self, ctx, branch=None):
+        import edgedb
+
+        return edgedb.create_client(database=branch)
+
+    def _branches(self, client) -> typing.Set[str]:
+        return set(client.query('SELECT sys::Database.name'))
+
+    def _admin(self, ctx):
+        """Return the admin client and the name of the benchmark branch."""
+        client = self._client(ctx)
+        try:
+            branch = client.query_single('SELECT sys::get_current_database()')
+            if self.admin_branch not in self._branches(client):
+                client.execute(f'CREATE EMPTY BRANCH {self.admin_branch}')
+        finally:
+            client.close()
+        return self._client(ctx, self.admin_branch), branch
+
+    def exists(self, ctx) -> bool:
+        client = self._client(ctx)
+        try:
+            branch = client.query_single('SELECT sys::get_current_database()')
+            return f'{branch}_snapshot' in self._branches(client)
+        finally:
+            client.close()
+
+    def take(self, ctx):
+        admin, branch = self._admin(ctx)
+        try:
+            if f'{branch}_snapshot' in self._branches(admin):
+                admin.execute(f'DROP BRANCH {branch}_snapshot FORCE')
+            admin.execute(
+                f'CREATE DATA BRANCH {branch}_snapshot FROM {branch}')
+        finally:
+            admin.close()
+
+    def restore(self, ctx):
+        admin, branch = self._admin(ctx)
+        try:
+            admin.execute(f'DROP BRANCH {branch} FORCE')
+            admin.execute(
+                f'CREATE DATA BRANCH {branch} FROM {branch}_snapshot')
+        finally:
+            admin.close()
+
+    def drop(self, ctx):
+        admin, branch = self._admin(ctx)
+        try:
+            if f'{branch}_snapshot' in self._branches(admin):
+                admin.execute(f'DROP BRANCH {branch}_snapshot FORCE')
+        finally:
+            admin.close()
+
+
+class MongoSnapshot(typing.NamedTuple):
+    """Copies of every collection of the MongoDB database."""
+
+    database: str = 'movies'
+    suffix: str = '__snapshot'
+
+    @contextlib.contextmanager
+    def _db(self, ctx):
+        import pymongo
+
+        client = pymongo.MongoClient(host=ctx.db_host, port=ctx.mongodb_port)
+        try:
+            yield client[self.database]
+        finally:
+            client.close()
+
+    def _collections(self, db) -> typing.List[str]:
+        return [
+            name for name in db.list_collection_names()
+            if not name.endswith(self.suffix)
+        ]
+
+    def exists(self, ctx) -> bool:
+        with self._db(ctx) as db:
+            names = set(db.list_collection_names())
+            collections = self._collections(db)
+            # An empty database has nothing to restore from.
+            return bool(collections) and all(
+                f'{name}{self.suffix}' in names for name in collections)
+
+    def take(self, ctx):
+        with self._db(ctx) as db:
+            for name in self._collections(db):
+                db[name].aggregate([{'$out': f'{name}{self.suffix}'}])
+
+    def restore(self, ctx):
+        with self._db(ctx) as db:
+            for name in self._collections(db):
+                # $out replaces the documents of the collection in one
+                # go, and keeps its indexes.
+                db[f'{name}{self.suffix}'].aggregate([{'$out': name}])
+
+    def drop(self, ctx):
+        with self._db(ctx) as db:
+            for name in self._collections(db):
+                db.drop_collection(f'{name}{self.suffix}')
+
+
+SNAPSHOTS = {
+    'postgres': PostgresSnapshot('postgres_bench', 'postgres_bench'),
+    'django': PostgresSnapshot('django_bench', 'django_bench'),
+    'sqlalchemy': PostgresSnapshot('sqlalch_bench', 'sqlalch_bench'),
+    'typeorm': PostgresSnapshot('typeorm_bench', 'typeorm_bench'),
+    'sequelize': PostgresSnapshot('sequelize_bench', 'sequelize_bench'),
+    'edgedb': EdgeDBSnapshot(),
+    'mongodb': MongoSnapshot(),
+}
+
+# Implementation -> snapshot of its database.  Implementations behind
+# a separate server (Hasura, Postgraphile) cannot have their database
+# replaced under them and always use setup()/cleanup().
+IMPLEMENTATIONS = {
+    'edgedb_py_json': 'edgedb',
+    'edgedb_py_json_async': 'edgedb',
+    'edgedb_py_sync': 'edgedb',
+    'edgedb_go': 'edgedb',
+    'edgedb_go_json': 'edgedb',
+    'edgedb_go_graphql': 'edgedb',
+    'edgedb_go_http': 'edgedb',
+    'edgedb_js': 'edgedb',
+    'edgedb_js_json': 'edgedb',
+    'edgedb_js_qb': 'edgedb',
+    'edgedb_js_qb_uncached': 'edgedb',
+    'edgedb_dart': 'edgedb',
+    'edgedb_dart_json': 'edgedb',
+    'django': 'django',
+    'django_restfw': 'django',
+    'mongodb': 'mongodb',
+    'sqlalchemy': 'sqlalchemy',
+    'sqlalchemy_asyncio': 'sqlalchemy',
+    'postgres_asyncpg': 'postgres',
+    'postgres_psycopg': 'postgres',
+    'postgres_pq': 'postgres',
+    'postgres_pgx': 'postgres',
+    'postgres_pg': 'postgres',
+    'postgres_dart': 'postgres',
+    'prisma': 'postgres',
+    'prisma_untuned': 'postgres',
+    'drizzle': 'postgres',
+    'typeorm': 'typeorm',
+    'sequelize': 'sequelize',
+}
+
+
+def prepare(ctx, benchname):
+    """Return the snapshot to reset *benchname* with, or None.
+
+    The snapshot is taken if it does not exist yet, so this must be
+    called before the benchmark connects to its database.
+    """
+    if ctx.reset != 'snapshot':
+        return None
+
+    target = IMPLEMENTATIONS.get(benchname)
+    if target is None:
+        print(f'{benchname}: no snapshot support, using cleanup queries')
+        return None
+
+    snapshot = SNAPSHOTS[target]
+    if not snapshot.exists(ctx):
+        print(f'taking a snapshot of the {target} database...')
+        snapshot.take(ctx)
+    return snapshot
+
+
+def mutates(querynames: typing.Iterable[str]) -> bool:
+    return any(q in MUTATIONS for q in querynames)
+
+
+def needs_restore(snapshot, querynames: typing.Iterable[str],
+                  dirty: bool) -> bool:
+    """Whether to restore the snapshot before benchmarking *querynames*.
+
+    *querynames* are the queries of the benchmark (several of them in
+    a mixed workload).  *dirty* tells if a previous benchmark of the
+    same implementation has modified the database since the last
+    restore.
+    """
+    return snapshot is not None and (dirty or mutates(querynames))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Manage snapshots of the benchmark databases.')
+    parser.add_argument('action', choices=['take', 'restore', 'drop'])
+    parser.add_argument('targets', nargs='+', choices=list(SNAPSHOTS))
+    parser.add_argument('--db-host', type=str, default='127.0.0.1',
+                        help='host with databases')
+    parser.add_argument('--pg-port', type=int, default=15432,
+                        help='PostgreSQL server port')
+    parser.add_argument('--mongodb-port', type=int, default=27017,
+                        help='MongoDB server port')
+
+    args = parser.parse_args()
+
+    for target in args.targets:
+        getattr(SNAPSHOTS[target], args.action)(args)
+        print(f'{args.action}: {target}')
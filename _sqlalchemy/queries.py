@@ -12,6 +12,8 @@ import sqlalchemy as sa
 import sqlalchemy.orm as orm
 import _sqlalchemy.models as m
 
+import _idsample
+
 
 engine = None
 session_factory = None
@@ -38,31 +40,35 @@ def close(ctx, sess):
 
 
 def load_ids(ctx, sess):
-    users = sess.scalars(
-        sa.select(m.User).order_by(sa.func.random()).limit(ctx.number_of_ids)
-    ).all()
+    # Sample only the ids, by their key range (see _idsample).
+    tables = {"users": m.User, "movies": m.Movie, "people": m.Person}
 
-    movies = sess.scalars(
-        sa.select(m.Movie).order_by(sa.func.random()).limit(ctx.number_of_ids)
-    ).all()
+    def bounds(key):
+        model = tables[key]
+        stmt = sa.select(sa.func.min(model.id), sa.func.max(model.id))
+        return sess.execute(stmt).one()
 
-    people = sess.scalars(
-        sa.select(m.Person).order_by(sa.func.random()).limit(ctx.number_of_ids)
-    ).all()
+    def fetch(key, batch):
+        model = tables[key]
+        stmt = sa.select(model.id).where(model.id.in_(batch))
+        return sess.scalars(stmt).all()
+
+    ids = _idsample.sample_keys(ctx, "sqlalch_bench", tables, bounds, fetch)
+    users, movies, people = ids["users"], ids["movies"], ids["people"]
 
     return dict(
-        get_user=[u.id for u in users],
-        get_movie=[m.id for m in movies],
-        get_person=[p.id for p in people],
+        get_user=users,
+        get_movie=movies,
+        get_person=people,
         # re-use user IDs for update tests
-        update_movie=[m.id for m in movies],
+        update_movie=movies[:],
         # generate as many insert stubs as "concurrency" to
         # accommodate concurrent inserts
         insert_user=[INSERT_PREFIX] * ctx.concurrency,
         insert_movie=[
             {
                 "prefix": INSERT_PREFIX,
-                "people": [p.id for p in people[:4]],
+                "people": people[:4],
             }
         ]
         * ctx.concurrency,
@@ -0,0 +1,95 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Bootstrap confidence intervals of benchmark metrics.
+
+Samples are small (a handful of --repeat trials, or the batch means
+of the per-second intervals of a single run) and far from normal, so
+intervals are estimated with the percentile bootstrap rather than from
+a t distribution.  Resampling uses a fixed seed: the same data always
+produces the same report.
+"""
+
+
+import math
+import random
+import typing
+
+
+# Number of bootstrap resamples.
+RESAMPLES = 2000
+
+CONFIDENCE = 0.95
+
+_SEED = 0
+
+
+def mean(values: typing.Sequence[float]) -> float:
+    return sum(values) / len(values)
+
+
+def batch_means(values: typing.Sequence[float]) -> typing.List[float]:
+    """Return the means of consecutive batches of *values*.
+
+    Consecutive intervals of a run are correlated (a stall or a cache
+    warming up spans several seconds), so resampling them one by one
+    understates the variance.  Batches of about sqrt(n) values are
+    closer to independent; the incomplete last batch is dropped.
+    """
+    size = max(1, round(math.sqrt(len(values))))
+    return [
+        mean(values[i:i + size])
+        for i in range(0, len(values) - size + 1, size)
+    ]
+
+
+def _percentile_interval(estimates: typing.List[float], confidence: float
+                         ) -> typing.Tuple[float, float]:
+    estimates.sort()
+    tail = (1 - confidence) / 2
+    lo = estimates[int(tail * (len(estimates) - 1))]
+    hi = estimates[int(round((1 - tail) * (len(estimates) - 1)))]
+    return lo, hi
+
+
+def bootstrap_ci(values: typing.Sequence[float], *,
+                 confidence: float = CONFIDENCE
+                 ) -> typing.Tuple[float, float]:
+    """Return the confidence interval of the mean of *values*."""
+    if len(values) < 2:
+        return values[0], values[0]
+    rng = random.Random(_SEED)
+    n = len(values)
+    estimates = [
+        mean(rng.choices(values, k=n)) for _ in range(RESAMPLES)
+    ]
+    return _percentile_interval(estimates, confidence)
+
+
+def bootstrap_change(base: typing.Sequence[float],
+                     new: typing.Sequence[float], *,
+                     confidence: float = CONFIDENCE
+                     ) -> typing.Tuple[float, float, float]:
+    """Return the relative change of the mean from *base* to *new*.
+
+    Returns ``(change, lo, hi)``, where lo and hi bound the confidence
+    interval of the change.  The change is significant if the interval
+    does not include zero.
+    """
+    base_mean = mean(base)
+    if not base_mean:
+        return 0.0, 0.0, 0.0
+    change = mean(new) / base_mean - 1
+    rng = random.Random(_SEED)
+    estimates = []
+    for _ in range(RESAMPLES):
+        b = mean(rng.choices(base, k=len(base)))
+        if b:
+            estimates.append(mean(rng.choices(new, k=len(new))) / b - 1)
+    lo, hi = _percentile_interval(estimates, confidence)
+    return change, lo, hi
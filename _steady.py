@@ -0,0 +1,149 @@
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Steady-state detection and stopping rules of adaptive runs.
+
+With ``--adaptive`` the latencies of all connections are collected in
+one-second intervals (see _histogram.LatencyTimeSeries) while the
+benchmark runs:
+
+* warmup ends once the last WINDOW intervals show no trend in either
+  throughput or mean latency, or after ``--warmup-time``;
+* measurement ends once the 95% confidence intervals of both mean and
+  p99 latency are within ``--ci-width`` of their value, estimated from
+  the means of the intervals (batch means), but not before
+  ``--min-duration`` and not after ``--duration``.
+"""
+
+
+import math
+import typing
+
+import _histogram
+
+
+# Number of intervals that must be free of trends to end warmup.
+WINDOW = 5
+
+# Largest change over the window, relative to the mean, of a series
+# that is considered stable.
+TREND_TOLERANCE = 0.05
+
+# Two-sided 95% quantiles of Student's t distribution by degrees of
+# freedom; the normal quantile is close enough for more.
+_T95 = [
+    12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+    2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+    2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+
+def t95(df: int) -> float:
+    return _T95[df - 1] if df <= len(_T95) else 1.96
+
+
+def relative_trend(values: typing.Sequence[float]) -> float:
+    """Least-squares change over *values*, relative to their mean.
+
+    The change is signed: negative for a decreasing series.
+    """
+    n = len(values)
+    mean = sum(values) / n
+    if not mean:
+        return 0.0
+    xmean = (n - 1) / 2
+    sxx = sum((x - xmean) ** 2 for x in range(n))
+    slope = sum(
+        (x - xmean) * (v - mean) for x, v in enumerate(values)) / sxx
+    return slope * (n - 1) / mean
+
+
+def relative_ci(values: typing.Sequence[float]) -> float:
+    """Half-width of the 95% CI of the mean of *values*, relative to it."""
+    n = len(values)
+    mean = sum(values) / n
+    if n < 2 or not mean:
+        return math.inf
+    var = sum((v - mean) ** 2 for v in values) / (n - 1)
+    return t95(n - 1) * math.sqrt(var / n) / mean
+
+
+def is_steady(intervals: typing.Sequence[_histogram.LatencyHistogram]
+              ) -> bool:
+    """Whether the last WINDOW intervals are free of trends."""
+    if len(intervals) < WINDOW:
+        return False
+    window = intervals[-WINDOW:]
+    if not all(h.total for h in window):
+        return False
+    throughput = relative_trend([h.total for h in window])
+    latency = relative_trend([h.mean() for h in window])
+    return (
+        abs(throughput) < TREND_TOLERANCE and abs(latency) < TREND_TOLERANCE
+    )
+
+
+def is_precise(intervals: typing.Sequence[_histogram.LatencyHistogram],
+               ci_width: float) -> bool:
+    """Whether mean and p99 latency are known within *ci_width*."""
+    batches = [h for h in intervals if h.total]
+    if len(batches) < 2:
+        return False
+    return (
+        relative_ci([h.mean() for h in batches]) <= ci_width
+        and relative_ci(
+            [h.value_at_quantile(0.99) for h in batches]) <= ci_width
+    )
+
+
+class Controller:
+    """Decide when an adaptive benchmark run changes phase.
+
+    *add()* feeds the complete intervals of all connections in order.
+    *update()* takes the time since the start of the run, in seconds,
+    and returns whether the phase changed.  Phases change on interval
+    boundaries at least *lead* seconds ahead, so that all workers can
+    learn about it in time: measurement runs over the intervals
+    *measure_start* to *measure_end* (exclusive) once they are set.
+    ``--warmup-time`` and ``--duration`` cap them, and the workers stop
+    there by themselves.
+    """
+
+    def __init__(self, ctx, lead: float = 0.1):
+        self.ctx = ctx
+        self.lead = lead
+        self.intervals: typing.List[_histogram.LatencyHistogram] = []
+        self.measure_start: typing.Optional[int] = None
+        self.measure_end: typing.Optional[int] = None
+
+    def add(self, hist: _histogram.LatencyHistogram):
+        self.intervals.append(hist)
+
+    def _next_boundary(self, elapsed: float) -> int:
+        return max(math.ceil(elapsed + self.lead), len(self.intervals) + 1)
+
+    def update(self, elapsed: float) -> bool:
+        ctx = self.ctx
+        if self.measure_start is None:
+            if is_steady(self.intervals):
+                self.measure_start = min(
+                    self._next_boundary(elapsed), ctx.warmup_time)
+                return True
+            if elapsed >= ctx.warmup_time:
+                # The workers have switched by themselves.
+                self.measure_start = ctx.warmup_time
+                return True
+        elif self.measure_end is None:
+            measured = self.intervals[self.measure_start:]
+            if len(measured) >= ctx.min_duration and is_precise(
+                    measured, ctx.ci_width):
+                self.measure_end = min(
+                    self._next_boundary(elapsed),
+                    self.measure_start + ctx.duration)
+                return True
+        return False
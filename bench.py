@@ -8,24 +8,28 @@
 ##
 
 
+import contextlib
 import datetime
 import itertools
 import json
-import math
 import os
 import os.path
 import pathlib
 import platform
 import random
+import shlex
 import string
 import subprocess
 import sys
+import time
 
 import distro
 import jinja2
-import numpy as np
 
+import _histogram
+import _history
 import _shared
+import _stats
 
 
 def platform_info():
@@ -58,47 +62,23 @@ def platform_info():
     return data
 
 
-def weighted_quantile(values, quantiles, weights):
-    """Very close to np.percentile, but supports weights.
-
-    :param values: np.array with data
-    :param quantiles: array-like with many quantiles needed,
-           quantiles should be in [0, 1]!
-    :param weights: array-like of the same length as `array`
-    :return: np.array with computed quantiles.
-    """
-    values = np.array(values)
-    quantiles = np.array(quantiles)
-    weights = np.array(weights)
-    if not (np.all(quantiles >= 0) and np.all(quantiles <= 1)):
-        raise ValueError('quantiles should be in [0, 1]')
-
-    weighted_quantiles = np.cumsum(weights) - 0.5 * weights
-    weighted_quantiles -= weighted_quantiles[0]
-    weighted_quantiles /= weighted_quantiles[-1]
-
-    return np.interp(quantiles, weighted_quantiles, values)
-
-
 percentiles = [25, 50, 75, 90, 99, 99.99]
 
 
 def calc_latency_stats(queries, duration, min_latency, max_latency,
-                       latency_stats, samples, *, output_format='text'):
-    arange = np.arange(len(latency_stats))
-
-    mean_latency = np.average(arange, weights=latency_stats)
-    variance = np.average((arange - mean_latency) ** 2, weights=latency_stats)
-    latency_std = math.sqrt(variance)
-    latency_cv = latency_std / mean_latency
+                       latency_stats, samples, *, output_format='text',
+                       rate=0, backlog=0, client_stats=None,
+                       timeseries=None, warmup_time=0):
+    # Latencies are recorded in nanoseconds and reported in milliseconds.
+    mean_latency = latency_stats.mean()
+    latency_std = latency_stats.stddev()
+    latency_cv = latency_std / mean_latency if mean_latency else 0.0
 
     percentile_data = []
 
-    quantiles = weighted_quantile(arange, [p / 100 for p in percentiles],
-                                  weights=latency_stats)
-
-    for i, percentile in enumerate(percentiles):
-        percentile_data.append((percentile, round(quantiles[i] / 100, 3)))
+    for percentile in percentiles:
+        value = latency_stats.value_at_quantile(percentile / 100)
+        percentile_data.append((percentile, round(value / 1e6, 3)))
 
     if samples:
         random.shuffle(samples)
@@ -108,18 +88,53 @@ def calc_latency_stats(queries, duration, min_latency, max_latency,
         duration=round(duration, 2),
         queries=queries,
         qps=round(queries / duration, 2),
-        latency_min=round(min_latency / 100, 3),
-        latency_mean=round(mean_latency / 100, 3),
-        latency_max=round(max_latency / 100, 3),
-        latency_std=round(latency_std / 100, 3),
+        latency_min=round(min_latency / 1e6, 3),
+        latency_mean=round(mean_latency / 1e6, 3),
+        latency_max=round(max_latency / 1e6, 3),
+        latency_std=round(latency_std / 1e6, 3),
         latency_cv=round(latency_cv * 100, 2),
         latency_percentiles=percentile_data,
         samples=samples[:3] if samples else None
     )
 
+    if rate:
+        data['target_rate'] = rate
+        data['backlog'] = backlog
+
+    if client_stats is not None and queries:
+        cpu_ns = client_stats['cpu_ns'] / queries
+        render_ns = client_stats['render_ns'] / queries
+        data['client_cpu'] = round(cpu_ns / 1e6, 4)
+        data['client_render'] = round(render_ns / 1e6, 4)
+        data['client_driver'] = round((cpu_ns - render_ns) / 1e6, 4)
+        data['client_mem_peak'] = round(
+            client_stats['mem_peak_bytes'] / 1024, 1)
+        data['client_mem_retained'] = client_stats['mem_retained_blocks']
+
+    if timeseries is not None:
+        data['timeseries'] = calc_timeseries(timeseries, warmup_time)
+
     return data
 
 
+def calc_timeseries(timeseries, warmup_time):
+    # One [time, qps, p50, p99, max, mean, p90] row per interval; time
+    # is the end of the interval in seconds, negative during warmup.
+    interval = _histogram.TIMESERIES_INTERVAL / 1e9
+    rows = []
+    for i, hist in enumerate(timeseries.intervals):
+        rows.append([
+            round((i + 1) * interval - warmup_time, 2),
+            round(hist.total / interval, 2),
+            round(hist.value_at_quantile(0.5) / 1e6, 3),
+            round(hist.value_at_quantile(0.99) / 1e6, 3),
+            round((hist.max or 0) / 1e6, 3),
+            round(hist.mean() / 1e6, 3),
+            round(hist.value_at_quantile(0.9) / 1e6, 3),
+        ])
+    return rows
+
+
 def _geom_mean(values):
     p = 1
     root = 0
@@ -167,23 +182,202 @@ def mean_latency_stats(data):
     return {'mean': mean_data, **data}
 
 
-def process_results(lat_data, results):
-    for bench_data in lat_data['data']:
-        impl_name = bench_data['benchmark']
-        impl = _shared.IMPLEMENTATIONS[impl_name]
+# Metrics averaged over --repeat trials, with their rounding.
+TRIAL_METRICS = {
+    'duration': 2,
+    'queries': 2,
+    'qps': 2,
+    'latency_min': 3,
+    'latency_mean': 3,
+    'latency_max': 3,
+    'latency_std': 3,
+    'latency_cv': 2,
+}
+
+# Metrics that get confidence intervals, besides latency percentiles.
+CI_METRICS = ['qps', 'latency_mean']
+
+
+def merge_trial_stats(trials):
+    if len(trials) == 1:
+        return trials[0]
+
+    # Keep the time series and samples of the first trial.
+    data = dict(trials[0])
+    for metric, ndigits in TRIAL_METRICS.items():
+        data[metric] = round(
+            _stats.mean([t[metric] for t in trials]), ndigits)
+
+    pct_values = [
+        (p, [t['latency_percentiles'][i][1] for t in trials])
+        for i, p in enumerate(percentiles)
+    ]
+    data['latency_percentiles'] = [
+        (p, round(_stats.mean(values), 3)) for p, values in pct_values
+    ]
+
+    histogram = _histogram.LatencyHistogram()
+    for t in trials:
+        histogram.add(
+            _histogram.LatencyHistogram.decode(t['latency_histogram']))
+    data['latency_histogram'] = histogram.encode()
+
+    data['trials'] = {
+        **{metric: [t[metric] for t in trials] for metric in CI_METRICS},
+        'latency_percentiles': pct_values,
+    }
+    data['ci'] = {
+        **{
+            metric: [round(v, TRIAL_METRICS[metric]) for v in
+                     _stats.bootstrap_ci(data['trials'][metric])]
+            for metric in CI_METRICS
+        },
+        'latency_percentiles': [
+            (p, [round(v, 3) for v in _stats.bootstrap_ci(values)])
+            for p, values in pct_values
+        ],
+    }
+
+    return data
+
+
+def merge_trials(data, implementations):
+    """Merge the results of the --repeat trials of every benchmark.
+
+    Metrics are averaged over trials.  Merged results also have the
+    values of every trial in ``trials`` and the bootstrap confidence
+    intervals of their means in ``ci``.  Results are ordered as
+    *implementations*.
+    """
+    merged = {}
+    for queryname, benches in data.items():
+        by_impl = {}
+        for d in benches:
+            by_impl.setdefault(d['implementation'], []).append(d)
+        merged[queryname] = [
+            merge_trial_stats(by_impl[impl])
+            for impl in sorted(by_impl, key=implementations.index)
+        ]
+
+    return merged
+
+
+def process_result(record, results):
+    impl = _shared.IMPLEMENTATIONS[record['benchmark']]
+    query_bench = record['query']
+
+    d = calc_latency_stats(
+        query_bench['nqueries'],
+        record['duration'],
+        query_bench['min_latency'],
+        query_bench['max_latency'],
+        _histogram.LatencyHistogram.decode(query_bench['latency_stats']),
+        query_bench.get('samples'),
+        rate=record.get('rate', 0),
+        backlog=query_bench.get('backlog', 0),
+        client_stats=query_bench.get('client_stats'),
+        timeseries=(
+            _histogram.LatencyTimeSeries.decode(query_bench['timeseries'])
+            if 'timeseries' in query_bench else None
+        ),
+        warmup_time=record.get('warmup_time', 0))
+
+    d["implementation"] = impl.title
+    # Kept for the results history, see _history.py.
+    d["latency_histogram"] = query_bench['latency_stats']
+
+    results.setdefault(query_bench['queryname'], []).append(d)
+
+
+def _read_records(f, pending, results):
+    for line in iter(f.readline, ''):
+        pending += line
+        if not pending.endswith('\n'):
+            # Partially written line, wait for the rest.
+            continue
+        try:
+            record = json.loads(pending)
+        except json.JSONDecodeError as e:
+            print('could not process benchmark results: {}'.format(e),
+                  file=sys.stderr)
+            print(pending, file=sys.stderr)
+            sys.exit(1)
+        pending = ''
+        process_result(record, results)
+
+    return pending
+
+
+def follow_results(drivers, results):
+    """Aggregate the records of running drivers as they are written.
+
+    *drivers* maps language names to ``(process, output file)`` pairs.
+    Drivers write one JSON line per (implementation, query) benchmark,
+    so every record can be processed and dropped as soon as it lands.
+    Returns a dict of driver exit codes.
+    """
+    pending = {lang: '' for lang in drivers}
+    returncodes = {}
+    while True:
+        for lang, (proc, f) in drivers.items():
+            if lang in returncodes:
+                continue
+            exited = proc.poll() is not None
+            pending[lang] = _read_records(f, pending[lang], results)
+            if exited:
+                returncodes[lang] = proc.returncode
+
+        if len(returncodes) == len(drivers):
+            break
+
+        time.sleep(0.1)
+
+    return returncodes
+
+
+def split_cpus(n):
+    """Split the CPUs available to this process into *n* disjoint sets.
+
+    Returns None if CPU affinity is not supported or there are fewer
+    CPUs than sets.
+    """
+    if not hasattr(os, 'sched_getaffinity'):
+        return None
+
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < n:
+        return None
+
+    size = len(cpus) // n
+    sets = [set(cpus[i * size:(i + 1) * size]) for i in range(n)]
+    # Hand the remainder to the last driver.
+    sets[-1].update(cpus[n * size:])
+    return sets
+
 
-        for query_bench in bench_data['queries']:
-            d = calc_latency_stats(
-                query_bench['nqueries'],
-                bench_data['duration'],
-                query_bench['min_latency'],
-                query_bench['max_latency'],
-                np.array(query_bench['latency_stats']),
-                query_bench.get('samples'))
+def start_driver(cmd, cpus=None):
+    # Pin the driver before it starts; its worker processes inherit the
+    # affinity.
+    def pin_cpus():
+        os.sched_setaffinity(0, cpus)
 
-            d["implementation"] = impl.title
+    return subprocess.Popen(
+        cmd, stdout=sys.stdout, stderr=sys.stderr,
+        preexec_fn=pin_cpus if cpus is not None else None)
+
+
+class DriverError(Exception):
+    """One or more language drivers failed.
+
+    ``results`` holds the aggregated results of every benchmark that
+    completed before the failure.
+    """
 
-            results.setdefault(query_bench['queryname'], []).append(d)
+    def __init__(self, failed, results):
+        super().__init__(
+            'benchmark drivers failed: {}'.format(', '.join(failed)))
+        self.failed = failed
+        self.results = results
 
 
 def format_report_html(data, target_file, sort=True):
@@ -208,12 +402,20 @@ def format_report_html(data, target_file, sort=True):
         __BENCHMARK_DATE__=data['date'],
         __BENCHMARK_DURATION__=data['duration'],
         __BENCHMARK_CONCURRENCY__=data['concurrency'],
+        __BENCHMARK_RATE__=data.get('rate'),
+        __BENCHMARK_ID_DISTRIBUTION__=data.get('id_distribution', 'uniform'),
+        __BENCHMARK_REPEAT__=data.get('repeat', 1),
         __BENCHMARK_NETLATENCY__=data['netlatency'],
         __BENCHMARK_IMPLEMENTATIONS__=data['implementations'],
         __BENCHMARK_DESCRIPTIONS__=data['benchmarks_desc'],
         __BENCHMARK_PLATFORM__=platform,
         __BENCHMARK_DATA__={
-            b: json.dumps(v) for b, v in data['benchmarks'].items()
+            b: json.dumps([
+                # Histograms are of no use to the charts.
+                {k: x for k, x in d.items() if k != 'latency_histogram'}
+                for d in v
+            ])
+            for b, v in data['benchmarks'].items()
         },
         __BENCHMARK_SORT__='true' if sort else 'false',
     )
@@ -224,102 +426,185 @@ def format_report_html(data, target_file, sort=True):
 
 
 def run_benchmarks(args, argv):
+    parallel = getattr(args, 'parallel_drivers', False)
+    repeat = getattr(args, 'repeat', 1)
+    driver_opts = {}
+    for opt in getattr(args, 'driver_opts', None) or []:
+        lang, _, opts = opt.partition(':')
+        driver_opts[lang] = shlex.split(opts)
+
+    # Every driver is passed the implementations to run in each trial.
+    argv = [
+        arg for arg in argv
+        if arg not in _shared.IMPLEMENTATIONS and arg != 'all'
+    ]
+
     lang_args = {}
     for benchname in args.benchmarks:
         bench = _shared.IMPLEMENTATIONS[benchname]
-        if bench.language == 'python':
-            lang_args['python'] = [
-                'python', 'bench_python.py', '--json', '__tmp.json'
-            ] + argv
-        elif bench.language == 'go':
-            lang_args['go'] = [
-                'python', 'bench_go.py', '--json', '__tmp.json'
-            ] + argv
-        elif bench.language == 'js':
-            lang_args['js'] = [
-                'python', 'bench_js.py', '--json', '__tmp.json'
-            ] + argv
-        elif bench.language == 'dart':
-            lang_args['dart'] = [
-                'python', 'bench_dart.py', '--json', '__tmp.json'
-            ] + argv
-        else:
+        if bench.language not in {'python', 'go', 'js', 'dart'}:
             raise ValueError('unsupported host language: {}'.format(
                 bench.language))
 
+        lang = bench.language
+        lang_args[lang] = [
+            'python', 'bench_{}.py'.format(lang),
+            '--json', '__tmp_{}.json'.format(lang),
+        ] + argv + driver_opts.get(lang, [])
+        if args.profile and args.json and not args.profile_prefix:
+            # Drivers write to temporary JSON files, put the profiles
+            # next to the final report instead.
+            lang_args[lang] += [
+                '--profile-prefix', os.path.splitext(args.json)[0]]
+
+    if parallel and len(lang_args) > 1:
+        cpu_sets = split_cpus(len(lang_args))
+        if cpu_sets is None:
+            print('warning: cannot pin drivers to disjoint CPU sets, '
+                  'running them unpinned', file=sys.stderr)
+        # Every driver runs concurrently, on its own CPUs, so each of
+        # them is expected to target its own database.
+        for lang in lang_args:
+            if lang not in driver_opts:
+                print('warning: no --driver-opts for {}, it will share '
+                      'the database with other drivers'.format(lang),
+                      file=sys.stderr)
+    else:
+        cpu_sets = None
+
+    failed = []
+    agg_data = {}
     try:
-        agg_data = {}
-        for cmd in lang_args.values():
-            subprocess.run(
-                cmd, stdout=sys.stdout, stderr=sys.stderr, check=True)
-
-            with open('__tmp.json', 'rt') as f:
-                # Read the raw data from the file
-                results = f.read()
+        for trial in range(repeat):
+            order = list(args.benchmarks)
+            if repeat > 1:
+                # Slow drifts of the machine or the databases must not
+                # favor the implementations that happen to run first.
+                random.shuffle(order)
+                print('== trial {} of {}: {} =='.format(
+                    trial + 1, repeat, ', '.join(order)))
+
+            langs = list(dict.fromkeys(
+                _shared.IMPLEMENTATIONS[b].language for b in order))
+            if parallel and len(langs) > 1:
+                batches = [langs]
+            else:
+                batches = [[lang] for lang in langs]
+
+            for batch in batches:
+                drivers = {}
                 try:
-                    raw_data = json.loads(results)
-                except json.JSONDecodeError as e:
-                    print('could not process benchmark results: {}'.format(e),
-                          file=sys.stderr)
-                    print(results, file=sys.stderr)
-                    sys.exit(1)
-
-                process_results(raw_data, agg_data)
+                    for lang in batch:
+                        # Create the output file upfront, so that it can
+                        # be followed from the moment the driver starts.
+                        out = '__tmp_{}.json'.format(lang)
+                        with open(out, 'wt'):
+                            pass
+                        f = open(out, 'rt')
+                        cpus = cpu_sets[len(drivers)] if cpu_sets else None
+                        cmd = lang_args[lang] + [
+                            b for b in order
+                            if _shared.IMPLEMENTATIONS[b].language == lang
+                        ]
+                        drivers[lang] = (start_driver(cmd, cpus), f)
+
+                    returncodes = follow_results(drivers, agg_data)
+                finally:
+                    for proc, f in drivers.values():
+                        if proc.poll() is None:
+                            proc.kill()
+                            proc.wait()
+                        f.close()
+
+                for lang, returncode in returncodes.items():
+                    if returncode != 0:
+                        print('{} benchmark driver exited with code {}'.format(
+                            lang, returncode), file=sys.stderr)
+                        if lang not in failed:
+                            failed.append(lang)
     finally:
-        if os.path.exists('__tmp.json'):
-            os.unlink('__tmp.json')
+        for lang in lang_args:
+            out = '__tmp_{}.json'.format(lang)
+            if os.path.exists(out):
+                os.unlink(out)
+
+    titles = [_shared.IMPLEMENTATIONS[b].title for b in args.benchmarks]
+    benchmarks_data = mean_latency_stats(merge_trials(agg_data, titles))
+    if failed:
+        raise DriverError(failed, benchmarks_data)
 
-    return mean_latency_stats(agg_data)
+    return benchmarks_data
+
+
+def init_edgedb_instance(args, argv):
+    """Point EdgeDB benchmarks at the instance of the current project.
+
+    Sets ``args.edgedb_port`` and appends it to the runner *argv*.
+    Returns False if the project instance is not available.
+    """
+    print(__file__)
+    project_info_proc = subprocess.run(
+        ["edgedb", "project", "info", "--json"],
+        text=True,
+        capture_output=True,
+    )
+    if project_info_proc.returncode != 0:
+        print(
+            f"`edgedb project` returned"
+            f" {project_info_proc.returncode}. Please run"
+            f" `make load-edgedb`, or initialize the EdgeDB"
+            f" project directly",
+            file=sys.stderr,
+        )
+        return False
+
+    project_info = json.loads(project_info_proc.stdout)
+    args.edgedb_instance = project_info["instance-name"]
+    os.environ["EDGEDB_INSTANCE"] = args.edgedb_instance
+
+    instance_status_proc = subprocess.run(
+        ["edgedb", "instance", "status", "--json", args.edgedb_instance],
+        text=True,
+        capture_output=True,
+    )
+    if (instance_status_proc.returncode != 0 and
+            instance_status_proc.returncode != 3):
+        print(
+            f"`edgedb instance status` returned"
+            f" {instance_status_proc.returncode}. Please run"
+            f" `make load-edgedb`, or initialize the EdgeDB"
+            f" project directly",
+            file=sys.stderr,
+        )
+        return False
+
+    instance_status = json.loads(instance_status_proc.stdout)
+    args.edgedb_port = int(instance_status["port"])
+    argv.extend(("--edgedb-port", str(args.edgedb_port)))
+    return True
 
 
 def main():
     args, argv = _shared.parse_args(
         prog_desc='EdgeDB Databases Benchmark',
         out_to_html=True,
-        out_to_json=True)
+        out_to_json=True,
+        parallel_drivers=True,
+        repeat=True,
+        history=True)
 
     if any(b.startswith('edgedb') for b in args.benchmarks):
-        print(__file__)
-        project_info_proc = subprocess.run(
-            ["edgedb", "project", "info", "--json"],
-            text=True,
-            capture_output=True,
-        )
-        if project_info_proc.returncode != 0:
-            print(
-                f"`edgedb project` returned"
-                f" {project_info_proc.returncode}. Please run"
-                f" `make load-edgedb`, or initialize the EdgeDB"
-                f" project directly",
-                file=sys.stderr,
-            )
+        if not init_edgedb_instance(args, argv):
             return 1
 
-        project_info = json.loads(project_info_proc.stdout)
-        args.edgedb_instance = project_info["instance-name"]
-        os.environ["EDGEDB_INSTANCE"] = args.edgedb_instance
-
-        instance_status_proc = subprocess.run(
-            ["edgedb", "instance", "status", "--json", args.edgedb_instance],
-            text=True,
-            capture_output=True,
-        )
-        if (instance_status_proc.returncode != 0 and
-                instance_status_proc.returncode != 3):
-            print(
-                f"`edgedb instance status` returned"
-                f" {instance_status_proc.returncode}. Please run"
-                f" `make load-edgedb`, or initialize the EdgeDB"
-                f" project directly",
-                file=sys.stderr,
-            )
-            return 1
-
-        instance_status = json.loads(instance_status_proc.stdout)
-        args.edgedb_port = int(instance_status["port"])
-        argv.extend(("--edgedb-port", str(args.edgedb_port)))
-
-    benchmarks_data = run_benchmarks(args, argv)
+    exitcode = 0
+    try:
+        benchmarks_data = run_benchmarks(args, argv)
+    except DriverError as e:
+        # Still report the benchmarks that did complete.
+        print(e, file=sys.stderr)
+        benchmarks_data = e.results
+        exitcode = 1
 
     date = datetime.datetime.now().strftime('%c')
     plat_info = platform_info()
@@ -329,8 +614,11 @@ def main():
         'netlatency': args.net_latency,
         'platform': plat_info,
         'concurrency': args.concurrency,
+        'rate': args.rate,
+        'id_distribution': str(args.id_distribution),
+        'repeat': args.repeat,
         'benchmarks': benchmarks_data,
-        'benchmarks_desc': _shared.BENCHMARKS,
+        'benchmarks_desc': _shared.benchmark_descriptions(args),
         'implementations': [
             _shared.IMPLEMENTATIONS[benchname].title
             for benchname in args.benchmarks
@@ -345,7 +633,13 @@ def main():
         with open(args.json, 'wt') as f:
             f.write(json.dumps(report_data))
 
-    return 0
+    if not args.no_history:
+        path = args.history or _history.DEFAULT_PATH
+        with contextlib.closing(_history.connect(path)) as conn:
+            run_id = _history.record_run(conn, report_data, sys.argv[1:])
+        print('recorded as run {} in {}'.format(run_id, path))
+
+    return exitcode
 
 
 if __name__ == '__main__':
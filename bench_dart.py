@@ -13,9 +13,9 @@ import pathlib
 import subprocess
 import typing
 
-import numpy as np
-
+import _histogram
 import _shared
+import _snapshot
 
 
 class Result(typing.NamedTuple):
@@ -24,10 +24,11 @@ class Result(typing.NamedTuple):
     queryname: str
     nqueries: int
     duration: int
+    # All latencies are in nanoseconds.
     min_latency: int
-    avg_latency: int
+    avg_latency: float
     max_latency: int
-    latency_stats: typing.List[int]
+    latency_stats: _histogram.LatencyHistogram
     samples: typing.List[str]
 
 
@@ -35,9 +36,9 @@ def print_result(ctx, result: Result):
     print(f'== {result.benchmark} : {result.queryname} ==')
     print(f'queries:\t{result.nqueries}')
     print(f'qps:\t\t{result.nqueries // ctx.duration} q/s')
-    print(f'min latency:\t{result.min_latency / 100:.2f}ms')
-    print(f'avg latency:\t{result.avg_latency / 100:.2f}ms')
-    print(f'max latency:\t{result.max_latency / 100:.2f}ms')
+    print(f'min latency:\t{result.min_latency / 1e6:.3f}ms')
+    print(f'avg latency:\t{result.avg_latency / 1e6:.3f}ms')
+    print(f'max latency:\t{result.max_latency / 1e6:.3f}ms')
     print()
 
 
@@ -71,30 +72,41 @@ def run_query(ctx, benchmark, queryname):
     output = proc.stdout
     data = json.loads(output)
 
-    avg_latency = np.average(
-        np.arange(len(data['latency_stats'])),
-        weights=data['latency_stats'])
+    # The runner reports latencies in a dense array of 10us buckets.
+    latency_stats = _histogram.LatencyHistogram.from_dense(
+        data['latency_stats'], unit_ns=10_000)
 
     return Result(
         benchmark=benchmark,
         queryname=queryname,
         nqueries=data['nqueries'],
         duration=data['duration'],
-        min_latency=data['min_latency'],
-        avg_latency=avg_latency,
-        max_latency=data['max_latency'],
-        latency_stats=data['latency_stats'],
+        min_latency=int(data['min_latency'] * 10_000),
+        avg_latency=latency_stats.mean(),
+        max_latency=int(data['max_latency'] * 10_000),
+        latency_stats=latency_stats,
         samples=data['samples'],
     )
 
 
-def run_bench(ctx, benchmark):
+def run_bench(ctx, benchmark, stream):
     results = []
+    snapshot = _snapshot.prepare(ctx, benchmark)
+    dirty = False
 
     for queryname in ctx.queries:
+        if _snapshot.needs_restore(snapshot, [queryname], dirty):
+            snapshot.restore(ctx)
+            dirty = _snapshot.mutates([queryname])
+
         res = run_query(ctx, benchmark, queryname)
         results.append(res)
         print_result(ctx, res)
+        stream.write(res)
+
+    if dirty:
+        # Leave the snapshot state behind for the next implementation.
+        snapshot.restore(ctx)
 
     return results
 
@@ -112,43 +124,31 @@ def main():
     print(f'benchmarks:\t{", ".join(b for b in ctx.benchmarks)}')
     print()
 
-    data = []
-    for benchmark in ctx.benchmarks:
-        bench_desc = _shared.IMPLEMENTATIONS[benchmark]
-        if bench_desc.language != 'dart':
-            continue
-
-        res = run_bench(ctx, benchmark)
-        data.append(res)
-
-    if ctx.json:
-        json_data = []
-        for results in data:
-            json_results = []
-            for r in results:
-                json_results.append({
-                    'queryname': r.queryname,
-                    'nqueries': r.nqueries,
-                    'min_latency': r.min_latency,
-                    'max_latency': r.max_latency,
-                    'latency_stats': [int(i) for i in r.latency_stats],
-                    'samples': r.samples,
-                })
-            json_data.append({
-                'benchmark': results[0].benchmark,
-                'duration': results[0].duration,
-                'queries': json_results,
-            })
-
-        data = json.dumps({
-            'language': 'dart',
-            'concurrency': ctx.concurrency,
-            'warmup_time': ctx.warmup_time,
-            'duration': ctx.duration,
-            'data': json_data,
-        })
-        with open(ctx.json, 'wt') as f:
-            f.write(data)
+    if ctx.rate:
+        print('--rate is only supported by the Python drivers, skipping')
+        return
+
+    if ctx.mix:
+        print('--mix is only supported by the Python drivers, skipping')
+        return
+
+    if not ctx.id_distribution.uniform:
+        print('--id-distribution is only supported by the Python drivers, '
+              'skipping')
+        return
+
+    if ctx.adaptive:
+        print('--adaptive is only supported by the Python drivers, running '
+              'for the full warmup time and duration')
+        print()
+
+    with _shared.ResultsStream(ctx, 'dart') as stream:
+        for benchmark in ctx.benchmarks:
+            bench_desc = _shared.IMPLEMENTATIONS[benchmark]
+            if bench_desc.language != 'dart':
+                continue
+
+            run_bench(ctx, benchmark, stream)
 
 
 if __name__ == '__main__':
@@ -9,18 +9,28 @@
 
 
 import asyncio
+import collections
 import concurrent.futures as futures
-import json
+import contextlib
+import itertools
 import math
 import multiprocessing
+import os
+import queue
 import random
+import threading
 import time
 import typing
 
-import numpy as np
 import uvloop
 
+import _histogram
+import _iddist
+import _instrument
+import _profiler
 import _shared
+import _snapshot
+import _steady
 
 
 class Result(typing.NamedTuple):
@@ -28,277 +38,803 @@ class Result(typing.NamedTuple):
     benchmark: str
     queryname: str
     nqueries: int
-    duration: int
+    # Seconds, from the start of measurement in all workers to the
+    # completion of the last measured request.
+    duration: float
+    # All latencies are in nanoseconds.
     min_latency: int
-    avg_latency: int
+    avg_latency: float
     max_latency: int
-    latency_stats: typing.List[int]
+    latency_stats: _histogram.LatencyHistogram
     samples: typing.List[str]
+    # Requests that were due but never sent in open-loop (--rate) mode.
+    backlog: int = 0
+    # Client-side CPU and allocation stats (--instrument).
+    client_stats: typing.Optional[dict] = None
+    # Sampled stacks in collapsed format (--profile).
+    profile: typing.Optional[collections.Counter] = None
+    # Per-second latencies, starting with the warmup period.
+    timeseries: typing.Optional[_histogram.LatencyTimeSeries] = None
+    # Seconds of warmup actually run, less than --warmup-time when
+    # --adaptive detects a steady state early.
+    warmup_time: typing.Optional[float] = None
+
+
+class WorkerResult(typing.NamedTuple):
+    """Result of a single connection, aggregated by agg_results()."""
 
+    nqueries: int
+    # time.monotonic_ns() at the start and the end of measurement.
+    window: typing.Tuple[int, int]
+    # Nanoseconds from the start of warmup to the start of measurement.
+    warmup: int
+    latency_stats: _histogram.LatencyHistogram
+    samples: typing.List[str]
+    backlog: int
+    client_stats: typing.Optional[dict]
+    profile: typing.Optional[collections.Counter]
+    timeseries: _histogram.LatencyTimeSeries
+
+
+class Workload:
+    """Requests of a single connection and their latencies.
+
+    Requests are all of a single query, or, with --mix, drawn from a
+    weighted mix of queries.  Latencies are recorded per query, and
+    results are produced for the mix as a whole and for each query.
+    """
+
+    def __init__(self, ctx, queries_mod, ids, queryname):
+        weights = ctx.mix if queryname == _shared.MIXED else {queryname: 1}
+
+        self.queryname = queryname
+        self.names = list(weights)
+        self.cum_weights = list(itertools.accumulate(weights.values()))
+        self.methods = {q: getattr(queries_mod, q) for q in self.names}
+        self.id_loops = {
+            q: _iddist.IdSampler(ctx.id_distribution, ids[q])
+            for q in self.names
+        }
+
+        self.nqueries = dict.fromkeys(self.names, 0)
+        self.latency_stats = {
+            q: _histogram.LatencyHistogram() for q in self.names}
+        self.timeseries = {
+            q: _histogram.LatencyTimeSeries() for q in self.names}
+        self.samples = {q: [] for q in self.names}
+
+    def set_start(self, start, reports=None):
+        # Time series of all workers start together with the warmup.
+        for series in self.timeseries.values():
+            series.start = start
+        self.start = start
+        # Complete intervals go to the --adaptive run controller.
+        self.reports = reports
+        self.next_report = 0
+
+    def next(self):
+        """Return the query name, method and argument of a request."""
+        if len(self.names) == 1:
+            q = self.names[0]
+        else:
+            q = random.choices(self.names, cum_weights=self.cum_weights)[0]
+        return q, self.methods[q], self.id_loops[q].get_next()
+
+    def sample_requests(self):
+        """Yield requests to collect sample outputs with."""
+        for q in self.names:
+            for _ in range(10):
+                yield q, self.methods[q], self.id_loops[q].get_next()
+
+    def add_sample(self, queryname, sample):
+        if isinstance(sample, bytes):
+            sample = sample.decode()
+        self.samples[queryname].append(sample)
+
+    def record_warmup(self, queryname, now, latency):
+        self.timeseries[queryname].record(now, latency)
+        if self.reports is not None:
+            self.report(now)
+
+    def record(self, queryname, now, latency):
+        self.nqueries[queryname] += 1
+        self.latency_stats[queryname].record(latency)
+        self.timeseries[queryname].record(now, latency)
+        if self.reports is not None:
+            self.report(now)
+
+    def report(self, now):
+        # An interval is complete once a request completes after it.
+        idx = (now - self.start) // _histogram.TIMESERIES_INTERVAL
+        while self.next_report < idx:
+            i = self.next_report
+            hist = _histogram.LatencyHistogram()
+            for series in self.timeseries.values():
+                if i < len(series.intervals):
+                    hist.add(series.intervals[i])
+            self.reports.put((self.start, i, hist))
+            self.next_report += 1
+
+    @property
+    def total(self):
+        return sum(self.nqueries.values())
+
+    def results(self, measure_start, window, backlog, client_stats,
+                profile) -> typing.Dict[str, WorkerResult]:
+        """Return the WorkerResults of this connection by result name."""
+        warmup = measure_start - self.start
+        results = {}
+        latency_stats = _histogram.LatencyHistogram()
+        timeseries = _histogram.LatencyTimeSeries()
+        for q in self.names:
+            latency_stats.add(self.latency_stats[q])
+            timeseries.add(self.timeseries[q])
+            if self.queryname == _shared.MIXED:
+                results[_shared.mixed_queryname(q)] = WorkerResult(
+                    nqueries=self.nqueries[q],
+                    window=window,
+                    warmup=warmup,
+                    latency_stats=self.latency_stats[q],
+                    samples=self.samples[q],
+                    backlog=0,
+                    client_stats=None,
+                    profile=None,
+                    timeseries=self.timeseries[q],
+                )
+
+        # The aggregate goes first.
+        return {
+            self.queryname: WorkerResult(
+                nqueries=self.total,
+                window=window,
+                warmup=warmup,
+                latency_stats=latency_stats,
+                samples=[s for q in self.names for s in self.samples[q]],
+                backlog=backlog,
+                client_stats=client_stats,
+                profile=profile,
+                timeseries=timeseries,
+            ),
+            **results,
+        }
+
+
+def get_request_interval(ctx):
+    # Interval between intended request send times of a single
+    # connection in open-loop (--rate) mode, in nanoseconds.
+    return 1e9 * ctx.concurrency / ctx.rate
+
+
+def get_backlog(interval, duration, nqueries):
+    # Number of requests that were due during the measurement window
+    # (of *duration* nanoseconds) of a single connection, but that
+    # were never sent.
+    scheduled = math.ceil(duration / interval)
+    return max(0, scheduled - nqueries)
+
+
+# Nanoseconds between the start barrier and the start of a benchmark.
+START_DELAY = 50_000_000
+
+
+class SharedClock(typing.NamedTuple):
+    """Times shared by the workers of a pool.
+
+    The times are time.monotonic_ns() values, zero until they are set.
+    """
+
+    # Common start time of a benchmark, see synchronized_start().
+    start_at: typing.Any
+    # Start and end of measurement, set early by the --adaptive
+    # controller, see AdaptiveControl.
+    measure_at: typing.Any
+    end_at: typing.Any
+    # Complete intervals of all connections for the controller, as
+    # (start, index, histogram), or None in fixed-length runs.
+    reports: typing.Optional[typing.Any]
+
+    def reset(self):
+        self.start_at.value = 0
+        self.measure_at.value = 0
+        self.end_at.value = 0
+
+
+class Schedule:
+    """Warmup and measurement deadlines of a benchmark in a worker.
+
+    Fixed-length runs warm up for --warmup-time and measure for
+    --duration.  In --adaptive runs those are upper bounds, and the
+    controller may publish earlier deadlines in the SharedClock while
+    the benchmark runs.
+    """
+
+    def __init__(self, ctx, start):
+        clock = _worker_state.clock
+        self.clock = clock if ctx.adaptive else None
+        self.reports = clock.reports if ctx.adaptive else None
+        self.max_measure_start = start + ctx.warmup_time * 1_000_000_000
+        self.max_duration = ctx.duration * 1_000_000_000
+
+    def measure_start(self) -> int:
+        if self.clock is not None and self.clock.measure_at.value:
+            return self.clock.measure_at.value
+        return self.max_measure_start
+
+    def measure_end(self, measure_start) -> int:
+        end = measure_start + self.max_duration
+        if self.clock is not None and self.clock.end_at.value:
+            return min(end, self.clock.end_at.value)
+        return end
+
+
+class WorkerState:
+    """Per-process state of a benchmark worker.
+
+    Workers are started once per implementation and keep their
+    connections open across all benchmarked queries.
+    """
+
+    def __init__(self, ctx, benchname, barrier, clock):
+        self.queries_mod = _shared.IMPLEMENTATIONS[benchname].module
+        self.barrier = barrier
+        self.clock = clock
+        if clock.reports is not None:
+            # Reports left over at exit are of no interest to anyone,
+            # don't wait for them to be consumed.
+            clock.reports.cancel_join_thread()
+        self.conns = []
+        self.loop = None
+
+        if hasattr(self.queries_mod, 'init'):
+            self.queries_mod.init(ctx)
+
+        if ctx.instrument:
+            self.instrumentation = _instrument.ClientInstrumentation()
+        else:
+            self.instrumentation = None
 
-class LoopingValues:
-    def __init__(self, values):
-        self.values = list(values)
-        random.shuffle(self.values)
-        self.i = 0
-        self.len = len(self.values)
+        if ctx.profile:
+            self.profiler = _profiler.SamplingProfiler()
+        else:
+            self.profiler = None
 
-    def get_next(self):
-        # advance
-        self.i += 1
-        self.i %= self.len
-        return self.values[self.i]
 
+_worker_state: typing.Optional[WorkerState] = None
 
-def run_benchmark_method(ctx, benchname, ids, queryname):
-    queries_mod = _shared.IMPLEMENTATIONS[benchname].module
-    if hasattr(queries_mod, 'init'):
-        queries_mod.init(ctx)
 
-    method = getattr(queries_mod, queryname)
-    conn = queries_mod.connect(ctx)
-    # This is used to loop over input IDs in such a way as to avoid
-    # repeating the same ID too closely to itself. This avoid
-    # conflicts when concurrently updating the same object.
-    id_loop = LoopingValues(ids)
+def connect_worker(ctx, state):
+    if state.loop is None:
+        state.conns.append(state.queries_mod.connect(ctx))
+        return
 
-    try:
-        samples = []
-        nqueries = 0
-        latency_stats = np.zeros((math.ceil(ctx.timeout) * 100 * 1000 + 1,))
-        min_latency = float('inf')
-        max_latency = 0.0
-
-        duration = ctx.warmup_time
-        start = time.monotonic()
-        while time.monotonic() - start < duration:
-            rid = id_loop.get_next()
-            method(conn, rid)
+    async def connect():
+        return await asyncio.gather(*[
+            state.queries_mod.connect(ctx)
+            for _ in range(ctx.concurrency // ctx.async_split)
+        ])
 
-        for _ in range(10):
-            rid = id_loop.get_next()
-            s = method(conn, rid)
-            if isinstance(s, bytes):
-                s = s.decode()
-            samples.append(s)
-
-        duration = ctx.duration
-        start = time.monotonic()
-        max_req_time = len(latency_stats) - 1
-        while time.monotonic() - start < duration:
-            rid = id_loop.get_next()
-            req_start = time.monotonic_ns()
-            method(conn, rid)
-            req_time = (time.monotonic_ns() - req_start) // 10000
+    state.conns.extend(state.loop.run_until_complete(connect()))
+
+
+def disconnect_worker(ctx, state):
+    conns, state.conns = state.conns, []
+    if state.loop is not None:
+        async def close():
+            await asyncio.gather(*[
+                state.queries_mod.close(ctx, conn) for conn in conns
+            ])
+
+        state.loop.run_until_complete(close())
+    else:
+        for conn in conns:
+            state.queries_mod.close(ctx, conn)
+
+
+def init_sync_worker(ctx, benchname, barrier, clock):
+    global _worker_state
+    state = _worker_state = WorkerState(ctx, benchname, barrier, clock)
+    connect_worker(ctx, state)
+
+
+def init_async_worker(ctx, benchname, barrier, clock):
+    global _worker_state
+    state = _worker_state = WorkerState(ctx, benchname, barrier, clock)
+
+    uvloop.install()
+    state.loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(state.loop)
+    connect_worker(ctx, state)
+
+
+def wait_at_barrier(ctx) -> int:
+    # A broken barrier stays broken: later benchmarks in the pool would
+    # start unsynchronized, and a worker could take two chunks of ids
+    # and mutate the same objects as another one.  Abort the run.
+    try:
+        return _worker_state.barrier.wait(timeout=max(ctx.timeout, 30))
+    except threading.BrokenBarrierError:
+        raise RuntimeError(
+            'benchmark workers failed to synchronize (a worker is stuck '
+            'or has died)') from None
 
-            if req_time > max_latency:
-                max_latency = req_time
-            if req_time < min_latency:
-                min_latency = req_time
 
-            if req_time > max_req_time:
-                req_time = max_req_time
-            latency_stats[req_time] += 1
+def wait_for_workers(ctx):
+    # Every worker in the pool must pick up exactly one task of a
+    # kind, so hold on to this one until all workers have got theirs.
+    wait_at_barrier(ctx)
 
-            nqueries += 1
 
-        return nqueries, latency_stats, min_latency, max_latency, samples
+def close_worker(ctx):
+    try:
+        wait_for_workers(ctx)
     finally:
-        queries_mod.close(ctx, conn)
+        disconnect_worker(ctx, _worker_state)
+    if _worker_state.loop is not None:
+        _worker_state.loop.close()
 
 
-async def run_async_benchmark_method(ctx, benchname, ids, queryname):
-    queries_mod = _shared.IMPLEMENTATIONS[benchname].module
-    if hasattr(queries_mod, 'init'):
-        queries_mod.init(ctx)
+def suspend_worker(ctx):
+    wait_for_workers(ctx)
+    disconnect_worker(ctx, _worker_state)
+
 
-    method = getattr(queries_mod, queryname)
-    conn = await queries_mod.connect(ctx)
-    # This is used to loop over input IDs in such a way as to avoid
-    # repeating the same ID too closely to itself. This avoid
-    # conflicts when concurrently updating the same object.
-    id_loop = LoopingValues(ids)
+def resume_worker(ctx):
+    wait_for_workers(ctx)
+    connect_worker(ctx, _worker_state)
 
+
+def run_on_workers(pool, nworkers, fn, *args):
+    done = futures.wait(
+        [pool.submit(fn, *args) for _ in range(nworkers)]).done
+    for fut in done:
+        fut.result()
+
+
+def restore_snapshot(ctx, pool, nworkers, snapshot):
+    """Restore the database while the workers are disconnected from it."""
+    run_on_workers(pool, nworkers, suspend_worker, ctx)
+    snapshot.restore(ctx)
+    run_on_workers(pool, nworkers, resume_worker, ctx)
+
+
+@contextlib.contextmanager
+def worker_pool(ctx, benchname, nworkers, initializer):
+    """Start a pool of benchmark workers for the whole run of *benchname*.
+
+    Workers connect once, in *initializer*, and their connections are
+    reused by every query.  Yields the pool and its SharedClock.
+    """
+    barrier = multiprocessing.Barrier(nworkers)
+    clock = SharedClock(
+        start_at=multiprocessing.Value('q', 0),
+        # Written by a single thread of the parent process.
+        measure_at=multiprocessing.Value('q', 0, lock=False),
+        end_at=multiprocessing.Value('q', 0, lock=False),
+        reports=multiprocessing.Queue() if ctx.adaptive else None,
+    )
+    with futures.ProcessPoolExecutor(
+        max_workers=nworkers,
+        initializer=initializer,
+        initargs=(ctx, benchname, barrier, clock),
+    ) as pool:
+        yield pool, clock
+        run_on_workers(pool, nworkers, close_worker, ctx)
+
+
+class AdaptiveControl(threading.Thread):
+    """Controller of an --adaptive benchmark run in the parent process.
+
+    Merges the intervals reported by all *nconns* connections and
+    publishes the phase changes decided by _steady.Controller in the
+    SharedClock of the pool.
+    """
+
+    def __init__(self, ctx, clock, nconns):
+        super().__init__(daemon=True)
+        self.ctx = ctx
+        self.clock = clock
+        self.nconns = nconns
+        self.stopped = threading.Event()
+
+    def run(self):
+        clock = self.clock
+        controller = _steady.Controller(self.ctx)
+        pending = collections.defaultdict(list)
+        while not self.stopped.is_set():
+            start = clock.start_at.value
+            try:
+                run, idx, hist = clock.reports.get(timeout=0.05)
+            except queue.Empty:
+                pass
+            else:
+                # Skip late reports of the previous benchmark.
+                if run == start:
+                    pending[idx].append(hist)
+
+            while len(pending[len(controller.intervals)]) == self.nconns:
+                merged = _histogram.LatencyHistogram()
+                for hist in pending.pop(len(controller.intervals)):
+                    merged.add(hist)
+                controller.add(merged)
+
+            if not start:
+                continue
+            elapsed = (time.monotonic_ns() - start) / 1e9
+            if controller.update(elapsed):
+                if controller.measure_end is None:
+                    clock.measure_at.value = (
+                        start + controller.measure_start * 1_000_000_000)
+                else:
+                    clock.end_at.value = (
+                        start + controller.measure_end * 1_000_000_000)
+                    return
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def adaptive_control(ctx, clock, nconns):
+    """Control the benchmark run in the pool of *clock* if --adaptive."""
+    clock.reset()
+    if not ctx.adaptive:
+        yield
+        return
+
+    control = AdaptiveControl(ctx, clock, nconns)
+    control.start()
     try:
-        samples = []
-        nqueries = 0
-        latency_stats = np.zeros((math.ceil(ctx.timeout) * 100 * 1000 + 1,))
-        min_latency = float('inf')
-        max_latency = 0.0
-
-        duration = ctx.warmup_time
-        start = time.monotonic()
-        while time.monotonic() - start < duration:
-            rid = id_loop.get_next()
-            await method(conn, rid)
+        yield
+    finally:
+        control.stop()
+
+
+def synchronized_start(ctx) -> int:
+    """Wait for all workers and return their common start time.
+
+    The time is a time.monotonic_ns() value, which is comparable
+    across processes.  It is set a little ahead, so that every worker
+    is already waiting for it, rather than waking up from the barrier,
+    when it comes.
+    """
+    state = _worker_state
+    if wait_at_barrier(ctx) == 0:
+        state.clock.start_at.value = time.monotonic_ns() + START_DELAY
+    wait_at_barrier(ctx)
+    return state.clock.start_at.value
+
+
+def run_benchmark_method(ctx, ids, queryname):
+    conn = _worker_state.conns[0]
+    workload = Workload(ctx, _worker_state.queries_mod, ids, queryname)
+
+    for q, method, rid in workload.sample_requests():
+        workload.add_sample(q, method(conn, rid))
+
+    start = synchronized_start(ctx)
+    # All workers warm up and measure over the same time windows.
+    schedule = Schedule(ctx, start)
+    workload.set_start(start, schedule.reports)
+
+    time.sleep(max(0, start - time.monotonic_ns()) / 1e9)
+    while time.monotonic_ns() < schedule.measure_start():
+        q, method, rid = workload.next()
+        req_start = time.monotonic_ns()
+        method(conn, rid)
+        now = time.monotonic_ns()
+        workload.record_warmup(q, now, now - req_start)
+
+    instrumentation = _worker_state.instrumentation
+    if instrumentation is not None:
+        instrumentation.start()
+    profiler = _worker_state.profiler
+    if profiler is not None:
+        profiler.start()
+
+    measure_start = schedule.measure_start()
+    # The last warmup request might have overrun the start.
+    window_start = time.monotonic_ns()
+    if ctx.rate:
+        # Open-loop mode: requests are issued on a fixed timetable
+        # and latency is measured from the intended send time, so
+        # that queueing delay behind a slow request is not hidden.
+        interval = get_request_interval(ctx)
+        first = measure_start + int(random.random() * interval)
+        while True:
+            intended = first + int(workload.total * interval)
+            now = time.monotonic_ns()
+            measure_end = schedule.measure_end(measure_start)
+            if intended >= measure_end or now >= measure_end:
+                break
+            if intended > now:
+                time.sleep((intended - now) / 1e9)
+            q, method, rid = workload.next()
+            method(conn, rid)
+            now = time.monotonic_ns()
+            workload.record(q, now, now - intended)
 
-        for _ in range(10):
-            rid = id_loop.get_next()
-            s = await method(conn, rid)
-            if isinstance(s, bytes):
-                s = s.decode()
-            samples.append(s)
-
-        duration = ctx.duration
-        start = time.monotonic()
-        max_req_time = len(latency_stats) - 1
-        while time.monotonic() - start < duration:
-            rid = id_loop.get_next()
+        backlog = get_backlog(
+            interval, measure_end - measure_start, workload.total)
+    else:
+        while time.monotonic_ns() < schedule.measure_end(measure_start):
+            q, method, rid = workload.next()
             req_start = time.monotonic_ns()
+            method(conn, rid)
+            now = time.monotonic_ns()
+            workload.record(q, now, now - req_start)
+
+        backlog = 0
+    window = (window_start, time.monotonic_ns())
+
+    profile = None
+    if profiler is not None:
+        profile = profiler.stop()
+    client_stats = None
+    if instrumentation is not None:
+        client_stats = instrumentation.stop()
+
+    return workload.results(
+        measure_start, window, backlog, client_stats, profile)
+
+
+async def collect_samples(conn, workload):
+    for q, method, rid in workload.sample_requests():
+        workload.add_sample(q, await method(conn, rid))
+
+
+async def run_async_benchmark_method(ctx, conn, workload, start):
+    # All workers warm up and measure over the same time windows.
+    schedule = Schedule(ctx, start)
+    workload.set_start(start, schedule.reports)
+
+    await asyncio.sleep(max(0, start - time.monotonic_ns()) / 1e9)
+    while time.monotonic_ns() < schedule.measure_start():
+        q, method, rid = workload.next()
+        req_start = time.monotonic_ns()
+        await method(conn, rid)
+        now = time.monotonic_ns()
+        workload.record_warmup(q, now, now - req_start)
+
+    instrumentation = _worker_state.instrumentation
+    if instrumentation is not None:
+        instrumentation.start()
+    profiler = _worker_state.profiler
+    if profiler is not None:
+        profiler.start()
+
+    measure_start = schedule.measure_start()
+    # The last warmup request might have overrun the start.
+    window_start = time.monotonic_ns()
+    if ctx.rate:
+        # Open-loop mode: requests are issued on a fixed timetable
+        # and latency is measured from the intended send time, so
+        # that queueing delay behind a slow request is not hidden.
+        interval = get_request_interval(ctx)
+        first = measure_start + int(random.random() * interval)
+        while True:
+            intended = first + int(workload.total * interval)
+            now = time.monotonic_ns()
+            measure_end = schedule.measure_end(measure_start)
+            if intended >= measure_end or now >= measure_end:
+                break
+            if intended > now:
+                await asyncio.sleep((intended - now) / 1e9)
+            q, method, rid = workload.next()
             await method(conn, rid)
-            req_time = (time.monotonic_ns() - req_start) // 10000
+            now = time.monotonic_ns()
+            workload.record(q, now, now - intended)
 
-            if req_time > max_latency:
-                max_latency = req_time
-            if req_time < min_latency:
-                min_latency = req_time
+        backlog = get_backlog(
+            interval, measure_end - measure_start, workload.total)
+    else:
+        while time.monotonic_ns() < schedule.measure_end(measure_start):
+            q, method, rid = workload.next()
+            req_start = time.monotonic_ns()
+            await method(conn, rid)
+            now = time.monotonic_ns()
+            workload.record(q, now, now - req_start)
 
-            if req_time > max_req_time:
-                req_time = max_req_time
-            latency_stats[req_time] += 1
+        backlog = 0
+    window = (window_start, time.monotonic_ns())
 
-            nqueries += 1
+    profile = None
+    if profiler is not None:
+        profile = profiler.stop()
+    client_stats = None
+    if instrumentation is not None:
+        client_stats = instrumentation.stop()
 
-        return nqueries, latency_stats, min_latency, max_latency, samples
-    finally:
-        await queries_mod.close(ctx, conn)
+    return workload.results(
+        measure_start, window, backlog, client_stats, profile)
 
 
-def agg_results(results, benchname, queryname, duration) -> Result:
-    min_latency = float('inf')
-    max_latency = 0.0
+def agg_results(ctx, results: typing.List[WorkerResult],
+                benchname, queryname) -> Result:
     nqueries = 0
-    latency_stats = None
+    backlog = 0
+    latency_stats = _histogram.LatencyHistogram()
     samples = []
+    timeseries = _histogram.LatencyTimeSeries()
+    # Workers start measuring at the same time; the window lasts until
+    # the last of them is done.
+    window_start = min(r.window[0] for r in results)
+    window_end = max(r.window[1] for r in results)
     for result in results:
-        t_nqueries, t_lat_stats, t_min_latency, t_max_latency, t_samples = \
-            result
-        samples.append(random.choice(t_samples))
-        nqueries += t_nqueries
-        if latency_stats is None:
-            latency_stats = t_lat_stats
-        else:
-            latency_stats = np.add(latency_stats, t_lat_stats)
-        if t_max_latency > max_latency:
-            max_latency = t_max_latency
-        if t_min_latency < min_latency:
-            min_latency = t_min_latency
-
-    avg_latency = np.average(
-        np.arange(len(latency_stats)), weights=latency_stats)
+        samples.append(random.choice(result.samples))
+        nqueries += result.nqueries
+        backlog += result.backlog
+        latency_stats.add(result.latency_stats)
+        timeseries.add(result.timeseries)
 
     return Result(
         benchmark=benchname,
         queryname=queryname,
         nqueries=nqueries,
-        duration=duration,
-        min_latency=min_latency,
-        avg_latency=avg_latency,
-        max_latency=max_latency,
+        duration=(window_end - window_start) / 1e9,
+        min_latency=latency_stats.min or 0,
+        avg_latency=latency_stats.mean(),
+        max_latency=latency_stats.max or 0,
         latency_stats=latency_stats,
         samples=samples,
+        backlog=backlog,
+        client_stats=(
+            _instrument.merge(r.client_stats for r in results)
+            if ctx.instrument else None
+        ),
+        profile=(
+            _profiler.merge(r.profile for r in results)
+            if ctx.profile else None
+        ),
+        timeseries=timeseries,
+        warmup_time=min(r.warmup for r in results) / 1e9,
     )
 
 
-def run_benchmark_sync(ctx, benchname, ids, queryname) -> Result:
-    method_ids = ids[queryname]
+def get_querynames(ctx, queryname) -> typing.List[str]:
+    if queryname == _shared.MIXED:
+        return list(ctx.mix)
+    return [queryname]
+
+
+def chunk_ids(ctx, ids, queryname, nchunks,
+              i) -> typing.Dict[str, _iddist.RankedIds]:
     # We want to split the input ids into separate chunks, so that we
     # avoid concurrent mutations of the same object.
-    chunk_len = math.ceil(len(method_ids) / ctx.concurrency)
-    with futures.ProcessPoolExecutor(max_workers=ctx.concurrency) as e:
+    return {
+        q: _iddist.chunk(
+            ctx.id_distribution, ids[q], q in _snapshot.MUTATIONS,
+            nchunks, i)
+        for q in get_querynames(ctx, queryname)
+    }
+
+
+def agg_workload_results(ctx, results, benchname) -> typing.List[Result]:
+    # Every worker returns results by the same names, aggregate first.
+    return [
+        agg_results(ctx, [r[name] for r in results], benchname, name)
+        for name in results[0]
+    ]
+
+
+def run_benchmark_sync(ctx, pool, clock, benchname, ids,
+                       queryname) -> typing.List[Result]:
+    # The pool has exactly one worker per chunk of ids, and every chunk
+    # runs for the whole benchmark duration, so each worker picks up
+    # exactly one chunk.
+    with adaptive_control(ctx, clock, ctx.concurrency):
         tasks = []
         for i in range(ctx.concurrency):
-            task = e.submit(
+            task = pool.submit(
                 run_benchmark_method,
                 ctx,
-                benchname,
-                method_ids[chunk_len*i:chunk_len*(i+1)],
+                chunk_ids(ctx, ids, queryname, ctx.concurrency, i),
                 queryname)
             tasks.append(task)
 
         results = [fut.result() for fut in futures.wait(tasks).done]
 
-    return agg_results(results, benchname, queryname, ctx.duration)
+    return agg_workload_results(ctx, results, benchname)
 
 
-def do_run_benchmark_async(ctx, benchname, ids, iproc, queryname) -> Result:
-    method_ids = ids[queryname]
-    # We want to split the input ids into separate chunks, so that we
-    # avoid concurrent mutations of the same object.
-    proc_chunk_len = math.ceil(len(method_ids) / ctx.async_split)
-    method_ids = method_ids[proc_chunk_len*iproc:proc_chunk_len*(iproc+1)]
-    chunk_len = math.ceil(
-        len(method_ids) / (ctx.concurrency // ctx.async_split)
-    )
-
-    uvloop.install()
+def do_run_benchmark_async(ctx, ids, iproc, queryname):
+    proc_ids = chunk_ids(ctx, ids, queryname, ctx.async_split, iproc)
+    nconns = ctx.concurrency // ctx.async_split
 
     async def run():
-        tasks = []
-        for i in range(ctx.concurrency // ctx.async_split):
-            task = asyncio.create_task(
-                run_async_benchmark_method(
-                    ctx,
-                    benchname,
-                    method_ids[chunk_len*i:chunk_len*(i+1)],
-                    queryname))
-            tasks.append(task)
-
-        return await asyncio.gather(*tasks)
-
-    return asyncio.run(run())
-
-
-def run_benchmark_async(ctx, benchname, ids, queryname) -> Result:
-    # We want to split the input ids into separate chunks, so that we
-    # avoid concurrent mutations of the same object.
-    with futures.ProcessPoolExecutor(max_workers=ctx.async_split) as e:
+        conns = _worker_state.conns
+        workloads = [
+            Workload(
+                ctx,
+                _worker_state.queries_mod,
+                chunk_ids(ctx, proc_ids, queryname, nconns, i),
+                queryname)
+            for i in range(len(conns))
+        ]
+        await asyncio.gather(*[
+            collect_samples(conn, workload)
+            for conn, workload in zip(conns, workloads)
+        ])
+
+        # Blocks the loop, but all connections are idle by now.
+        start = synchronized_start(ctx)
+        return await asyncio.gather(*[
+            run_async_benchmark_method(ctx, conn, workload, start)
+            for conn, workload in zip(conns, workloads)
+        ])
+
+    return _worker_state.loop.run_until_complete(run())
+
+
+def run_benchmark_async(ctx, pool, clock, benchname, ids,
+                        queryname) -> typing.List[Result]:
+    nconns = ctx.concurrency // ctx.async_split * ctx.async_split
+    with adaptive_control(ctx, clock, nconns):
         tasks = []
         for i in range(ctx.async_split):
-            task = e.submit(
+            task = pool.submit(
                 do_run_benchmark_async,
                 ctx,
-                benchname,
                 ids,
                 i,
                 queryname)
             tasks.append(task)
 
-        results = [r for fut in futures.wait(tasks).done for r in fut.result()]
+        results = [
+            r for fut in futures.wait(tasks).done for r in fut.result()]
 
-    return agg_results(results, benchname, queryname, ctx.duration)
+    return agg_workload_results(ctx, results, benchname)
 
 
-def run_sync(ctx, benchname) -> typing.List[Result]:
+def run_sync(ctx, benchname, stream) -> typing.List[Result]:
     queries_mod = _shared.IMPLEMENTATIONS[benchname].module
     results = []
 
+    snapshot = _snapshot.prepare(ctx, benchname)
+
     if hasattr(queries_mod, 'init'):
         queries_mod.init(ctx)
     idconn = queries_mod.connect(ctx)
     ids = queries_mod.load_ids(ctx, idconn)
     queries_mod.close(ctx, idconn)
 
-    for queryname in ctx.queries:
-        # Potentially setup the benchmark state
-        conn = queries_mod.connect(ctx)
-        queries_mod.setup(ctx, conn, queryname)
-        queries_mod.close(ctx, conn)
-
-        res = run_benchmark_sync(ctx, benchname, ids, queryname)
-        results.append(res)
-        print_result(ctx, res)
-        queries_mod.close(ctx, conn)
-
-        # Potentially clean up after the benchmarks
-        conn = queries_mod.connect(ctx)
-        queries_mod.cleanup(ctx, conn, queryname)
-        queries_mod.close(ctx, conn)
+    nworkers = ctx.concurrency
+    dirty = False
+    with worker_pool(
+            ctx, benchname, nworkers, init_sync_worker) as (pool, clock):
+        for queryname in ctx.queries:
+            querynames = get_querynames(ctx, queryname)
+            restored = _snapshot.needs_restore(snapshot, querynames, dirty)
+            if restored:
+                restore_snapshot(ctx, pool, nworkers, snapshot)
+                dirty = _snapshot.mutates(querynames)
+            else:
+                # Potentially setup the benchmark state
+                conn = queries_mod.connect(ctx)
+                for q in querynames:
+                    queries_mod.setup(ctx, conn, q)
+                queries_mod.close(ctx, conn)
+
+            for res in run_benchmark_sync(
+                    ctx, pool, clock, benchname, ids, queryname):
+                report_result(ctx, res, stream)
+                results.append(res)
+
+            if not restored:
+                # Potentially clean up after the benchmarks
+                conn = queries_mod.connect(ctx)
+                for q in querynames:
+                    queries_mod.cleanup(ctx, conn, q)
+                queries_mod.close(ctx, conn)
+
+    if dirty:
+        # Leave the snapshot state behind for the next implementation.
+        snapshot.restore(ctx)
 
     return results
 
 
-def run_async(ctx, benchname) -> typing.List[Result]:
+def run_async(ctx, benchname, stream) -> typing.List[Result]:
     queries_mod = _shared.IMPLEMENTATIONS[benchname].module
     results = []
 
@@ -311,56 +847,115 @@ def run_async(ctx, benchname) -> typing.List[Result]:
         finally:
             await queries_mod.close(ctx, conn)
 
-    async def setup():
+    async def setup(querynames):
         if not hasattr(queries_mod, 'setup'):
             return
         conn = await queries_mod.connect(ctx)
         try:
-            return await queries_mod.setup(ctx, conn, queryname)
+            for q in querynames:
+                await queries_mod.setup(ctx, conn, q)
         finally:
             await queries_mod.close(ctx, conn)
 
-    async def cleanup():
+    async def cleanup(querynames):
         if not hasattr(queries_mod, 'cleanup'):
             return
         conn = await queries_mod.connect(ctx)
         try:
-            return await queries_mod.cleanup(ctx, conn, queryname)
+            for q in querynames:
+                await queries_mod.cleanup(ctx, conn, q)
         finally:
             await queries_mod.close(ctx, conn)
 
+    snapshot = _snapshot.prepare(ctx, benchname)
+
     uvloop.install()
     ids = asyncio.run(fetch_ids())
 
-    for queryname in ctx.queries:
-        # Potentially setup the benchmark state
-        asyncio.run(setup())
-
-        res = run_benchmark_async(ctx, benchname, ids, queryname)
-        results.append(res)
-        print_result(ctx, res)
-
-        # Potentially clean up after the benchmarks
-        asyncio.run(cleanup())
+    nworkers = ctx.async_split
+    dirty = False
+    with worker_pool(
+            ctx, benchname, nworkers, init_async_worker) as (pool, clock):
+        for queryname in ctx.queries:
+            querynames = get_querynames(ctx, queryname)
+            restored = _snapshot.needs_restore(snapshot, querynames, dirty)
+            if restored:
+                restore_snapshot(ctx, pool, nworkers, snapshot)
+                dirty = _snapshot.mutates(querynames)
+            else:
+                # Potentially setup the benchmark state
+                asyncio.run(setup(querynames))
+
+            for res in run_benchmark_async(
+                    ctx, pool, clock, benchname, ids, queryname):
+                report_result(ctx, res, stream)
+                results.append(res)
+
+            if not restored:
+                # Potentially clean up after the benchmarks
+                asyncio.run(cleanup(querynames))
+
+    if dirty:
+        # Leave the snapshot state behind for the next implementation.
+        snapshot.restore(ctx)
 
     return results
 
 
-def run_bench(ctx, benchname) -> typing.List[Result]:
+def run_bench(ctx, benchname, stream) -> typing.List[Result]:
     queries_mod = _shared.IMPLEMENTATIONS[benchname].module
     if getattr(queries_mod, 'ASYNC', False):
-        return run_async(ctx, benchname)
+        return run_async(ctx, benchname, stream)
     else:
-        return run_sync(ctx, benchname)
+        return run_sync(ctx, benchname, stream)
+
+
+def get_profile_filename(ctx, result: Result) -> str:
+    if ctx.profile_prefix:
+        prefix = ctx.profile_prefix
+    elif ctx.json:
+        prefix = os.path.splitext(ctx.json)[0]
+    else:
+        prefix = 'profile'
+    return f'{prefix}.{result.benchmark}.{result.queryname}.folded'
+
+
+def write_profile(ctx, result: Result):
+    filename = get_profile_filename(ctx, result)
+    _profiler.write_collapsed(result.profile, filename)
+    print(f'profile:\t{filename}')
+    print()
+
+
+def report_result(ctx, result: Result, stream):
+    print_result(ctx, result)
+    stream.write(result)
+    if result.profile is not None:
+        write_profile(ctx, result)
 
 
 def print_result(ctx, result: Result):
     print(f'== {result.benchmark} : {result.queryname} ==')
     print(f'queries:\t{result.nqueries}')
-    print(f'qps:\t\t{result.nqueries // ctx.duration} q/s')
-    print(f'min latency:\t{result.min_latency / 100:.2f}ms')
-    print(f'avg latency:\t{result.avg_latency / 100:.2f}ms')
-    print(f'max latency:\t{result.max_latency / 100:.2f}ms')
+    if ctx.adaptive:
+        print(f'warmup:\t\t{result.warmup_time:.0f}s')
+        print(f'duration:\t{result.duration:.1f}s')
+    print(f'qps:\t\t{int(result.nqueries / result.duration)} q/s')
+    if ctx.rate:
+        print(f'target rate:\t{ctx.rate} q/s')
+        print(f'achieved rate:\t{result.nqueries / result.duration:.2f} q/s')
+        print(f'backlog:\t{result.backlog}')
+    print(f'min latency:\t{result.min_latency / 1e6:.3f}ms')
+    print(f'avg latency:\t{result.avg_latency / 1e6:.3f}ms')
+    print(f'max latency:\t{result.max_latency / 1e6:.3f}ms')
+    if result.client_stats is not None and result.nqueries:
+        cs = result.client_stats
+        cpu = cs['cpu_ns'] / result.nqueries / 1e6
+        render = cs['render_ns'] / result.nqueries / 1e6
+        print(f'client cpu:\t{cpu:.3f}ms/q '
+              f'(render {render:.3f}ms, driver {cpu - render:.3f}ms)')
+        print(f'alloc peak:\t{cs["mem_peak_bytes"] / 1024:.1f}KiB '
+              f'({cs["mem_retained_blocks"]} blocks retained)')
     print()
 
 
@@ -375,48 +970,22 @@ def main():
     print(f'concurrency:\t{ctx.concurrency}')
     print(f'warmup time:\t{ctx.warmup_time} seconds')
     print(f'duration:\t{ctx.duration} seconds')
+    if ctx.adaptive:
+        print(f'adaptive:\tat least {ctx.min_duration} seconds, '
+              f'until the 95% CI is within {ctx.ci_width:.1%}')
+    if ctx.rate:
+        print(f'rate:\t\t{ctx.rate} q/s (open loop)')
     print(f'queries:\t{", ".join(q for q in ctx.queries)}')
     print(f'benchmarks:\t{", ".join(b for b in ctx.benchmarks)}')
     print()
 
-    data = []
-    for benchmark in ctx.benchmarks:
-        bench_desc = _shared.IMPLEMENTATIONS[benchmark]
-        if bench_desc.language != 'python':
-            continue
-
-        res = run_bench(ctx, benchmark)
-        data.append(res)
-
-    if ctx.json:
-        json_data = []
-        for results in data:
-            json_results = []
-            for r in results:
-                json_results.append({
-                    'queryname': r.queryname,
-                    'nqueries': r.nqueries,
-                    'min_latency': r.min_latency,
-                    'max_latency': r.max_latency,
-                    'latency_stats':
-                        [int(i) for i in r.latency_stats.tolist()],
-                    'samples': r.samples,
-                })
-            json_data.append({
-                'benchmark': results[0].benchmark,
-                'duration': results[0].duration,
-                'queries': json_results,
-            })
-
-        data = json.dumps({
-            'language': 'python',
-            'concurrency': ctx.concurrency,
-            'warmup_time': ctx.warmup_time,
-            'duration': ctx.duration,
-            'data': json_data,
-        })
-        with open(ctx.json, 'wt') as f:
-            f.write(data)
+    with _shared.ResultsStream(ctx, 'python', rate=ctx.rate) as stream:
+        for benchmark in ctx.benchmarks:
+            bench_desc = _shared.IMPLEMENTATIONS[benchmark]
+            if bench_desc.language != 'python':
+                continue
+
+            run_bench(ctx, benchmark, stream)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Compare two benchmark reports (``bench.py --json``).
+
+For every implementation and query in both reports, the changes in
+throughput, mean latency and latency percentiles are tested with a
+bootstrap confidence interval (see _stats.py).  The samples are the
+trials of reports made with ``--repeat``, or else the batch means of
+the per-second intervals of the measured window.  Reports made before
+the intervals had mean and p90 latency need ``--repeat`` for those.
+"""
+
+
+import argparse
+import json
+import sys
+
+import _stats
+
+
+# Metrics as (name, key in a report, percentile), and whether more is
+# better.
+METRICS = [
+    ('qps', 'qps', None, True),
+    ('mean', 'latency_mean', None, False),
+    ('p50', None, 50, False),
+    ('p90', None, 90, False),
+    ('p99', None, 99, False),
+]
+
+# Columns of the per-second time series rows, see bench.calc_timeseries().
+TIMESERIES_COLUMNS = {'qps': 1, 'p50': 2, 'p99': 3, 'mean': 5, 'p90': 6}
+
+
+def get_value(bench, key, percentile):
+    if key is not None:
+        return bench[key]
+    return dict(bench['latency_percentiles'])[percentile]
+
+
+def get_trials(bench, key, percentile):
+    trials = bench.get('trials')
+    if trials is None:
+        return None
+    if key is not None:
+        return trials[key]
+    return dict(trials['latency_percentiles'])[percentile]
+
+
+def get_intervals(bench, name):
+    column = TIMESERIES_COLUMNS.get(name)
+    rows = bench.get('timeseries')
+    if column is None or not rows or len(rows[0]) <= column:
+        return None
+    # Rows are stamped with the end of the interval, in seconds since
+    # the start of measurement.  Intervals without queries have no
+    # latency, but count for throughput.
+    return _stats.batch_means([
+        row[column] for row in rows
+        if 0 < row[0] <= bench['duration'] and (row[1] or name == 'qps')
+    ])
+
+
+def get_samples(base, new, name, key, percentile):
+    """Return comparable samples of a metric in *base* and *new*."""
+    a = get_trials(base, key, percentile)
+    b = get_trials(new, key, percentile)
+    if a is not None and b is not None:
+        return a, b
+    a = get_intervals(base, name)
+    b = get_intervals(new, name)
+    if a and b and len(a) + len(b) > 2:
+        return a, b
+    return None, None
+
+
+def compare(base_data, new_data, confidence):
+    """Yield a row of every metric of benchmarks in both reports."""
+    for queryname, benches in new_data['benchmarks'].items():
+        if queryname == 'mean' or queryname not in base_data['benchmarks']:
+            continue
+        base_benches = {
+            b['implementation']: b
+            for b in base_data['benchmarks'][queryname]
+        }
+        for new in benches:
+            base = base_benches.get(new['implementation'])
+            if base is None:
+                continue
+            for name, key, percentile, higher_is_better in METRICS:
+                a, b = get_samples(base, new, name, key, percentile)
+                if a is None:
+                    change = lo = hi = None
+                    verdict = 'n/a'
+                else:
+                    change, lo, hi = _stats.bootstrap_change(
+                        a, b, confidence=confidence)
+                    if lo > 0 or hi < 0:
+                        verdict = (
+                            'better' if (change > 0) == higher_is_better
+                            else 'worse')
+                    else:
+                        verdict = ''
+                yield dict(
+                    query=queryname,
+                    implementation=new['implementation'],
+                    metric=name,
+                    base=get_value(base, key, percentile),
+                    new=get_value(new, key, percentile),
+                    change=change,
+                    ci=None if change is None else (lo, hi),
+                    verdict=verdict,
+                )
+
+
+def format_row(row):
+    if row['change'] is None:
+        change = ci = ''
+    else:
+        change = f'{row["change"]:+.1%}'
+        ci = '[{:+.1%}, {:+.1%}]'.format(*row['ci'])
+    return (
+        f'{row["query"]:<22} {row["implementation"]:<28} '
+        f'{row["metric"]:<5} {row["base"]:>12} {row["new"]:>12} '
+        f'{change:>8} {ci:>18}  {row["verdict"]}'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Flag statistically significant differences between '
+                    'two benchmark reports')
+    parser.add_argument(
+        '--confidence', type=float, default=_stats.CONFIDENCE,
+        help='confidence level of the intervals of the changes')
+    parser.add_argument(
+        '--all', action='store_true',
+        help='also list the metrics without a significant change')
+    parser.add_argument(
+        '--fail-on-regression', action='store_true',
+        help='exit with status 1 if any metric got significantly worse')
+    parser.add_argument('base', help='JSON report to compare against')
+    parser.add_argument('new', help='JSON report to compare')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base_data = json.load(f)
+    with open(args.new) as f:
+        new_data = json.load(f)
+
+    print(f'{"query":<22} {"implementation":<28} {"":<5} {"base":>12} '
+          f'{"new":>12} {"change":>8} {"CI":>18}')
+    regressions = 0
+    for row in compare(base_data, new_data, args.confidence):
+        if row['verdict'] == 'worse':
+            regressions += 1
+        if args.all or row['verdict'] in {'better', 'worse'}:
+            print(format_row(row))
+
+    if args.fail_on_regression and regressions:
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
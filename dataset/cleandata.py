@@ -6,122 +6,370 @@
 ##
 
 
-import itertools
-import json
-import pathlib
-
-
-# Use a globally unique numeric ID, because that affords the most
-# compatibility with the different ORMs that we need to import data
-# into.
-gid = 0
-gid_map = {'user': {}, 'person': {}, 'movie': {}, 'review': {}}
-
-
-def new_id(oldid, cat):
-    global gid
-    global gid_map
-
-    gid += 1
-    gid_map[cat][oldid] = gid
-    return gid
+"""Turn the output of ``synth`` into the datasets used by the loaders.
 
+``protodataset.json`` is read in two streaming passes, so that memory
+use does not depend on the size of the records:
 
-def get_id(oldid, cat):
-    global gid_map
-    return gid_map[cat][oldid]
+1. every record is spooled to a per-type file on disk, keeping only its
+   id and a hash of its image in compact arrays;
+2. the spooled records are cleaned up and written one at a time to
+   ``edbdataset.json``, then renumbered and written to ``dataset.json``
+   and its columnar copy.
+"""
 
 
-def clean(data: dict):
-    directors = data.pop('director')
-    people = data['person']
-
-    # first record all directors
-    data['person'] = directors
-
-    # now add the rest of "person" records from the id > directors
-    lastid = directors[-1]['id']
-
-    data['person'].extend(
-        p for p in people if p['id'] > lastid
-    )
-
-    # Use '' instead of None for 'middle_name'
-    for rec in data['person']:
-        rec['middle_name'] = rec['middle_name'] or ''
+import array
+import json
+import pathlib
+import re
+import tempfile
+import typing
+
+import numpy as np
+
+import _columnar
+
+
+CHUNK_SIZE = 1 << 20
+
+_WS = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """Buffered reader of consecutive JSON tokens of a text file."""
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self) -> bool:
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError('unexpected end of JSON input')
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f'expected {char!r} in JSON input, '
+                             f'found {found!r}')
+        self.pos += 1
+
+    def value(self) -> typing.Tuple[typing.Any, str]:
+        """Decode the next value; return it along with its JSON text."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number at the end of the buffer might continue after it.
+            if end == len(self.buf) and not self.eof and self._fill():
+                continue
+            text = self.buf[self.pos:end]
+            self.pos = end
+            return obj, text
+
+
+def iter_arrays(f):
+    """Yield (key, value, text) for the items of {key: [value, ...]}."""
+    reader = _Reader(f)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        key, _ = reader.value()
+        reader.expect(':')
+        reader.expect('[')
+        if reader.peek() != ']':
+            while True:
+                yield (key, *reader.value())
+                if reader.peek() == ']':
+                    break
+                reader.expect(',')
+        reader.expect(']')
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+
+class JSONArrayWriter:
+    """Write the elements of a JSON array one at a time."""
+
+    def __init__(self, f):
+        self.f = f
+        self.first = True
+
+    def write(self, obj):
+        if not self.first:
+            self.f.write(', ')
+        self.first = False
+        self.f.write(json.dumps(obj))
+
+
+class Section:
+    """Records of one type, spooled to disk one JSON document per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self.ids = array.array('q')
+        # Hashes are only compared within this process, so the
+        # (randomized) built-in string hash will do.
+        self.images = array.array('q')
+        self._file = open(path, 'wt', newline='\n')
+
+    def append(self, rec: dict, text: str):
+        # Newlines can only be whitespace between JSON tokens.
+        self._file.write(text.replace('\n', ' '))
+        self._file.write('\n')
+        self.ids.append(rec['id'])
+        if 'image' in rec:
+            self.images.append(hash(rec['image']))
+
+    def close(self):
+        self._file.close()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        with open(self.path, 'rt', newline='\n') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def images_at(self, indexes: typing.List[int]):
+        """Yield the images of the records at sorted *indexes*."""
+        wanted = iter(indexes)
+        want = next(wanted, None)
+        if want is None:
+            return
+        with open(self.path, 'rt', newline='\n') as f:
+            for i, line in enumerate(f):
+                if i == want:
+                    yield json.loads(line)['image']
+                    want = next(wanted, None)
+                    if want is None:
+                        return
+
+
+def spool(f, spool_dir: pathlib.Path) -> typing.Dict[str, Section]:
+    sections = {}
+    for key, rec, text in iter_arrays(f):
+        section = sections.get(key)
+        if section is None:
+            section = sections[key] = Section(spool_dir / f'{key}.jsonl')
+        section.append(rec, text)
+
+    for section in sections.values():
+        section.close()
+    return sections
+
+
+class IdMap:
+    """Global ids of the records of one type, by their original id.
+
+    Two arrays replace a dict of Python ints: the sorted original ids
+    and the position of each of them in the output.
+    """
+
+    def __init__(self, old_ids: np.ndarray, base: int):
+        self.order = np.argsort(old_ids, kind='stable')
+        self.sorted_ids = old_ids[self.order]
+        self.base = base
+
+    def __len__(self):
+        return len(self.order)
+
+    def get(self, old_ids: typing.List[int]) -> typing.List[int]:
+        idx = np.searchsorted(self.sorted_ids, old_ids)
+        if len(idx) and (
+                idx.max() >= len(self.sorted_ids)
+                or (self.sorted_ids[idx] != old_ids).any()):
+            raise KeyError(f'unknown ids in {old_ids!r}')
+        return (self.base + self.order[idx]).tolist()
+
+
+class Plan(typing.NamedTuple):
+
+    # The person records, in order: (section, mask of the kept records).
+    people: typing.List[typing.Tuple[Section, typing.Optional[np.ndarray]]]
+    # (spooled type, index in its spool) -> suffix that makes the
+    # image unique.
+    renames: typing.Dict[typing.Tuple[str, int], int]
+
+
+def clean(sections: typing.Dict[str, Section]) -> Plan:
+    directors = sections.pop('director')
+    people = sections['person']
+
+    # First come all directors, then the rest of "person" records with
+    # the id > directors.
+    lastid = directors.ids[-1]
+    keep = np.frombuffer(people.ids, dtype=np.int64) > lastid
+    person_sources = [(directors, None), (people, keep)]
 
     # Check that we generated unique image names as we use that
     # fact when importing data into EdgeDB.
-    imgs = set()
-    for i, rec in enumerate(itertools.chain(
-            data['user'], data['person'], data['movie'])):
-        if rec['image'] in imgs:
-            rec['image'] = f"{rec['image'].split('.')[0]}-{i}.jpeg"
-
-        imgs.add(rec['image'])
-
-    return data
-
-
-def normalize(data: dict, appname='webapp'):
-    output = []
-
-    users = data['user']
-    reviews = data['review']
-    movies = data['movie']
-    people = data['person']
-
-    for p in people:
-        p['id'] = new_id(p['id'], 'person')
-        output.append({
-            'model': f'{appname}.person',
-            'fields': p
-        })
-
-    for u in users:
-        u['id'] = new_id(u['id'], 'user')
-        output.append({
-            'model': f'{appname}.user',
-            'fields': u
-        })
-
-    for m in movies:
+    chain = [(sections['user'], None), *person_sources,
+             (sections['movie'], None)]
+
+    hashes = []
+    positions = []
+    for section, mask in chain:
+        idx = np.arange(len(section))
+        images = np.frombuffer(section.images, dtype=np.int64)
+        if mask is not None:
+            idx, images = idx[mask], images[mask]
+        hashes.append(images)
+        positions.append((section, idx))
+
+    # Equal hashes only make candidates, the images themselves are
+    # compared in a pass over the records that share a hash.
+    hashes = np.concatenate(hashes)
+    _, first, counts = np.unique(
+        hashes, return_index=True, return_counts=True)
+    shared = np.isin(hashes, hashes[first[counts > 1]])
+    dups = np.zeros(len(hashes), dtype=bool)
+    seen = set()
+    offset = 0
+    for section, idx in positions:
+        where = np.flatnonzero(shared[offset:offset + len(idx)]).tolist()
+        images = section.images_at(idx[where].tolist())
+        for i, image in zip(where, images):
+            if image in seen:
+                dups[offset + i] = True
+            else:
+                seen.add(image)
+        offset += len(idx)
+
+    # Renames are keyed by the spool file, as directors are spooled
+    # apart from the rest of "person" records.
+    renames = {}
+    offset = 0
+    for section, idx in positions:
+        for i in np.flatnonzero(dups[offset:offset + len(idx)]).tolist():
+            renames[(section.path.stem, int(idx[i]))] = offset + i
+        offset += len(idx)
+
+    return Plan(people=person_sources, renames=renames)
+
+
+def _unique_image(rec, key, index, renames):
+    i = renames.get((key, index))
+    if i is not None:
+        rec['image'] = f"{rec['image'].split('.')[0]}-{i}.jpeg"
+
+
+def _people(plan: Plan):
+    """Yield the kept person records, in order."""
+    for section, mask in plan.people:
+        for i, p in enumerate(section):
+            if mask is not None and not mask[i]:
+                continue
+            # Use '' instead of None for 'middle_name'
+            p['middle_name'] = p['middle_name'] or ''
+            _unique_image(p, section.path.stem, i, plan.renames)
+            yield p
+
+
+def write_edb(sections: typing.Dict[str, Section], plan: Plan, edb_f):
+    # Sections are in the order of protodataset.json, without
+    # "director", as the EdgeDB loader reads them.
+    edb_f.write('{')
+    for n, key in enumerate(sections):
+        if n:
+            edb_f.write(', ')
+        edb_f.write(f'{json.dumps(key)}: [')
+        edb = JSONArrayWriter(edb_f)
+        if key == 'person':
+            for p in _people(plan):
+                edb.write(p)
+        else:
+            for i, rec in enumerate(sections[key]):
+                _unique_image(rec, key, i, plan.renames)
+                edb.write(rec)
+        edb_f.write(']')
+    edb_f.write('}')
+
+
+def normalize(sections: typing.Dict[str, Section], plan: Plan,
+              norm: JSONArrayWriter,
+              columnar: _columnar.DatasetWriter, appname='webapp'):
+    # Use a globally unique numeric ID, because that affords the most
+    # compatibility with the different ORMs that we need to import data
+    # into.
+    person_ids = np.concatenate([
+        np.frombuffer(sec.ids, dtype=np.int64)[
+            slice(None) if mask is None else mask]
+        for sec, mask in plan.people
+    ])
+    people = IdMap(person_ids, 1)
+    users = IdMap(
+        np.frombuffer(sections['user'].ids, dtype=np.int64),
+        people.base + len(people))
+    movies = IdMap(
+        np.frombuffer(sections['movie'].ids, dtype=np.int64),
+        users.base + len(users))
+    review_base = movies.base + len(movies)
+
+    def write(model, fields):
+        norm.write({'model': f'{appname}.{model}', 'fields': fields})
+        columnar.write(model, fields)
+
+    for gid, p in enumerate(_people(plan), people.base):
+        p['id'] = gid
+        write('person', p)
+
+    for i, u in enumerate(sections['user']):
+        _unique_image(u, 'user', i, plan.renames)
+        u['id'] = users.base + i
+        write('user', u)
+
+    for i, m in enumerate(sections['movie']):
+        _unique_image(m, 'movie', i, plan.renames)
         dirs = m.pop('directors')
         cast = m.pop('cast')
         origid = m['id']  # used later for deciding whether to have list_order
-
-        m['id'] = new_id(m['id'], 'movie')
-        output.append({
-            'model': f'{appname}.movie',
-            'fields': m
-        })
+        m['id'] = movies.base + i
+        write('movie', m)
 
         # the cast and directors need their own intermediate objects
-        for i, nid in enumerate(dirs):
-            output.append({
-                'model': f'{appname}.directors',
-                # don't care about the id for this
-                'fields': {
-                    'list_order': i,
-                    'person_id': get_id(nid, 'person'),
-                    'movie_id': m['id'],
-                }
+        for order, pid in enumerate(people.get(dirs)):
+            write('directors', {
+                'list_order': order,
+                'person_id': pid,
+                'movie_id': m['id'],
             })
 
-        for i, nid in enumerate(cast):
-            output.append({
-                'model': f'{appname}.cast',
-                # don't care about the id for this
-                'fields': {
-                    # only some movies will order cast
-                    'list_order': i if origid % 10 else None,
-                    'person_id': get_id(nid, 'person'),
-                    'movie_id': m['id'],
-                }
+        for order, pid in enumerate(people.get(cast)):
+            write('cast', {
+                # only some movies will order cast
+                'list_order': order if origid % 10 else None,
+                'person_id': pid,
+                'movie_id': m['id'],
             })
 
-    for i, r in enumerate(reviews):
-        r['author_id'] = get_id(r.pop('author'), 'user')
+    for i, r in enumerate(sections['review']):
+        r['author_id'], = users.get([r.pop('author')])
 
         # The first reviews just get linked to each movie in turn to
         # avoid having a Movie without reviews. This is to simplify
@@ -130,31 +378,31 @@ def normalize(data: dict, appname='webapp'):
         # it is to adjust all the benchmarks.
         r_id = r.pop('movie')
         if i < len(movies):
-            r['movie_id'] = get_id(i, 'movie')
+            r['movie_id'], = movies.get([i])
         else:
-            r['movie_id'] = get_id(r_id, 'movie')
+            r['movie_id'], = movies.get([r_id])
 
-        r['id'] = new_id(r['id'], 'review')
-        output.append({
-            'model': f'{appname}.review',
-            'fields': r
-        })
-
-    return output
+        r['id'] = review_base + i
+        write('review', r)
 
 
 def clean_json():
     build_path = pathlib.Path(__file__).resolve().parent / 'build'
-    with open(build_path / 'protodataset.json', 'rt') as f:
-        data = json.load(f)
 
-    with open(build_path / 'edbdataset.json', 'wt') as f:
-        data = clean(data)
-        f.write(json.dumps(data))
+    with tempfile.TemporaryDirectory(dir=build_path) as spool_dir:
+        with open(build_path / 'protodataset.json', 'rt') as f:
+            sections = spool(f, pathlib.Path(spool_dir))
+
+        plan = clean(sections)
+
+        with open(build_path / 'edbdataset.json', 'wt') as edb_f:
+            write_edb(sections, plan, edb_f)
 
-    with open(build_path / 'dataset.json', 'wt') as f:
-        data = normalize(data)
-        f.write(json.dumps(data))
+        with open(build_path / 'dataset.json', 'wt') as norm_f, \
+                _columnar.DatasetWriter(build_path / 'dataset') as columnar:
+            norm_f.write('[')
+            normalize(sections, plan, JSONArrayWriter(norm_f), columnar)
+            norm_f.write(']')
 
 
 if __name__ == '__main__':
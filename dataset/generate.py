@@ -0,0 +1,307 @@
+#
+# Copyright (c) 2021 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Generate the benchmark dataset without external tools.
+
+Records are produced in vectorized batches from a seeded random
+generator and streamed straight to ``build/edbdataset.json`` and
+``build/dataset.json`` (and its columnar copy in ``build/dataset/``),
+in the layouts that cleandata.py produces from the output of
+``synth``.  Memory use is bounded by the batch size, not by the size
+of the dataset.
+"""
+
+
+import argparse
+import json
+import pathlib
+
+import numpy as np
+from faker.providers.company.en_US import Provider as _company
+from faker.providers.person.en_US import Provider as _person
+
+import _columnar
+from cleandata import JSONArrayWriter
+
+
+BATCH_SIZE = 10_000
+
+FIRST_NAMES = np.array(list(_person.first_names), dtype=object)
+LAST_NAMES = np.array(list(_person.last_names), dtype=object)
+BS_WORDS = [np.array(words, dtype=object) for words in _company.bsWords]
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'), dtype=object)
+
+# Distributions of the dataset/templates used with synth.
+MIDDLE_NAME_P = [0.90, 0.07, 0.03]  # none, first name, initial
+RATING_P = np.array([20, 80, 200, 250, 275, 170]) / 995
+REVIEW_SENTENCES = np.array([1, 2, 3, 4, 5, 6, 7, 8, 9, 25])
+TWO_DIRECTORS_P = 0.05
+CAST_RANGE = (10, 55)
+YEAR_RANGE = (1950, 2015)
+REVIEW_TIME_RANGE = (1420070400, 1609459200)  # 2015-01-01 .. 2021-01-01
+
+# Odd and not divisible by 5, hence coprime with 10 ** 12: images
+# derived from consecutive ids with it are unique but look random.
+_IMAGE_STRIDE = 7_919_031_977
+
+
+def images(rng, prefix, ids):
+    letters = LETTERS[rng.integers(0, len(LETTERS), len(ids))]
+    numbers = (ids.astype(np.uint64) * _IMAGE_STRIDE) % 10 ** 12
+    return [
+        f'{prefix}{letter}{number:012d}.jpeg'
+        for letter, number in zip(letters, numbers.tolist())
+    ]
+
+
+def bs_phrases(rng, n):
+    verbs, adjectives, nouns = (
+        words[rng.integers(0, len(words), n)] for words in BS_WORDS)
+    return [
+        f'{v} {a} {noun}' for v, a, noun in zip(verbs, adjectives, nouns)
+    ]
+
+
+def paragraphs(rng, counts):
+    """Return one paragraph of counts[i] bs sentences for every i."""
+    sentences = [
+        f'{phrase.capitalize()}.'
+        for phrase in bs_phrases(rng, int(counts.sum()))
+    ]
+    bounds = np.concatenate(([0], np.cumsum(counts))).tolist()
+    return [
+        ' '.join(sentences[start:end])
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def gen_people(rng, start, n):
+    ids = np.arange(start, start + n)
+    first = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), n)]
+    last = LAST_NAMES[rng.integers(0, len(LAST_NAMES), n)]
+    middle_kind = rng.choice(3, n, p=MIDDLE_NAME_P).tolist()
+    middle_first = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), n)]
+    middle_initial = LETTERS[rng.integers(0, len(LETTERS), n)]
+    middle = [
+        ('', mf, f'{mi.upper()}.')[kind]
+        for kind, mf, mi in zip(middle_kind, middle_first, middle_initial)
+    ]
+    bios = paragraphs(rng, np.full(n, 5))
+
+    return [
+        {
+            'id': i,
+            'first_name': f,
+            'middle_name': m,
+            'last_name': la,
+            'image': img,
+            'bio': bio,
+        }
+        for i, f, m, la, img, bio in zip(
+            ids.tolist(), first, middle, last,
+            images(rng, 'p', ids), bios)
+    ]
+
+
+def gen_users(rng, start, n):
+    ids = np.arange(start, start + n)
+    first = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), n)]
+    suffix = rng.integers(0, 100, n)
+    return [
+        {'id': i, 'name': f'{f.lower()}{s:02d}', 'image': img}
+        for i, f, s, img in zip(
+            ids.tolist(), first, suffix.tolist(), images(rng, 'u', ids))
+    ]
+
+
+def gen_movies(rng, start, n, *, npeople, ndirectors):
+    ids = np.arange(start, start + n)
+    years = rng.integers(*YEAR_RANGE, n)
+    titles = bs_phrases(rng, n)
+    descriptions = paragraphs(rng, np.full(n, 20))
+
+    ndirs = 1 + (rng.random(n) < TWO_DIRECTORS_P)
+    directors = rng.integers(0, ndirectors, int(ndirs.sum()))
+    dir_bounds = np.concatenate(([0], np.cumsum(ndirs))).tolist()
+
+    ncast = rng.integers(*CAST_RANGE, n)
+    cast = rng.integers(0, npeople, int(ncast.sum()))
+    cast_bounds = np.concatenate(([0], np.cumsum(ncast))).tolist()
+
+    directors = directors.tolist()
+    cast = cast.tolist()
+    return [
+        {
+            'id': i,
+            'image': img,
+            'year': y,
+            'title': t,
+            'description': d,
+            'directors': directors[dir_bounds[k]:dir_bounds[k + 1]],
+            'cast': cast[cast_bounds[k]:cast_bounds[k + 1]],
+        }
+        for k, (i, img, y, t, d) in enumerate(zip(
+            ids.tolist(), images(rng, 'm', ids), years.tolist(), titles,
+            descriptions))
+    ]
+
+
+def gen_reviews(rng, start, n, *, nusers, nmovies):
+    ids = np.arange(start, start + n)
+    ratings = rng.choice(len(RATING_P), n, p=RATING_P)
+    bodies = paragraphs(rng, rng.choice(REVIEW_SENTENCES, n))
+    times = rng.integers(*REVIEW_TIME_RANGE, n).astype('datetime64[s]')
+    authors = rng.integers(0, nusers, n)
+    movies = rng.integers(0, nmovies, n)
+
+    return [
+        {
+            'id': i,
+            'rating': r,
+            'body': b,
+            'creation_time': f'{t}+00:00',
+            'author': a,
+            'movie': m,
+        }
+        for i, r, b, t, a, m in zip(
+            ids.tolist(), ratings.tolist(), bodies, times.astype(str),
+            authors.tolist(), movies.tolist())
+    ]
+
+
+class Normalizer:
+    """Streaming equivalent of cleandata.normalize().
+
+    Every record gets a globally unique id.  People come first, then
+    users, movies and reviews, so the global id of any record can be
+    derived from its original id and the number of records of each
+    preceding type.
+    """
+
+    def __init__(self, out: JSONArrayWriter,
+                 columnar: _columnar.DatasetWriter, *,
+                 npeople, nusers, nmovies, appname='webapp'):
+        self.out = out
+        self.columnar = columnar
+        self.appname = appname
+        self.person_base = 1
+        self.user_base = self.person_base + npeople
+        self.movie_base = self.user_base + nusers
+        self.review_base = self.movie_base + nmovies
+        self.nmovies = nmovies
+
+    def _write(self, model, fields):
+        self.out.write({'model': f'{self.appname}.{model}', 'fields': fields})
+        self.columnar.write(model, fields)
+
+    def person(self, p):
+        self._write('person', dict(p, id=self.person_base + p['id']))
+
+    def user(self, u):
+        self._write('user', dict(u, id=self.user_base + u['id']))
+
+    def movie(self, m):
+        fields = {k: v for k, v in m.items() if k not in ('directors', 'cast')}
+        fields['id'] = movie_id = self.movie_base + m['id']
+        self._write('movie', fields)
+
+        for i, pid in enumerate(m['directors']):
+            self._write('directors', {
+                'list_order': i,
+                'person_id': self.person_base + pid,
+                'movie_id': movie_id,
+            })
+
+        for i, pid in enumerate(m['cast']):
+            self._write('cast', {
+                # only some movies will order cast
+                'list_order': i if m['id'] % 10 else None,
+                'person_id': self.person_base + pid,
+                'movie_id': movie_id,
+            })
+
+    def review(self, r):
+        fields = {k: v for k, v in r.items() if k not in ('author', 'movie')}
+        fields['author_id'] = self.user_base + r['author']
+        # The first reviews are linked to each movie in turn, so that
+        # every movie has reviews; see cleandata.normalize().
+        movie = r['id'] if r['id'] < self.nmovies else r['movie']
+        fields['movie_id'] = self.movie_base + movie
+        fields['id'] = self.review_base + r['id']
+        self._write('review', fields)
+
+
+def generate(build_path: pathlib.Path, *, people, users, reviews,
+             seed=0, batch_size=BATCH_SIZE):
+    rng = np.random.default_rng(seed)
+    # about 7% of people are going to be directors
+    ndirectors = max(1, people * 7 // 100)
+    movies = max(1, people // 4)
+
+    with open(build_path / 'edbdataset.json', 'wt') as edb_f, \
+            open(build_path / 'dataset.json', 'wt') as norm_f, \
+            _columnar.DatasetWriter(build_path / 'dataset') as columnar:
+        norm_f.write('[')
+        norm = Normalizer(
+            JSONArrayWriter(norm_f), columnar,
+            npeople=people, nusers=users, nmovies=movies)
+
+        edb_f.write('{')
+        sections = [
+            ('person', people, gen_people, {}, norm.person),
+            ('user', users, gen_users, {}, norm.user),
+            ('movie', movies, gen_movies,
+             {'npeople': people, 'ndirectors': ndirectors}, norm.movie),
+            ('review', reviews, gen_reviews,
+             {'nusers': users, 'nmovies': movies}, norm.review),
+        ]
+        for i, (name, total, gen, kwargs, normalize) in enumerate(sections):
+            if i:
+                edb_f.write(', ')
+            edb_f.write(f'{json.dumps(name)}: [')
+            edb_out = JSONArrayWriter(edb_f)
+            for start in range(0, total, batch_size):
+                n = min(batch_size, total - start)
+                for rec in gen(rng, start, n, **kwargs):
+                    edb_out.write(rec)
+                    normalize(rec)
+            edb_f.write(']')
+            print(f'generated {total} {name} records')
+
+        edb_f.write('}')
+        norm_f.write(']')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Generate the benchmark dataset.')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiplier of the default record counts')
+    parser.add_argument('--people', type=int, default=100_000,
+                        help='number of people at scale 1')
+    parser.add_argument('--users', type=int, default=100_000,
+                        help='number of users at scale 1')
+    parser.add_argument('--reviews', type=int, default=500_000,
+                        help='number of reviews at scale 1')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed; equal seeds give equal datasets')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of records generated at once')
+
+    args = parser.parse_args()
+
+    build_path = pathlib.Path(__file__).resolve().parent / 'build'
+    build_path.mkdir(exist_ok=True)
+    generate(
+        build_path,
+        people=int(args.people * args.scale),
+        users=int(args.users * args.scale),
+        reviews=int(args.reviews * args.scale),
+        seed=args.seed,
+        batch_size=args.batch_size,
+    )
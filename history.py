@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+"""Query the history of benchmark results (see _history.py).
+
+    python history.py runs
+    python history.py trend --impl django --query get_movie --metric p99
+
+A trend only includes runs with the same platform, dataset, concurrency,
+rate and id distribution as the last run of the benchmark, unless
+``--all-configs`` is given.  The change over the runs is the least
+squares fit, relative to the mean, and it is flagged when it is worse
+than ``--threshold`` percent.
+"""
+
+
+import argparse
+import contextlib
+import json
+import pathlib
+import statistics
+import sys
+
+import jinja2
+
+import _history
+import _steady
+
+
+# Metrics where more is better.
+HIGHER_IS_BETTER = {'qps'}
+
+
+def print_runs(conn, limit):
+    rows = conn.execute(
+        '''
+        SELECT runs.*, count(results.run_id) AS nresults
+        FROM runs LEFT JOIN results ON results.run_id = runs.id
+        GROUP BY runs.id ORDER BY runs.id DESC LIMIT ?
+        ''',
+        (limit,),
+    ).fetchall()
+    print(f'{"run":>5}  {"date":<25} {"revision":<13} {"dataset":<16} '
+          f'{"conc":>5} {"results":>7}')
+    for row in reversed(rows):
+        rev = (row['git_rev'] or '-')[:12] + ('*' if row['git_dirty'] else '')
+        print(f'{row["id"]:>5}  {row["date"]:<25} {rev:<13} '
+              f'{row["dataset"] or "-":<16} {row["concurrency"]:>5} '
+              f'{row["nresults"]:>7}')
+
+
+def get_trends(conn, args):
+    """Return the trend of every selected benchmark."""
+    trends = []
+    for impl, query in _history.benchmarks(conn):
+        if args.impl and impl not in args.impl:
+            continue
+        if args.query and query not in args.query:
+            continue
+
+        config = None
+        if not args.all_configs:
+            config = _history.latest_config(conn, impl, query)
+        rows = _history.trend(
+            conn, impl, query, args.metric, config=config, limit=args.last)
+        values = [row['value'] for row in rows]
+
+        change = _steady.relative_trend(values) if len(values) > 1 else 0.0
+        worse = -change if args.metric in HIGHER_IS_BETTER else change
+        trends.append(dict(
+            implementation=impl,
+            query=query,
+            metric=args.metric,
+            change=change,
+            flagged=len(values) >= args.min_runs
+            and worse * 100 > args.threshold,
+            median=statistics.median(values) if values else None,
+            points=[
+                dict(
+                    run=row['run_id'],
+                    date=row['date'],
+                    rev=(row['git_rev'] or '')[:12]
+                    + ('*' if row['git_dirty'] else ''),
+                    value=row['value'],
+                )
+                for row in rows
+            ],
+        ))
+    return trends
+
+
+def print_trends(trends):
+    for t in trends:
+        flag = '  SLOWER' if t['flagged'] else ''
+        print(f'== {t["implementation"]} : {t["query"]} : {t["metric"]} '
+              f'({len(t["points"])} runs, {t["change"]:+.1%}){flag} ==')
+        for p in t['points']:
+            print(f'{p["run"]:>5}  {p["date"]:<25} {p["rev"]:<13} '
+                  f'{p["value"]:>12}')
+        print()
+
+
+def format_trends_html(trends, target_file):
+    tpl_dir = pathlib.Path(__file__).parent / 'docs'
+
+    env = jinja2.Environment(
+        loader=jinja2.FileSystemLoader(tpl_dir),
+    )
+    tpl = env.get_template('TREND.html')
+
+    queries = {}
+    for t in trends:
+        queries.setdefault(t['query'], []).append(t)
+
+    target_file.write(tpl.render(
+        __TREND_METRIC__=trends[0]['metric'] if trends else '',
+        __TREND_DATA__={q: json.dumps(v) for q, v in queries.items()},
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Query the history of benchmark results')
+    parser.add_argument(
+        '--db', default=_history.DEFAULT_PATH,
+        help='SQLite file with the history')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    runs = commands.add_parser('runs', help='list the recorded runs')
+    runs.add_argument(
+        '--limit', type=int, default=20,
+        help='number of most recent runs to list')
+
+    trend = commands.add_parser(
+        'trend', help='show a metric of benchmarks over time')
+    trend.add_argument(
+        '--impl', action='append',
+        help='implementation to show, e.g. "django"; all by default')
+    trend.add_argument(
+        '--query', action='append',
+        help='query to show, e.g. "get_movie"; all by default')
+    trend.add_argument(
+        '--metric', choices=list(_history.METRICS), default='qps',
+        help='metric to show, latencies are in milliseconds')
+    trend.add_argument(
+        '--last', type=int, default=0,
+        help='number of most recent runs to include; all by default')
+    trend.add_argument(
+        '--all-configs', action='store_true',
+        help='include runs with options other than the last run')
+    trend.add_argument(
+        '--threshold', type=float, default=5,
+        help='change over the runs, in percent, that is flagged if '
+             'for the worse')
+    trend.add_argument(
+        '--min-runs', type=int, default=3,
+        help='number of runs it takes to flag a trend')
+    trend.add_argument(
+        '--html', type=str, default='',
+        help='filename to dump a trend chart to')
+    trend.add_argument(
+        '--fail-on-slowdown', action='store_true',
+        help='exit with status 1 if any trend is flagged')
+
+    args = parser.parse_args()
+
+    with contextlib.closing(_history.connect(args.db)) as conn:
+        if args.command == 'runs':
+            print_runs(conn, args.limit)
+            return 0
+
+        trends = get_trends(conn, args)
+
+    print_trends(trends)
+    if args.html:
+        with open(args.html, 'wt') as f:
+            format_trends_html(trends, f)
+
+    if args.fail_on_slowdown and any(t['flagged'] for t in trends):
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+import argparse
+import subprocess
+import sys
+
+import _shared
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure the import time of benchmark implementations')
+    parser.add_argument(
+        'benchmarks', nargs='*', help='benchmarks names (default: all)')
+    args = parser.parse_args()
+
+    # No choices=: Python 3.11 checks the empty default against them.
+    unknown = [
+        b for b in args.benchmarks
+        if b != 'all' and b not in _shared.IMPLEMENTATIONS
+    ]
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(unknown)}')
+
+    benchmarks = args.benchmarks
+    if not benchmarks or 'all' in benchmarks:
+        benchmarks = list(_shared.IMPLEMENTATIONS.keys())
+
+    for benchname in benchmarks:
+        impl = _shared.IMPLEMENTATIONS[benchname]
+        try:
+            elapsed = _shared.measure_import_time(benchname)
+        except subprocess.CalledProcessError as e:
+            print(f'{benchname}:\timport failed', file=sys.stderr)
+            print(e.stderr, file=sys.stderr)
+            continue
+
+        if elapsed is None:
+            print(f'{benchname}:\t- ({impl.language} runner)')
+        else:
+            print(f'{benchname}:\t{elapsed * 1000:.1f}ms '
+                  f'({impl.module_name})')
+
+
+if __name__ == '__main__':
+    main()
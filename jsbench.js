@@ -99,6 +99,30 @@ function _now() {
   return s * 1000000 + Math.round(ns / 1000);
 }
 
+// Latencies in the time series are bucketed like in _histogram.py:
+// every value keeps its SUB_BUCKET_BITS most significant bits.
+const SUB_BUCKET_BITS = 8;
+
+function bucketIndex(value) {
+  var shift = 0;
+  while (value >= 2 ** (SUB_BUCKET_BITS + shift)) {
+    shift += 1;
+  }
+  if (shift == 0) {
+    return value;
+  }
+  return shift * 2 ** (SUB_BUCKET_BITS - 1) + Math.floor(value / 2 ** shift);
+}
+
+// Encode every interval as a list of [bucket index, count] pairs.
+function encodeTimeseries(timeseries) {
+  return timeseries.map(function (counts) {
+    return Array.from(counts.entries()).sort(function (a, b) {
+      return a[0] - b[0];
+    });
+  });
+}
+
 async function runner(args, app) {
   var timeoutInMicroSecs = args.timeout * 1000000;
 
@@ -109,6 +133,18 @@ async function runner(args, app) {
   var latencyStats = null;
   var data = null;
   var samples = [];
+  // Per-second latency bucket counts, since the start of the warmup.
+  var timeseries = [];
+  var benchStart = null;
+
+  function recordTimeseries(now, reqTimeInMicroSecs) {
+    var idx = Math.floor((now - benchStart) / 1000000);
+    while (timeseries.length <= idx) {
+      timeseries.push(new Map());
+    }
+    var bucket = bucketIndex(reqTimeInMicroSecs * 1000);
+    timeseries[idx].set(bucket, (timeseries[idx].get(bucket) || 0) + 1);
+  }
 
   var ids = (await app.getIDs(args.number_of_ids))[args.query];
   if (ids.length > args.number_of_ids) {
@@ -154,6 +190,7 @@ async function runner(args, app) {
         max_latency: maxLatency,
         latency_stats: Array.prototype.slice.call(latencyStats),
         samples: samples.slice(0, args.nsamples),
+        timeseries: encodeTimeseries(timeseries),
       };
       console.log(JSON.stringify(data));
     }
@@ -161,6 +198,9 @@ async function runner(args, app) {
 
   async function doRun(app, query, concurrency, runDuration, report, nsamples) {
     var runStart = _now();
+    if (benchStart === null) {
+      benchStart = runStart;
+    }
 
     async function queryRunner(app) {
       var queries = 0;
@@ -184,8 +224,11 @@ async function runner(args, app) {
           samples.push(data);
         }
 
+        var reqEnd = _now();
+        recordTimeseries(reqEnd, reqEnd - reqStart);
+
         // Request time in tens of microseconds
-        reqTime = Math.round((_now() - reqStart) / 10);
+        reqTime = Math.round((reqEnd - reqStart) / 10);
 
         if (reqTime > maxLatency) {
           maxLatency = reqTime;
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#
+# Copyright (c) 2019 MagicStack Inc.
+# All rights reserved.
+#
+# See LICENSE for details.
+##
+
+
+import copy
+import datetime
+import json
+import math
+import os.path
+import sys
+
+import _shared
+import bench
+
+
+def _p99(stats):
+    return dict(stats['latency_percentiles'])[99]
+
+
+def _round_concurrency(args, concurrency):
+    # Concurrency must stay a multiple of --async-split.
+    return math.ceil(concurrency / args.async_split) * args.async_split
+
+
+def get_profile_prefix(args):
+    if args.profile_prefix:
+        return args.profile_prefix
+    elif args.json:
+        return os.path.splitext(args.json)[0]
+    else:
+        return 'profile'
+
+
+def make_argv(args, benchname, queries, concurrency, rate):
+    argv = [
+        '--concurrency', concurrency,
+        '--async-split', args.async_split,
+        '--db-host', args.db_host,
+        '--duration', args.duration,
+        '--timeout', args.timeout,
+        '--warmup-time', args.warmup_time,
+        '--net-latency', args.net_latency,
+        '--pg-port', args.pg_port,
+        '--mongodb-port', args.mongodb_port,
+        '--number-of-ids', args.number_of_ids,
+    ]
+
+    if args.edgedb_port is not None:
+        argv.extend(('--edgedb-port', args.edgedb_port))
+
+    if args.resample_ids:
+        argv.append('--resample-ids')
+
+    if args.adaptive:
+        argv.extend((
+            '--adaptive',
+            '--min-duration', args.min_duration,
+            '--ci-width', args.ci_width,
+        ))
+
+    if rate:
+        argv.extend(('--rate', rate))
+
+    if args.reset != 'cleanup':
+        argv.extend(('--reset', args.reset))
+
+    if args.instrument:
+        argv.append('--instrument')
+
+    if args.profile:
+        # Keep the profiles of every step.
+        step = f'r{rate:g}' if rate else f'c{concurrency}'
+        argv.extend((
+            '--profile', '--profile-prefix',
+            f'{get_profile_prefix(args)}.{step}'))
+
+    if not args.id_distribution.uniform:
+        argv.extend(('--id-distribution', args.id_distribution))
+
+    if args.mix:
+        argv.extend(('--mix', _shared.format_mix(args.mix)))
+    else:
+        for queryname in queries:
+            argv.extend(('--query', queryname))
+
+    argv.append(benchname)
+
+    return [str(a) for a in argv]
+
+
+def sweep_implementation(args, benchname):
+    """Sweep a single implementation.
+
+    Concurrency (or the target --rate, in open-loop mode) is increased
+    geometrically until every query either breaks the p99 objective or
+    stops gaining throughput, or its driver fails.  Returns a dict
+    mapping query names to the list of per-step stats, as produced by
+    bench.calc_latency_stats(), each extended with the step's
+    concurrency and rate, along with whether the driver failed.
+    """
+    concurrency = _round_concurrency(args, args.concurrency)
+    rate = args.rate
+
+    steps = {}
+    best_qps = {}
+    pending = list(args.queries)
+    failed = False
+
+    for _ in range(args.max_steps):
+        if not pending or concurrency > args.max_concurrency:
+            break
+
+        step_args = copy.copy(args)
+        step_args.benchmarks = [benchname]
+        step_args.queries = pending
+        step_args.concurrency = concurrency
+        step_args.rate = rate
+        # The profile prefix is passed on by make_argv().
+        step_args.profile_prefix = get_profile_prefix(args)
+        argv = make_argv(args, benchname, pending, concurrency, rate)
+
+        try:
+            data = bench.run_benchmarks(step_args, argv)
+        except bench.DriverError as e:
+            # Keep what the step did measure, but don't push a failing
+            # implementation any further.
+            print(f'{benchname}: {e}, stopping the sweep', file=sys.stderr)
+            data = e.results
+            failed = True
+
+        saturated = []
+        for queryname in pending:
+            if not data.get(queryname):
+                # No result, e.g. the driver failed before the query.
+                saturated.append(queryname)
+                continue
+            stats = dict(data[queryname][0])
+            stats['concurrency'] = concurrency
+            stats['rate'] = rate
+            steps.setdefault(queryname, []).append(stats)
+
+            prev_best = best_qps.get(queryname, 0)
+            if _p99(stats) > args.slo_p99:
+                saturated.append(queryname)
+            elif stats['qps'] < prev_best * (1 + args.min_gain):
+                saturated.append(queryname)
+                best_qps[queryname] = max(prev_best, stats['qps'])
+            else:
+                best_qps[queryname] = stats['qps']
+
+        pending = [q for q in pending if q not in saturated]
+        if failed:
+            break
+
+        if rate:
+            rate = rate * args.sweep_factor
+        else:
+            concurrency = _round_concurrency(
+                args,
+                max(concurrency + 1,
+                    math.ceil(concurrency * args.sweep_factor)))
+
+    return steps, failed
+
+
+def pick_sustainable(args, steps):
+    """Pick the highest-throughput step that met the latency objective.
+
+    If no step did, the first (lowest load) step is reported with a
+    ``max_sustainable_qps`` of zero.
+    """
+    within_slo = [s for s in steps if _p99(s) <= args.slo_p99]
+    if within_slo:
+        best = dict(max(within_slo, key=lambda s: s['qps']))
+        best['max_sustainable_qps'] = best['qps']
+    else:
+        best = dict(steps[0])
+        best['max_sustainable_qps'] = 0
+    # Steps of different implementations ran at different rates, so
+    # there is no single target rate to mark in the report.
+    best.pop('target_rate', None)
+    return best
+
+
+def print_summary(args, benchmarks):
+    print('============ Sweep summary ============')
+    print(f'p99 objective:\t{args.slo_p99}ms')
+    print()
+    for queryname in args.queries:
+        print(f'== {queryname} ==')
+        for stats in benchmarks.get(queryname, []):
+            where = (
+                f'rate {stats["rate"]:g} q/s'
+                if stats['rate']
+                else f'concurrency {stats["concurrency"]}'
+            )
+            print(f'{stats["implementation"]}:\t'
+                  f'{stats["max_sustainable_qps"]} q/s ({where}, '
+                  f'p99 {_p99(stats)}ms)')
+        print()
+
+
+def main():
+    args, _ = _shared.parse_args(
+        prog_desc='EdgeDB Databases Benchmark (latency vs throughput sweep)',
+        out_to_html=True,
+        out_to_json=True,
+        sweep=True)
+
+    if args.rate:
+        # Only the Python runners support open-loop load generation.
+        skipped = [
+            b for b in args.benchmarks
+            if _shared.IMPLEMENTATIONS[b].language != 'python'
+        ]
+        if skipped:
+            print(f'--rate is not supported by: {", ".join(skipped)}; '
+                  f'skipping', file=sys.stderr)
+        args.benchmarks = [b for b in args.benchmarks if b not in skipped]
+
+    if any(b.startswith('edgedb') for b in args.benchmarks):
+        if not bench.init_edgedb_instance(args, []):
+            return 1
+
+    exitcode = 0
+    sweep_data = {}
+    benchmarks = {}
+    for benchname in args.benchmarks:
+        title = _shared.IMPLEMENTATIONS[benchname].title
+        steps, failed = sweep_implementation(args, benchname)
+        if failed:
+            exitcode = 1
+        sweep_data[title] = steps
+        for queryname in args.queries:
+            if queryname not in steps:
+                # Not a single step produced a result.
+                continue
+            benchmarks.setdefault(queryname, []).append(
+                pick_sustainable(args, steps[queryname]))
+
+    print_summary(args, benchmarks)
+
+    if args.rate:
+        load = f'{args.concurrency}'
+    else:
+        load = f'{args.concurrency}..{args.max_concurrency} (swept)'
+
+    report_data = {
+        'date': datetime.datetime.now().strftime('%c'),
+        'duration': args.duration,
+        'netlatency': args.net_latency,
+        'platform': bench.platform_info(),
+        'concurrency': load,
+        'rate': f'{args.rate:g}.. (swept)' if args.rate else 0,
+        'id_distribution': str(args.id_distribution),
+        'slo_p99': args.slo_p99,
+        'benchmarks': bench.mean_latency_stats(benchmarks),
+        'benchmarks_desc': _shared.benchmark_descriptions(args),
+        'implementations': [
+            _shared.IMPLEMENTATIONS[benchname].title
+            for benchname in args.benchmarks
+        ],
+        'sweep': sweep_data,
+    }
+
+    if args.html:
+        with open(args.html, 'wt') as f:
+            bench.format_report_html(report_data, f)
+
+    if args.json:
+        with open(args.json, 'wt') as f:
+            f.write(json.dumps(report_data))
+
+    return exitcode
+
+
+if __name__ == '__main__':
+    sys.exit(main())